@@ -0,0 +1,290 @@
+# bench_server.py
+# Micro-benchmarks hors-ligne du serveur (aucun socket ouvert).
+# Usage: python bench_server.py [chunks|grid|sim|collide|save|flow|lod|entities] ...   (sans argument: tout)
+import sys, time, random, json, tracemalloc
+import server_game as S
+import wire
+
+def bench_chunks(n=200):
+    # Parité (aussi vérifiée par test_chunks.py): le générateur vectorisé doit reproduire exactement le générateur de référence
+    rnd = random.Random(7)
+    coords = [(0, 0), (1, -1), (-1, 1)] + [(rnd.randint(-5000, 5000), rnd.randint(-5000, 5000)) for _ in range(n)]
+    if S.np is None:
+        print("[chunks] NumPy absent: parité non vérifiée (générateur pur Python seul)")
+    else:
+        bad = [c for c in coords if S._chunk_bytes(S.generate_chunk(*c)) != S._chunk_bytes(S._generate_chunk_py(*c))]
+        print(f"[chunks] parité: {len(coords) - len(bad)}/{len(coords)} identiques" + (f" — différences: {bad[:5]}" if bad else ""))
+    for label, fn in (("python", S._generate_chunk_py), ("vectorisé", S.generate_chunk)):
+        t0 = time.perf_counter()
+        for c in coords:
+            fn(*c)
+        dt = time.perf_counter() - t0
+        print(f"[chunks] {label:10s} {len(coords)/dt:8.1f} chunks/s")
+
+def _brute_radius(store, x, y, r):
+    return sorted(k for k, e in store.items() if S.dist(x, y, e["x"], e["y"]) <= r)
+
+def _brute_nearest(store, x, y, max_r):
+    best, best_d = None, max_r
+    for k, e in store.items():
+        d = S.dist(x, y, e["x"], e["y"])
+        if d < best_d: best, best_d = k, d
+    return best
+
+def bench_grid(sizes=(1000, 10000), n_players=100, n_projs=200, span=20000):
+    # Monde synthétique: N mobs et n_players joueurs répartis sur span x span px
+    for n in sizes:
+        rnd = random.Random(n)
+        npcs = {i: {"x": rnd.uniform(0, span), "y": rnd.uniform(0, span)} for i in range(1, n + 1)}
+        players = {i: {"x": rnd.uniform(0, span), "y": rnd.uniform(0, span), "dead": False} for i in range(1, n_players + 1)}
+        projs = [(rnd.uniform(0, span), rnd.uniform(0, span)) for _ in range(n_projs)]
+        t0 = time.perf_counter()
+        ngrid = S.SpatialHash(npcs); pgrid = S.SpatialHash(players)
+        for k, e in npcs.items(): ngrid.insert(k, e["x"], e["y"])
+        for k, e in players.items(): pgrid.insert(k, e["x"], e["y"])
+        t_build = time.perf_counter() - t0
+        # parité avec les parcours linéaires d'origine
+        bad = sum(pgrid.nearest(e["x"], e["y"], 160)[0] != _brute_nearest(players, e["x"], e["y"], 160) for e in list(npcs.values())[:500])
+        bad += sum(ngrid.query_radius(x, y, 300) != _brute_radius(npcs, x, y, 300) for x, y in projs[:50])
+        def tick_brute():
+            for e in npcs.values(): _brute_nearest(players, e["x"], e["y"], 160)   # IA mobs
+            for x, y in projs: _brute_radius(npcs, x, y, 18)                       # impacts
+            for p in players.values(): _brute_radius(npcs, p["x"], p["y"], S.AOI_RADIUS)  # AOI
+        def tick_grid():
+            for k, e in npcs.items():
+                pgrid.nearest(e["x"], e["y"], 160); ngrid.move(k, e["x"] + 1, e["y"])
+            for x, y in projs: ngrid.query_radius(x, y, 18)
+            for p in players.values(): ngrid.query_radius(p["x"], p["y"], S.AOI_RADIUS)
+        res = {}
+        for label, fn in (("linéaire", tick_brute), ("grille", tick_grid)):
+            t0 = time.perf_counter(); fn(); res[label] = time.perf_counter() - t0
+        print(f"[grid] {n:6d} mobs: construction {t_build*1000:6.1f} ms, tick linéaire {res['linéaire']*1000:8.1f} ms, "
+              f"grille {res['grille']*1000:6.1f} ms (x{res['linéaire']/res['grille']:.0f}), écarts de parité: {bad}")
+
+SIM_T0 = 1_000_000.0
+
+def _sim_world(numpy_mode, n_mobs, n_players, n_projs, seed=3, span=6000):
+    # remet l'état global du serveur à un monde synthétique reproductible
+    S.SIM_NUMPY = numpy_mode
+    for store, grid in ((S.players, S.player_grid), (S.npcs, S.npc_grid), (S.items, S.item_grid)):
+        store.clear(); grid.clear()
+    S.projs = S.ProjectileStore() if numpy_mode else {}
+    S.proj_grid = S.projs if numpy_mode else S.SpatialHash(S.projs)
+    S.next_item_id = S.next_npc_id = S.next_proj_id = 1
+    S.dormant.clear(); S.lod_stats["asleep"] = 0
+    S._lod.update(ticks=0, step=0, mid=[[] for _ in range(S.LOD_MID_EVERY)], active=set())
+    rnd = random.Random(seed); random.seed(seed)  # random_free_pos/spawn tirent sur le module random
+    for pid in range(1, n_players + 1):
+        x, y = S.random_free_pos(rnd.randint(-span, span), rnd.randint(-span, span), 4)
+        p = S.base_player(f"P{pid}", x, y); p["class"] = rnd.choice(("Mage", "Guerrier", "Voleur"))
+        S.players[pid] = p; S.player_grid.insert(pid, x, y)
+    for _ in range(n_mobs):
+        # la moitié des mobs autour des joueurs, le reste dispersé
+        c = S.players[rnd.randint(1, n_players)] if rnd.random() < 0.5 else {"x": rnd.randint(-span, span), "y": rnd.randint(-span, span)}
+        S.spawn_mob_at(*S.random_free_pos(c["x"], c["y"], 5))
+    clock, S.now = S.now, lambda: SIM_T0  # expire_at reproductibles
+    for _ in range(n_projs):
+        pid = rnd.randint(1, n_players); p = S.players[pid]
+        S.spawn_projectile(pid, p["x"], p["y"], p["x"] + rnd.uniform(-100, 100), p["y"] + rnd.uniform(-100, 100),
+                           {"speed": 12, "dmg": 15, "ttl": 1.0 + rnd.random()})
+    S.now = clock
+
+def _sim_run(numpy_mode, n_mobs, n_players, n_projs, steps):
+    _sim_world(numpy_mode, n_mobs, n_players, n_projs)
+    random.seed(11)
+    digests = []; work = 0.0
+    for i in range(steps):
+        w0 = time.perf_counter()
+        S.logic_step(SIM_T0 + i / S.TICK_HZ)
+        work += time.perf_counter() - w0
+        digests.append(json.dumps([S.players, S.npcs, dict(S.projs.items()), S.items], sort_keys=True, default=wire.json_default))
+    return digests, work / steps
+
+def bench_sim(sizes=((1000, 50, 1000), (10000, 200, 5000)), steps=30):
+    if S.np is None:
+        print("[sim] NumPy absent: rien à comparer"); return
+    for n_mobs, n_players, n_projs in sizes:
+        ref, t_py = _sim_run(False, n_mobs, n_players, n_projs, steps)
+        out, t_np = _sim_run(True, n_mobs, n_players, n_projs, steps)
+        same = sum(a == b for a, b in zip(ref, out))
+        print(f"[sim] {n_mobs:6d} mobs {n_players:4d} joueurs {n_projs:5d} projectiles: dicts {t_py*1000:7.1f} ms/pas, "
+              f"numpy {t_np*1000:7.1f} ms/pas (x{t_py/t_np:.1f}), snapshots identiques {same}/{steps}")
+    S.SIM_NUMPY = True
+
+def _colliding_ref(cx, cy, w, h):
+    # version d'origine: get_tile_at + is_blocking_tile sur chaque tuile couverte
+    x0 = int((cx - w/2) // S.TILE); y0 = int((cy - h/2) // S.TILE)
+    x1 = int((cx + w/2) // S.TILE); y1 = int((cy + h/2) // S.TILE)
+    return any(S.is_blocking_tile(S.get_tile_at(tx, ty)) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1))
+
+def bench_collide(n=200000, span=20000):
+    rnd = random.Random(5)
+    rects = [(rnd.uniform(-span, span), rnd.uniform(-span, span), rnd.choice((10, 20, 22, 120))) for _ in range(n)]
+    for x, y, s in rects: S.get_chunk(int(x // S.TILE // S.CHUNK_TILES), int(y // S.TILE // S.CHUNK_TILES))  # préchauffage
+    bad = sum(S.is_colliding_rect(x, y, s, s) != _colliding_ref(x, y, s, s) for x, y, s in rects[:20000])
+    # rectangles à cheval sur les bords de chunks (négatifs compris)
+    edge = S.TILE * S.CHUNK_TILES
+    bad += sum(S.is_colliding_rect(k * edge + d, j * edge + e, 30, 30) != _colliding_ref(k * edge + d, j * edge + e, 30, 30)
+               for k in range(-3, 3) for j in range(-3, 3) for d in (-15, -5, 0, 5) for e in (-15, 0, 15))
+    res = {}
+    for label, fn in (("tuiles", _colliding_ref), ("masques", S.is_colliding_rect)):
+        t0 = time.perf_counter()
+        for x, y, s in rects: fn(x, y, s, s)
+        res[label] = time.perf_counter() - t0
+    tiles, mask = S._chunk_entry(0, 0)
+    per_chunk = sys.getsizeof(tiles) + sys.getsizeof(mask) + sys.getsizeof((tiles, mask))
+    lists = sys.getsizeof([]) * 65 + 8 * 4096  # ancien list[list[int]] (petits entiers partagés)
+    print(f"[collide] {n} tests: tuiles {n/res['tuiles']:9.0f}/s, masques {n/res['masques']:9.0f}/s "
+          f"(x{res['tuiles']/res['masques']:.1f}), écarts: {bad}; mémoire/chunk {per_chunk} o (listes: ~{lists} o)")
+
+def bench_save(n_users=20000, n_dirty=2000):
+    # Temps de lock tenu par une sauvegarde: ancien json.dump complet vs snapshot des lignes modifiées
+    import tempfile, os
+    d = tempfile.mkdtemp()
+    S.ACCOUNTS_DB_PATH = os.path.join(d, "accounts.db"); S._db = None
+    S.accounts = {"users": {}}
+    for i in range(n_users):
+        ch = {"id": "1", "name": f"H{i}", "class": "Mage", "level": 1, "x": i, "y": -i, "stats": {"str": 5, "int": 5, "agi": 5, "sta": 5},
+              "inventory": [{"id": 100011, "name": "Petite potion", "type": "potion", "power": 30}] * 8}
+        S.accounts["users"][f"u{i}"] = {"password": "h", "characters": {"1": ch}, "next_char_id": 2}
+        S.mark_dirty(f"u{i}"); S.mark_dirty(f"u{i}", "1")
+    S.save_accounts()  # écriture initiale
+    t0 = time.perf_counter(); json.dumps(S.accounts, indent=2, ensure_ascii=False); full = (time.perf_counter() - t0) * 1000
+    for i in range(n_dirty):
+        p = {"name": f"H{i}", "level": 2, "x": 1, "y": 2, "stats": {"str": 6, "int": 5, "agi": 5, "sta": 5}, "equipment": {}}
+        S.persist_player_to_character(f"u{i}", "1", p, [])
+    n = S.save_accounts()
+    S._db.close(); S._db = None; S.accounts = {"users": {}}; S.load_accounts()
+    ok = sum(S.accounts["users"][f"u{i}"]["characters"]["1"]["level"] == 2 for i in range(n_dirty))
+    print(f"[save] {n_users} comptes, {n} lignes modifiées: lock {S.save_stats['hold_last_ms']:.2f}ms, "
+          f"écriture {S.save_stats['last_ms']:.1f}ms hors lock (ancien json.dump complet sous lock: ~{full:.0f}ms + disque); "
+          f"relues {ok}/{n_dirty}")
+
+def _chase(mx, my, px, py, steps=400, speed=2.0):
+    n, target = {"x": mx, "y": my}, {"x": px, "y": py}
+    for _ in range(steps):
+        vx = px - n["x"]; vy = py - n["y"]
+        b = S.math.hypot(vx, vy)
+        if b <= 28:
+            return True
+        vx, vy, l = S._steer(n, target, vx, vy, b or 1)
+        n["x"], n["y"] = S.move_with_collisions(n["x"], n["y"], speed * vx / l, speed * vy / l, S.NPC_SIZE)
+    return False
+
+def bench_flow(n=300, span=40000):
+    # Poursuites dont la ligne droite traverse un mur: combien de mobs rejoignent leur cible
+    rnd = random.Random(11); cases = []
+    while len(cases) < n:
+        px, py = S.random_free_pos(rnd.randint(-span, span), rnd.randint(-span, span), 4)
+        mx, my = px + rnd.randint(-4, 4) * S.TILE, py + rnd.randint(-4, 4) * S.TILE
+        if S.is_colliding_rect(mx, my, S.NPC_SIZE, S.NPC_SIZE) or S.dist(mx, my, px, py) > 160:
+            continue
+        steps = 16
+        if any(S.is_blocking_tile(S.get_tile_at(int((mx + (px - mx) * k / steps) // S.TILE), int((my + (py - my) * k / steps) // S.TILE)))
+               for k in range(steps + 1)):
+            cases.append((mx, my, px, py))
+    res = {}
+    for label, on in (("ligne droite", False), ("champ de flux", True)):
+        S.FLOW_FIELDS = on; S.flow_cache.clear()
+        t0 = time.perf_counter()
+        res[label] = (sum(_chase(*c) for c in cases), time.perf_counter() - t0)
+    S.FLOW_FIELDS = True; S.flow_cache.clear()
+    t0 = time.perf_counter()
+    for mx, my, px, py in cases: S._flow_build(int(px // S.TILE), int(py // S.TILE))
+    per = (time.perf_counter() - t0) / len(cases) * 1000
+    print(f"[flow] {len(cases)} poursuites derrière un mur: " + ", ".join(f"{k} {v[0]}/{len(cases)} arrivés ({v[1]:.2f}s)" for k, v in res.items())
+          + f"; BFS {2*S.FLOW_RADIUS+1}x{2*S.FLOW_RADIUS+1} = {per:.2f} ms")
+
+def bench_lod(totals=(2000, 20000, 100000), n_players=20, near=300, span=300000, steps=40):
+    # Pas de simulation à population fixe autour des joueurs, avec de plus en plus de mobs ailleurs
+    for total in totals:
+        _sim_world(S.np is not None, 0, n_players, 0, span=span)
+        rnd = random.Random(5)
+        for i in range(total):
+            c = S.players[rnd.randint(1, n_players)] if i < near else {"x": rnd.randint(-span, span), "y": rnd.randint(-span, span)}
+            S.spawn_mob_at(*S.random_free_pos(c["x"], c["y"], 5))
+        S.lod_pass()
+        t0 = time.perf_counter()
+        for i in range(steps):
+            S.logic_step(SIM_T0 + i / S.TICK_HZ)
+        dt = (time.perf_counter() - t0) / steps
+        print(f"[lod] {total:6d} mobs: {dt*1000:6.2f} ms/pas; actifs={S.lod_stats['active']} intermédiaires={S.lod_stats['mid']} "
+              f"endormis={S.lod_stats['asleep']}")
+    S.SIM_NUMPY = True
+
+def _per_entity_bytes(make, n):
+    tracemalloc.start()
+    objs = [make(i) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(objs)
+
+def _frozen_encoded(e):
+    kind = {S.Player: "players", S.Mob: "npcs", S.Item: "items"}[type(e)]
+    wire.encode({"type": "state", "seq": 1, "full": True, kind: {"1": e.frozen()}}, wire.PROTO_BIN)
+    wire.encode({"type": "state", "seq": 1, "full": True, kind: {"1": e.frozen()}}, wire.PROTO_JSON)
+    return e
+
+def _entity_snapshots(ents, freeze, rnd, n_clients, moving, rounds):
+    # rounds ticks: une fraction des entités bouge, puis un snapshot complet par client et par protocole
+    ids = list(ents); frames = []; t = 0.0
+    for seq in range(rounds):
+        for k in rnd.sample(ids, int(len(ids) * moving)):
+            e = ents[k]; e["x"] = e["x"] + 1
+        t0 = time.perf_counter()
+        for _ in range(n_clients):
+            view = {str(k): freeze(e) for k, e in ents.items()}
+            msg = {"type": "state", "seq": seq + 1, "full": True, "players": {}, "npcs": view, "items": {}, "projs": {}}
+            frames = [wire.encode(msg, proto) for proto in wire.PROTOS]
+        t += time.perf_counter() - t0
+    return t / (rounds * n_clients), frames
+
+def _shown_bytes(mob, n, shown):
+    # n mobs tous diffusés une fois, puis une fraction seulement: mémoire par mob avant et après
+    # drop_unshown_frozen (formes figées des mobs sortis des vues)
+    _sim_world(S.np is not None, 0, 0, 0)
+    def show(ids):
+        S.snapshot_seq += S.ID_STEP
+        msg = {"type": "state", "seq": S.snapshot_seq, "full": True, **S._freeze_view({"npcs": {i: S.npcs[i] for i in ids}})}
+        for proto in wire.PROTOS: wire.encode(msg, proto)
+    tracemalloc.start()
+    for i in range(n): S.npcs[i] = S.Mob(mob(i))
+    show(range(n)); show(range(int(n * shown)))
+    kept = tracemalloc.get_traced_memory()[0]
+    S.drop_unshown_frozen()
+    dropped = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    S.npcs.clear()
+    return kept / n, dropped / n
+
+def bench_entities(n=10000, n_clients=10, moving=0.1, rounds=5):
+    # Mémoire par entité (dict d'origine / classe à __slots__) et encodage d'un snapshot complet de
+    # n mobs dont une fraction bouge à chaque tick: copie + json.dumps à chaque fois, ou forme figée
+    # partagée dont les fragments encodés sont réutilisés
+    random.seed(1)
+    tpl = [S.make_mob_template() for _ in range(n)]
+    mob = lambda i: {"x": i * 40, "y": -i * 40, "dx": 0, "dy": 0, "last_hit_by": None, **tpl[i]}
+    item = lambda i: {"x": i * 40, "y": i * 40, "name": "Petite potion", "type": "potion", "power": 30}
+    for label, as_dict, as_slots in (("mob", mob, lambda i: S.Mob(mob(i))), ("objet", item, lambda i: S.Item(item(i))),
+                                     ("joueur", lambda i: S.base_player(f"P{i}", i, i).to_dict(), lambda i: S.base_player(f"P{i}", i, i))):
+        d, sl = _per_entity_bytes(as_dict, n), _per_entity_bytes(as_slots, n)
+        fr = _per_entity_bytes(lambda i: _frozen_encoded(as_slots(i)), n)
+        print(f"[entities] {label:6s}: dict {d:6.0f} o/entité, slots {sl:6.0f} o/entité ({(1 - sl / d) * 100:.0f}% de moins), "
+              f"slots + forme figée encodée {fr:6.0f} o/entité")
+    kept, dropped = _shown_bytes(mob, n, moving)
+    print(f"[entities] {n} mobs diffusés puis {moving:.0%} encore en vue: formes figées gardées {kept:6.0f} o/mob, "
+          f"jetées hors vue {dropped:6.0f} o/mob")
+    res = {}
+    for label, make, freeze in (("dicts", mob, S._copy_entity), ("slots", lambda i: S.Mob(mob(i)), S._freeze_entity)):
+        ents = {i: make(i) for i in range(n)}
+        res[label] = _entity_snapshots(ents, freeze, random.Random(2), n_clients, moving, rounds)
+    (t_d, f_d), (t_s, f_s) = res["dicts"], res["slots"]
+    print(f"[entities] snapshot complet de {n} mobs ({moving:.0%} bougent par tick, json + bin1): dicts {t_d*1000:6.1f} ms, "
+          f"slots+cache {t_s*1000:6.1f} ms (x{t_d/t_s:.1f}); octets identiques: {f_d == f_s}")
+
+BENCHES = {"chunks": bench_chunks, "grid": bench_grid, "sim": bench_sim, "collide": bench_collide, "save": bench_save, "flow": bench_flow, "lod": bench_lod, "entities": bench_entities}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        BENCHES[name]()
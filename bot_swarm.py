@@ -0,0 +1,247 @@
+# bot_swarm.py
+# Essaim de bots sans affichage pour charger server_game.py (ou router.py): chaque bot parle le
+# vrai protocole (register/login -> create_character -> enter_world -> move/cast/pickup/chat),
+# tous dans un seul processus asyncio. Les bots arrivent par paliers (--ramp par seconde) et un
+# rapport périodique donne, pour le nombre de bots actifs: débit, latence entrée -> état
+# (p50/p90/p99), cadence des états, octets reçus par client. Avec --spawn, le serveur est lancé
+# ici et ses lignes [STATS] de ticks (retards, dépassements, pas_max) sont intercalées.
+# Usage: python bot_swarm.py --bots 200 --ramp 20 [--duration 60] [--proto bin1] [--spawn]
+import asyncio, argparse, json, random, time, sys, os, tempfile
+import wire
+
+HOST = "127.0.0.1"
+PORT = 5555
+ACT_HZ = 10             # actions par seconde et par bot
+SPEED = 4               # comme client.py
+REPORT_EVERY = 5.0
+JOIN_TIMEOUT = 10.0
+ECHO_TIMEOUT = 1.0      # mouvement resté sans écho (mur, mort): abandonné, compté "bloqué"
+CLASSES = ("Guerrier", "Mage", "Voleur")
+CHAT_LINES = ("salut", "quelqu'un pour le donjon ?", "lag ?", "gg")
+
+stats = {"active": 0, "failed": 0, "dropped": 0, "msgs_in": 0, "msgs_out": 0, "bytes_in": 0,
+         "bytes_out": 0, "states": 0, "blocked": 0}
+window = {"lat": [], "gaps": [], "join": []}  # échantillons de la fenêtre de rapport courante
+bots = []
+
+def pct(vals, q):
+    if not vals:
+        return float("nan")
+    s = sorted(vals)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+def _decode(raw):
+    return json.loads(raw) if raw[:1] == b"{" else wire.decode_frame(raw[4:])
+
+class Bot:
+    def __init__(self, i, proto, tag):
+        self.name = f"bot{tag}_{i}"
+        self.want_proto = proto
+        self.proto = wire.PROTO_JSON  # jusqu'au login_ok
+        self.r = self.w = None
+        self.me = None; self.pos = (0, 0); self.cls = None
+        self.heading = (SPEED, 0)
+        self.pending = None     # instant du premier mouvement pas encore vu dans un état
+        self.last_state = None
+        self.rx = 0
+
+    async def send(self, obj):
+        data = wire.encode(obj, self.proto)
+        self.w.write(data)
+        stats["msgs_out"] += 1; stats["bytes_out"] += len(data)
+        await self.w.drain()
+
+    async def recv(self):
+        while True:
+            raw = await wire.read_raw_async(self.r)
+            if raw is None:
+                raise ConnectionError("connexion fermée par le serveur")
+            self.rx += len(raw); stats["bytes_in"] += len(raw); stats["msgs_in"] += 1
+            try:
+                return _decode(raw)
+            except ValueError:
+                continue
+
+    async def expect(self, *types):
+        while True:
+            msg = await self.recv()
+            if msg.get("type") in types:
+                return msg
+
+    async def join(self):
+        self.r, self.w = await asyncio.open_connection(HOST, PORT)
+        creds = {"username": self.name, "password": "bot", "proto": self.want_proto}
+        await self.send({"type": "register", **creds})
+        msg = await self.expect("login_ok", "login_error")
+        if msg["type"] == "login_error":  # compte laissé par un essai précédent
+            await self.send({"type": "login", **creds})
+            msg = await self.expect("login_ok", "login_error")
+            if msg["type"] == "login_error":
+                raise ConnectionError(msg.get("msg"))
+        self.proto = msg.get("proto", wire.PROTO_JSON)
+        chars = msg.get("characters") or []
+        if not chars:
+            await self.send({"type": "create_character", "name": self.name, "class": random.choice(CLASSES)})
+            chars = (await self.expect("characters"))["characters"]
+        await self.send({"type": "enter_world", "char_id": chars[0]["id"]})
+        msg = await self.expect("welcome", "enter_error")
+        if msg["type"] == "enter_error":
+            raise ConnectionError(msg.get("msg"))
+        self.me = str(msg["your_id"])
+        you = msg.get("you") or {}
+        self.pos = (you.get("x", 0), you.get("y", 0)); self.cls = you.get("class")
+
+    async def read_loop(self):
+        while True:
+            msg = await self.recv()
+            if msg.get("type") == "state":
+                self.on_state(msg)
+                await self.send({"type": "ack", "seq": msg["seq"]})
+
+    def on_state(self, msg):
+        t = time.perf_counter()
+        stats["states"] += 1
+        if self.last_state is not None:
+            window["gaps"].append(t - self.last_state)
+        self.last_state = t
+        ps = msg.get("players") or {}
+        me = ps.get(self.me) or ps.get(int(self.me)) or {}
+        if "x" in me or "y" in me:  # delta: la position n'y figure que si elle a changé
+            self.pos = (me.get("x", self.pos[0]), me.get("y", self.pos[1]))
+            if self.pending is not None:
+                window["lat"].append(t - self.pending)
+                self.pending = None
+
+    async def act_loop(self):
+        while True:
+            await asyncio.sleep(random.uniform(0.8, 1.2) / ACT_HZ)
+            t = time.perf_counter()
+            if self.pending is not None and t - self.pending > ECHO_TIMEOUT:
+                stats["blocked"] += 1; self.pending = None
+                self.heading = (random.choice((-SPEED, 0, SPEED)), random.choice((-SPEED, SPEED)))
+            r = random.random()
+            if r < 0.8:
+                if random.random() < 0.05:
+                    self.heading = (random.choice((-SPEED, 0, SPEED)), random.choice((-SPEED, SPEED)))
+                await self.send({"type": "move", "dx": self.heading[0], "dy": self.heading[1]})
+                if self.pending is None:
+                    self.pending = t
+            elif r < 0.9:
+                x, y = self.pos
+                await self.send({"type": "cast", "slot": random.randint(1, 4),
+                                 "tx": x + random.uniform(-200, 200), "ty": y + random.uniform(-200, 200)})
+            elif r < 0.98:
+                await self.send({"type": "pickup"})
+            else:
+                await self.send({"type": "chat", "msg": random.choice(CHAT_LINES)})
+
+    async def run(self, stop):
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.join(), JOIN_TIMEOUT)
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats["failed"] += 1
+            if self.w: self.w.close()
+            return
+        window["join"].append(time.perf_counter() - t0)
+        stats["active"] += 1
+        tasks = [asyncio.create_task(self.read_loop()), asyncio.create_task(self.act_loop()),
+                 asyncio.create_task(stop.wait())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for tk in pending:
+            tk.cancel()
+        if not stop.is_set():
+            stats["dropped"] += 1  # coupé par le serveur avant la fin
+        stats["active"] -= 1
+        self.w.close()
+
+def _ms(v):
+    return f"{v * 1000:6.1f}"
+
+async def report_loop(t_start):
+    prev = dict(stats); t_prev = time.perf_counter()
+    print(" temps  bots | msg/s in  out |  Ko/s in | o/s/bot | lat p50   p90   p99 (ms) | "
+          "cadence p50   p99 | bloqués échecs coupés")
+    while True:
+        await asyncio.sleep(REPORT_EVERY)
+        t = time.perf_counter(); dt = t - t_prev
+        cur = dict(stats); lat, gaps = window["lat"], window["gaps"]
+        window["lat"], window["gaps"] = [], []
+        d = {k: cur[k] - prev[k] for k in cur}
+        per_bot = d["bytes_in"] / dt / max(1, cur["active"])
+        print(f"{t - t_start:6.0f} {cur['active']:5d} | {d['msgs_in']/dt:8.0f} {d['msgs_out']/dt:4.0f} | "
+              f"{d['bytes_in']/dt/1024:8.1f} | {per_bot:7.0f} | "
+              f"{_ms(pct(lat, .5))}{_ms(pct(lat, .9))}{_ms(pct(lat, .99))}      | "
+              f"{_ms(pct(gaps, .5))}{_ms(pct(gaps, .99))} | {d['blocked']:7d} {cur['failed']:6d} {cur['dropped']:6d}")
+        prev, t_prev = cur, t
+
+def summary():
+    rx = sorted(b.rx for b in bots if b.me is not None)
+    joins = window["join"]
+    print(f"[ESSAIM] {len(rx)} bots entrés, {stats['failed']} échecs, {stats['dropped']} coupés; "
+          f"entrée en jeu p50={_ms(pct(joins, .5)).strip()}ms p99={_ms(pct(joins, .99)).strip()}ms; "
+          f"octets reçus/bot min={rx[0] if rx else 0} médian={pct(rx, .5) if rx else 0} max={rx[-1] if rx else 0}")
+
+async def _echo_server(proc):
+    # ne garder que la santé du serveur: ticks et envoi
+    while True:
+        line = await proc.stdout.readline()
+        if not line:
+            return
+        s = line.decode("utf-8", "replace").rstrip()
+        if s.startswith(("[STATS] ticks", "[STATS] envoi", "[STATS] profil", "[TICK LENT]", "[PROFIL]")) or "Traceback" in s:
+            print("   serveur", s[8:] if s.startswith("[STATS]") else s)
+
+async def spawn_server(mode):
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-u", os.path.join(here, "server_game.py"), "--host", HOST, "--port", str(PORT),
+        "--mode", mode, "--max-conn", "100000", "--stats-every", str(REPORT_EVERY),
+        cwd=tempfile.mkdtemp(prefix="swarm_"),  # comptes jetables
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            _, w = await asyncio.open_connection(HOST, PORT); w.close(); break
+        except OSError:
+            await asyncio.sleep(0.1)
+    asyncio.create_task(_echo_server(proc))
+    return proc
+
+async def main(args):
+    proc = await spawn_server(args.mode) if args.spawn else None
+    stop = asyncio.Event(); tag = f"{int(time.time()) % 100000}"
+    t_start = time.perf_counter()
+    reporter = asyncio.create_task(report_loop(t_start))
+    runs = []
+    try:
+        for i in range(args.bots):
+            b = Bot(i, args.proto, tag); bots.append(b)
+            runs.append(asyncio.create_task(b.run(stop)))
+            await asyncio.sleep(1.0 / args.ramp)
+        await asyncio.sleep(max(0.0, args.duration - (time.perf_counter() - t_start)))
+    finally:
+        stop.set()
+        await asyncio.gather(*runs, return_exceptions=True)
+        reporter.cancel()
+        summary()
+        if proc:
+            proc.terminate(); await proc.wait()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Essaim de bots de charge pour le serveur MMO-lite")
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--bots", type=int, default=100)
+    ap.add_argument("--ramp", type=float, default=10.0, help="bots lancés par seconde")
+    ap.add_argument("--duration", type=float, default=60.0, help="durée totale du test (s)")
+    ap.add_argument("--proto", choices=wire.PROTOS, default=wire.PROTO_BIN)
+    ap.add_argument("--act-hz", type=float, default=ACT_HZ, help="actions par seconde et par bot")
+    ap.add_argument("--report-every", type=float, default=REPORT_EVERY)
+    ap.add_argument("--spawn", action="store_true", help="lancer server_game.py ici (dossier temporaire)")
+    ap.add_argument("--mode", choices=("threads", "asyncio"), default="asyncio", help="mode du serveur lancé par --spawn")
+    args = ap.parse_args()
+    HOST, PORT, ACT_HZ, REPORT_EVERY = args.host, args.port, args.act_hz, args.report_every
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
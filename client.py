@@ -1,5 +1,11 @@
 # client.py
-import socket, threading, json, pygame, time, os, math, copy
+import socket, threading, json, pygame, time, os, math, copy, base64
+from collections import OrderedDict
+import wire
+try:
+    import numpy as np  # optionnel: aperçus de la carte via pygame.surfarray
+except ImportError:
+    np = None
 
 SERVER_HOST = "127.0.0.1"
 SERVER_PORT = 5555
@@ -8,10 +14,25 @@ PLAYER_NAME = "Héros"
 WIDTH, HEIGHT = 960, 720
 SPEED = 4
 
-players = {}   # "pid" -> {...}
-npcs = {}      # "nid" -> {...}
-items = {}     # "iid" -> {...}
-projs = {}     # "id"  -> {...}
+class WorldSnapshot:
+    """Un état du monde tel que le rendu le lit: construit par le thread réseau (clés déjà en str,
+    joueur local déjà repéré) puis jamais modifié. Le thread réseau publie chaque nouvel état en
+    remplaçant latest_world (une affectation, atomique); la boucle de rendu le reprend une fois par
+    image dans world et parcourt ses dicts sans copie ni verrou, sans jamais voir d'état à moitié
+    appliqué. Les entités inchangées sont partagées d'un snapshot à l'autre (copie sur écriture
+    dans apply_state)."""
+    __slots__ = ("seq", "players", "npcs", "items", "projs", "me")
+
+    def __init__(self, seq=None, players=None, npcs=None, items=None, projs=None, you=None):
+        self.seq = seq
+        self.players = players or {}   # "pid" -> {...}
+        self.npcs = npcs or {}         # "nid" -> {...}
+        self.items = items or {}       # "iid" -> {...}
+        self.projs = projs or {}       # "id"  -> {...}
+        self.me = self.players.get(str(you)) if you is not None else None
+
+latest_world = WorldSnapshot()   # dernier état publié par le thread réseau
+world = latest_world             # état de l'image en cours (thread de rendu)
 your_id = None
 
 TILE = 40; GRID_W = 0; GRID_H = 0
@@ -31,6 +52,17 @@ def get_tile(tx, ty):
     if 0 <= ly < CHUNK_TILES and 0 <= lx < CHUNK_TILES:
         return ch[ly][lx]
     return 0
+
+def decode_chunk(entry):
+    # "rle": paires (compte, valeur) en base64 -> 64 lignes de bytes (ch[ly][lx] -> int)
+    if entry.get("enc") == "rle":
+        raw = base64.b64decode(entry.get("data", ""))
+        buf = bytearray()
+        for i in range(0, len(raw) - 1, 2):
+            buf.extend(bytes((raw[i+1],)) * raw[i])
+        buf = bytes(buf)
+        return [buf[i*CHUNK_TILES:(i+1)*CHUNK_TILES] for i in range(CHUNK_TILES)]
+    return entry.get("tiles", [])
 SPELLS = {}
 
 inventory = []; inv_open = False; inv_sel = 0
@@ -58,9 +90,10 @@ def load_config():
                 data = json.load(f)
             keys = {**DEFAULT_KEYS, **data.get("keys", {})}
             hud_scale = data.get("hud_scale","large")
-            return {"keys": keys, "hud_scale": hud_scale}
+            proto = data.get("proto", wire.PROTO_BIN)
+            return {"keys": keys, "hud_scale": hud_scale, "proto": proto}
         except: pass
-    cfg = {"keys": DEFAULT_KEYS, "hud_scale":"large"}
+    cfg = {"keys": DEFAULT_KEYS, "hud_scale":"large", "proto": wire.PROTO_BIN}
     with open(CONFIG_PATH,"w",encoding="utf-8") as f:
         json.dump(cfg, f, indent=2, ensure_ascii=False)
     return cfg
@@ -68,9 +101,10 @@ def load_config():
 CONFIG = load_config()
 HUD_SCALE = CONFIG.get("hud_scale","large")
 KEYS = CONFIG["keys"]
+WIRE_PROTO = CONFIG.get("proto", wire.PROTO_BIN)  # "json" pour lire le trafic en clair
 def save_config():
     with open(CONFIG_PATH,"w",encoding="utf-8") as f:
-        json.dump({"keys": KEYS, "hud_scale": HUD_SCALE}, f, indent=2, ensure_ascii=False)
+        json.dump({"keys": KEYS, "hud_scale": HUD_SCALE, "proto": WIRE_PROTO}, f, indent=2, ensure_ascii=False)
 
 def keyconst(name): return getattr(pygame, name, None)
 def pressed(name):
@@ -81,12 +115,51 @@ def key_is(event_key, name):
     return (kc is not None) and (event_key == kc)
 
 # ---- Réseau ----
+_send_lock = threading.Lock()  # boucle de rendu et thread réseau (acks) écrivent sur le même socket
+send_proto = wire.PROTO_JSON   # passe au protocole négocié à la réception de login_ok
 def send_json(conn, obj):
+    # JSON ligne ou trame bin1 selon le protocole négocié
     try:
-        conn.sendall((json.dumps(obj) + "\n").encode("utf-8"))
+        data = wire.encode(obj, send_proto)
+        with _send_lock:
+            conn.sendall(data)
     except Exception as e:
         print("send_json error:", e)
 
+# Snapshots delta: on garde les derniers états reconstruits pour servir de base aux deltas
+STATE_KINDS = ("players", "npcs", "items", "projs")
+STATE_HISTORY = 64
+state_hist = OrderedDict()  # seq -> {kind: {id: entity}}
+
+def apply_state(data):
+    """Reconstruit l'état complet à partir d'un message "state" (complet ou delta) et l'acquitte.
+    Renvoie None si la base est inconnue (une resynchronisation est alors demandée)."""
+    seq = data.get("seq")
+    if seq is None or data.get("full"):
+        st = {kind: {str(k): v for k, v in data.get(kind, {}).items()} for kind in STATE_KINDS}
+    else:
+        base = state_hist.get(data.get("base"))
+        if base is None:
+            send_json(sock, {"type":"resync"})
+            return None
+        removed = data.get("removed", {})
+        st = {}
+        for kind in STATE_KINDS:
+            ents = dict(base[kind])
+            for k in removed.get(kind, []):
+                ents.pop(str(k), None)
+            for k, d in data.get(kind, {}).items():
+                prev = ents.get(str(k))
+                # copie sur écriture: les états précédents de l'historique restent intacts
+                ents[str(k)] = {**prev, **d} if prev is not None else d
+            st[kind] = ents
+    if seq is not None:
+        state_hist[seq] = st
+        while len(state_hist) > STATE_HISTORY:
+            state_hist.popitem(last=False)
+        send_json(sock, {"type":"ack", "seq": seq})
+    return st
+
 FX = []  # effets visuels temporaires
 tooltip = {"txt": None, "until": 0.0, "pos": (0,0)}
 
@@ -110,19 +183,20 @@ create_msg = ""
 
 def network_thread(sock):
     global your_id, TILE, GRID_W, GRID_H, inventory, SPELLS
-    global UI_STATE, char_list, char_sel, login_msg, char_msg, create_msg
+    global UI_STATE, char_list, char_sel, login_msg, char_msg, create_msg, send_proto, latest_world
     try:
-        f = sock.makefile("r")
-        for line in f:
-            try: data = json.loads(line)
-            except: continue
+        f = sock.makefile("rb")
+        while True:
+            data = wire.read_msg(f)
+            if data is None: break
+            if not isinstance(data, dict): continue
             t = data.get("type")
             if t == "welcome":
                 your_id = data.get("your_id")
                 TILE = int(data.get("tile", TILE)); GRID_W = int(data.get("grid_w", GRID_W)); GRID_H = int(data.get("grid_h", GRID_H))
                 inventory = data.get("inventory", [])
                 you = data.get("you"); 
-                if you: players[str(your_id)] = you
+                if you: latest_world = WorldSnapshot(players={str(your_id): you}, you=your_id)
                 sp = data.get("spells", {})
                 # normaliser les clés en str pour l'UI des sorts
                 try:
@@ -131,6 +205,8 @@ def network_thread(sock):
                     SPELLS = sp
                 UI_STATE = "game"
             elif t == "login_ok":
+                if data.get("proto") in wire.PROTOS:
+                    send_proto = data["proto"]
                 lst = data.get("characters", [])
                 char_list = lst
                 char_sel = 0
@@ -152,15 +228,21 @@ def network_thread(sock):
             elif t == "enter_error":
                 char_msg = data.get("msg", "Erreur d'entrée")
             elif t == "state":
-                players.clear(); players.update({str(k):v for k,v in data.get("players",{}).items()})
-                npcs.clear();    npcs.update({str(k):v for k,v in data.get("npcs",{}).items()})
-                items.clear();   items.update({str(k):v for k,v in data.get("items",{}).items()})
-                projs.clear();   projs.update(data.get("projs",{}))
+                st = apply_state(data)
+                if st is not None:
+                    latest_world = WorldSnapshot(data.get("seq"), you=your_id, **st)
+            elif t == "aoi":
+                # entités sorties de la zone d'intérêt: oublier leur position lissée
+                leave = data.get("leave", {})
+                for k in leave.get("players", []): render_pos_players.pop(str(k), None)
+                for k in leave.get("npcs", []):    render_pos_npcs.pop(str(k), None)
             elif t == "chunks":
                 for entry in data.get("list", []):
                     cx = int(entry.get("cx")); cy = int(entry.get("cy"))
-                    loaded_chunks[(cx,cy)] = entry.get("tiles", [])
+                    loaded_chunks[(cx,cy)] = decode_chunk(entry)
                     requested_chunks.discard((cx,cy))
+                    invalidate_chunk_blocks(cx, cy)
+                    invalidate_chunk_overview(cx, cy)
             elif t == "inventory":
                 inventory = data.get("inventory", inventory)
             elif t == "chat":
@@ -185,6 +267,32 @@ clock = pygame.time.Clock()
 font = pygame.font.SysFont(None, 18)
 bigfont = pygame.font.SysFont(None, 22)
 
+# ---- Cache des textes ----
+# font.render est coûteux et la plupart des textes (noms, HUD, chat, menus) ne changent pas d'une
+# image à l'autre: surfaces gardées en LRU par (police, texte, couleur). Compteurs par image
+# affichés par l'overlay de debug (F3).
+TEXT_CACHE_MAX = 512
+text_cache = OrderedDict()                # (police, texte, couleur) -> Surface
+text_frame = {"touchés": 0, "ratés": 0}   # image en cours
+text_last = dict(text_frame)              # image précédente
+
+def text(f, s, col):
+    key = (f, s, col)
+    surf = text_cache.get(key)
+    if surf is None:
+        surf = text_cache[key] = f.render(s, True, col)
+        text_frame["ratés"] += 1
+        if len(text_cache) > TEXT_CACHE_MAX:
+            text_cache.popitem(last=False)
+    else:
+        text_cache.move_to_end(key)
+        text_frame["touchés"] += 1
+    return surf
+
+def text_new_frame():
+    text_last.update(text_frame)
+    text_frame.update({"touchés": 0, "ratés": 0})
+
 # ---- Interpolation anti-tremblement ----
 render_pos_players = {}   # id -> (x,y)
 render_pos_npcs = {}
@@ -203,47 +311,139 @@ def smooth_to(render_dict, key, tx, ty, speed=0.25):
     return nx, ny
 
 # ---- Sprites (dessinés en code) ----
-def draw_tile(ty, tx, t):
-    # dessiner en coordonnées écran (monde - caméra)
-    x, y = int(tx*TILE - cam_x), int(ty*TILE - cam_y)
+def draw_tile(surf, x, y, tx, ty, t):
+    # tuile (tx,ty) du monde dessinée dans surf en (x,y): le motif dépend des coordonnées monde
     r = pygame.Rect(x, y, TILE, TILE)
     if t == 0:     # herbe
         base = 38 + ((tx+ty) % 2)*2
-        pygame.draw.rect(screen, (base, base+16, base), r)
+        pygame.draw.rect(surf, (base, base+16, base), r)
         if (tx+ty) % 3 == 0:
-            pygame.draw.circle(screen, (30,50,30), (x+8, y+10), 3)
-            pygame.draw.circle(screen, (30,50,30), (x+22, y+28), 3)
+            pygame.draw.circle(surf, (30,50,30), (x+8, y+10), 3)
+            pygame.draw.circle(surf, (30,50,30), (x+22, y+28), 3)
     elif t == 1:   # mur
-        pygame.draw.rect(screen, (90,90,96), r)
-        pygame.draw.rect(screen, (70,70,76), r, 2)
+        pygame.draw.rect(surf, (90,90,96), r)
+        pygame.draw.rect(surf, (70,70,76), r, 2)
         for i in range(4, TILE, 8):
-            pygame.draw.line(screen, (110,110,120), (x, y+i), (x+TILE, y+i), 1)
+            pygame.draw.line(surf, (110,110,120), (x, y+i), (x+TILE, y+i), 1)
     elif t == 2:   # eau
-        pygame.draw.rect(screen, (35,70,140), r)
-        pygame.draw.arc(screen, (25,60,120), (x+6,y+6,14,10), 0, math.pi, 2)
-        pygame.draw.arc(screen, (25,60,120), (x+18,y+18,14,10), 0, math.pi, 2)
+        pygame.draw.rect(surf, (35,70,140), r)
+        pygame.draw.arc(surf, (25,60,120), (x+6,y+6,14,10), 0, math.pi, 2)
+        pygame.draw.arc(surf, (25,60,120), (x+18,y+18,14,10), 0, math.pi, 2)
     elif t == 3:   # sable
-        pygame.draw.rect(screen, (168,150,105), r)
-        pygame.draw.line(screen, (190,170,120), (x+6,y+12), (x+24,y+12), 1)
+        pygame.draw.rect(surf, (168,150,105), r)
+        pygame.draw.line(surf, (190,170,120), (x+6,y+12), (x+24,y+12), 1)
     else:          # route/pont
-        pygame.draw.rect(screen, (120,120,128), r)
-        pygame.draw.rect(screen, (90,90,100), r, 1)
+        pygame.draw.rect(surf, (120,120,128), r)
+        pygame.draw.rect(surf, (90,90,100), r, 1)
+
+# ---- Cache de surfaces du sol ----
+# Le sol est pré-rendu par blocs de SUB_TILES x SUB_TILES tuiles (640x640 px, 16 blocs par chunk)
+# gardés en LRU sous un budget mémoire: draw_tilemap ne fait plus que quelques blits par image.
+# Les blocs manquants autour de la caméra sont rendus par un thread dédié, le plus proche
+# d'abord; en attendant, un bloc d'herbe générique les remplace. L'arrivée d'un chunk
+# invalide ses blocs (numéro de génération: un rendu en cours sur l'ancienne version est jeté).
+SUB_TILES = 16
+SUB_PER_CHUNK = CHUNK_TILES // SUB_TILES
+TILE_CACHE_MB = 64             # budget mémoire des blocs (~1,6 Mo chacun à TILE=40)
+tile_cache = OrderedDict()     # (TILE, bx, by) -> Surface
+tile_cache_bytes = 0
+tile_jobs = set()              # blocs à rendre par le thread du sol
+chunk_gen = {}                 # (cx,cy) -> génération des données du chunk
+grass_blocks = {}              # (TILE, phase du motif) -> Surface (blocs de remplacement)
+tile_lock = threading.Condition()
+tile_stats = {"rendus": 0, "jetés": 0, "évictions": 0, "remplacés": 0}
+
+def render_block(bx, by):
+    """Surface d'un bloc (bx,by); hors chunk chargé: herbe, comme get_tile."""
+    surf = pygame.Surface((SUB_TILES*TILE, SUB_TILES*TILE))
+    tx0, ty0 = bx*SUB_TILES, by*SUB_TILES
+    cx, cy = bx // SUB_PER_CHUNK, by // SUB_PER_CHUNK
+    ch = loaded_chunks.get((cx, cy))
+    lx0, ly0 = tx0 - cx*CHUNK_TILES, ty0 - cy*CHUNK_TILES
+    for j in range(SUB_TILES):
+        row = ch[ly0 + j] if ch is not None else None
+        for i in range(SUB_TILES):
+            draw_tile(surf, i*TILE, j*TILE, tx0+i, ty0+j, row[lx0+i] if row is not None else 0)
+    return surf
+
+def grass_block(bx, by):
+    # le motif d'herbe ne dépend que de (tx+ty) mod 6: 3 blocs suffisent pour tout le monde
+    key = (TILE, (bx + by)*SUB_TILES % 6)
+    surf = grass_blocks.get(key)
+    if surf is None:
+        surf = grass_blocks[key] = pygame.Surface((SUB_TILES*TILE, SUB_TILES*TILE))
+        for j in range(SUB_TILES):
+            for i in range(SUB_TILES):
+                draw_tile(surf, i*TILE, j*TILE, key[1] + i, j, 0)
+    return surf
+
+def invalidate_chunk_blocks(cx, cy):
+    # appelé par le thread réseau quand les données d'un chunk arrivent
+    global tile_cache_bytes
+    with tile_lock:
+        chunk_gen[(cx, cy)] = chunk_gen.get((cx, cy), 0) + 1
+        for key in [k for k in tile_cache if k[1] // SUB_PER_CHUNK == cx and k[2] // SUB_PER_CHUNK == cy]:
+            surf = tile_cache.pop(key)
+            tile_cache_bytes -= surf.get_pitch() * surf.get_height()
+
+def _block_near_camera(bx, by, margin=1):
+    size = SUB_TILES*TILE
+    return (math.floor(cam_x / size) - margin <= bx <= math.floor((cam_x + WIDTH - 1) / size) + margin and
+            math.floor(cam_y / size) - margin <= by <= math.floor((cam_y + HEIGHT - 1) / size) + margin)
+
+def tile_worker():
+    global tile_cache_bytes
+    while True:
+        with tile_lock:
+            while not tile_jobs:
+                tile_lock.wait()
+            size = SUB_TILES*TILE
+            mx, my = (cam_x + WIDTH/2) / size, (cam_y + HEIGHT/2) / size
+            key = min(tile_jobs, key=lambda k: (k[1] + 0.5 - mx)**2 + (k[2] + 0.5 - my)**2)
+            tile_jobs.discard(key)
+            c = (key[1] // SUB_PER_CHUNK, key[2] // SUB_PER_CHUNK)
+            gen = chunk_gen.get(c)
+            if key[0] != TILE or key in tile_cache or not _block_near_camera(key[1], key[2]):
+                continue  # déjà fait, ou la caméra est partie entre-temps
+        surf = render_block(key[1], key[2])
+        with tile_lock:
+            if chunk_gen.get(c) != gen or key[0] != TILE:
+                tile_stats["jetés"] += 1
+                continue
+            tile_cache[key] = surf; tile_stats["rendus"] += 1
+            tile_cache_bytes += surf.get_pitch() * surf.get_height()
+            while tile_cache_bytes > TILE_CACHE_MB * 1024 * 1024 and len(tile_cache) > 1:
+                _, old = tile_cache.popitem(last=False)
+                tile_cache_bytes -= old.get_pitch() * old.get_height(); tile_stats["évictions"] += 1
+
+threading.Thread(target=tile_worker, name="sol", daemon=True).start()
 
 def draw_tilemap():
-    start_tx = int(math.floor(cam_x / TILE)) - 2
-    end_tx = int(math.floor((cam_x + WIDTH) / TILE)) + 3
-    start_ty = int(math.floor(cam_y / TILE)) - 2
-    end_ty = int(math.floor((cam_y + HEIGHT) / TILE)) + 3
-    need = set()
-    for ty in range(start_ty, end_ty):
-        for tx in range(start_tx, end_tx):
-            cx = int(math.floor(tx / CHUNK_TILES)); cy = int(math.floor(ty / CHUNK_TILES))
-            if (cx,cy) not in loaded_chunks:
-                need.add((cx,cy))
-                t = 0
-            else:
-                t = get_tile(tx, ty)
-            draw_tile(ty, tx, t)
+    size = SUB_TILES*TILE
+    bx0, bx1 = int(math.floor(cam_x / size)), int(math.floor((cam_x + WIDTH - 1) / size))
+    by0, by1 = int(math.floor(cam_y / size)), int(math.floor((cam_y + HEIGHT - 1) / size))
+    need = set(); blits = []
+    with tile_lock:
+        # blocs visibles + une couronne de marge, préparée avant d'entrer dans l'écran
+        for by in range(by0 - 1, by1 + 2):
+            for bx in range(bx0 - 1, bx1 + 2):
+                visible = bx0 <= bx <= bx1 and by0 <= by <= by1
+                key = (TILE, bx, by); c = (bx // SUB_PER_CHUNK, by // SUB_PER_CHUNK)
+                surf = tile_cache.get(key)
+                if surf is not None:
+                    if visible: tile_cache.move_to_end(key)
+                elif c in loaded_chunks:
+                    tile_jobs.add(key)
+                elif visible:
+                    need.add(c)
+                if visible:
+                    blits.append((surf, bx, by))
+        if tile_jobs:
+            tile_lock.notify()
+    for surf, bx, by in blits:
+        if surf is None:
+            surf = grass_block(bx, by); tile_stats["remplacés"] += 1
+        screen.blit(surf, (int(bx*size - cam_x), int(by*size - cam_y)))
     global last_chunk_request
     if need and time.time() - last_chunk_request > 0.15:
         req = []
@@ -259,71 +459,130 @@ def draw_bar(x, y, w, h, ratio, fg, bg=(60,60,60)):
     pygame.draw.rect(screen, bg, (x, y, w, h))
     pygame.draw.rect(screen, fg, (x, y, int(w*max(0,min(1,ratio))), h))
 
-def sprite_player(x, y, is_you, moving, hp_ratio):
+# ---- Atlas de sprites ----
+# Chaque variante de sprite (joueur soi/autre, type de mob, type d'objet, tête et traînée de
+# projectile, icône PNJ) est dessinée une fois au démarrage dans une petite surface à clé de
+# couleur (paint_*: les dessins d'origine, dans une surface quelconque). Une entité coûte ensuite
+# un blit, plus un pour sa barre de vie: les barres sont pré-rendues par largeur remplie.
+SPRITE_KEY = (255, 0, 255)
+MOB_KINDS = ("Rat", "Gobelin", "Slime", "Loup")   # sous-chaîne du nom -> sprite; autre: générique
+ITEM_COLORS = {"potion": (200,70,70), "gold": (220,200,60), "weapon": (160,160,200), "scroll": (200,170,120)}
+PROJ_COLORS = {False: (240,120,60), True: (255,170,70)}   # rapide: vitesse > 6
+HP_BAR_H = 4
+HP_BAR_WIDTHS = (16, 24)   # joueurs, mobs
+atlas = {}                 # clé -> (Surface, ox, oy), à afficher en (x-ox, y-oy)
+mob_kind = {}              # nom -> type de sprite (décidé une fois par nom)
+
+def paint_player(surf, x, y, is_you):
     # Sprite 2D simple (tête+corps+bras/jambes stylisés) au lieu d'un cube
     base_col = (90, 180, 120) if is_you else (120, 140, 210)
     # corps
     body_w, body_h = 16, 22
     body = pygame.Rect(int(x - body_w/2), int(y - body_h/2), body_w, body_h)
-    pygame.draw.rect(screen, base_col, body, 0, border_radius=4)
+    pygame.draw.rect(surf, base_col, body, 0, border_radius=4)
     # tête
-    pygame.draw.circle(screen, (230, 210, 180), (body.centerx, body.top-6), 6)
+    pygame.draw.circle(surf, (230, 210, 180), (body.centerx, body.top-6), 6)
     # yeux
-    pygame.draw.circle(screen, (20,20,25), (body.centerx-2, body.top-8), 1)
-    pygame.draw.circle(screen, (20,20,25), (body.centerx+2, body.top-8), 1)
+    pygame.draw.circle(surf, (20,20,25), (body.centerx-2, body.top-8), 1)
+    pygame.draw.circle(surf, (20,20,25), (body.centerx+2, body.top-8), 1)
     # bras
-    pygame.draw.line(screen, (70,90,120), (body.left-4, body.centery-2), (body.left+2, body.centery+2), 3)
-    pygame.draw.line(screen, (70,90,120), (body.right+4, body.centery-2), (body.right-2, body.centery+2), 3)
+    pygame.draw.line(surf, (70,90,120), (body.left-4, body.centery-2), (body.left+2, body.centery+2), 3)
+    pygame.draw.line(surf, (70,90,120), (body.right+4, body.centery-2), (body.right-2, body.centery+2), 3)
     # jambes
-    pygame.draw.line(screen, (60,50,40), (body.centerx-4, body.bottom), (body.centerx-4, body.bottom+6), 3)
-    pygame.draw.line(screen, (60,50,40), (body.centerx+4, body.bottom), (body.centerx+4, body.bottom+6), 3)
-    # barre HP
-    if hp_ratio is not None:
-        draw_bar(body.x, body.y-10, body_w, 4, hp_ratio, (200,60,60))
+    pygame.draw.line(surf, (60,50,40), (body.centerx-4, body.bottom), (body.centerx-4, body.bottom+6), 3)
+    pygame.draw.line(surf, (60,50,40), (body.centerx+4, body.bottom), (body.centerx+4, body.bottom+6), 3)
 
-def sprite_mob(name, x, y, moving, hp_ratio):
+def paint_mob(surf, kind, x, y):
     # sprite cartoon simple par type
-    if "Rat" in name:
-        col = (140,140,140); size=18
-        pygame.draw.circle(screen, col, (int(x), int(y)), size//2)
-        pygame.draw.circle(screen, (200,200,200), (int(x)+6, int(y)-6), 3)
-    elif "Gobelin" in name:
-        col = (90,160,90); size=20
-        pygame.draw.rect(screen, col, (int(x-10), int(y-12), 20, 24), border_radius=4)
-    elif "Slime" in name:
-        col = (120,180,220); size=22
-        pygame.draw.ellipse(screen, col, (int(x-12), int(y-8), 24, 16))
-    elif "Loup" in name:
-        col = (140,120,100); size=22
-        pygame.draw.polygon(screen, col, [(int(x-12),int(y)),(int(x),int(y-8)),(int(x+12),int(y)),(int(x),int(y+8))])
+    if kind == "Rat":
+        pygame.draw.circle(surf, (140,140,140), (x, y), 9)
+        pygame.draw.circle(surf, (200,200,200), (x+6, y-6), 3)
+    elif kind == "Gobelin":
+        pygame.draw.rect(surf, (90,160,90), (x-10, y-12, 20, 24), border_radius=4)
+    elif kind == "Slime":
+        pygame.draw.ellipse(surf, (120,180,220), (x-12, y-8, 24, 16))
+    elif kind == "Loup":
+        pygame.draw.polygon(surf, (140,120,100), [(x-12,y),(x,y-8),(x+12,y),(x,y+8)])
     else:
-        col = (200,140,80); size=20
-        pygame.draw.rect(screen, col, (int(x-10), int(y-10), 20, 20), border_radius=4)
+        pygame.draw.rect(surf, (200,140,80), (x-10, y-10, 20, 20), border_radius=4)
+
+def paint_item(surf, typ, x, y):
+    r = pygame.Rect(x - 8, y - 8, 16, 16)
+    pygame.draw.rect(surf, ITEM_COLORS.get(typ, (180,180,180)), r, border_radius=4)
+    pygame.draw.rect(surf, (20,20,20), r, 1, border_radius=4)
+
+def _bake(key, w, h, paint):
+    surf = pygame.Surface((w, h))
+    surf.fill(SPRITE_KEY)
+    paint(surf, w//2, h//2)
+    surf.set_colorkey(SPRITE_KEY, pygame.RLEACCEL)
+    atlas[key] = (surf, w//2, h//2)
+
+def bake_atlas():
+    for is_you in (True, False):
+        _bake(("joueur", is_you), 40, 48, lambda s, x, y: paint_player(s, x, y, is_you))
+    for kind in MOB_KINDS + (None,):
+        _bake(("mob", kind), 32, 32, lambda s, x, y: paint_mob(s, kind, x, y))
+    for typ in tuple(ITEM_COLORS) + (None,):
+        _bake(("objet", typ), 24, 24, lambda s, x, y: paint_item(s, typ, x, y))
+    for fast, col in PROJ_COLORS.items():
+        _bake(("proj", fast), 16, 16, lambda s, x, y: pygame.draw.circle(s, col, (x, y), 5))
+        for k in range(1, 4):
+            _bake(("traînée", fast, k), 16, 16,
+                  lambda s, x, y: pygame.draw.circle(s, (col[0]//2, col[1]//2, col[2]//2), (x, y), max(1, 5-k)))
+    _bake("pnj", 10, 10, lambda s, x, y: pygame.draw.circle(s, (240,220,90), (x, y), 3))
+    for w in HP_BAR_WIDTHS:
+        for fill in range(w + 1):
+            bar = pygame.Surface((w, HP_BAR_H))
+            bar.fill((60,60,60)); bar.fill((200,60,60), (0, 0, fill, HP_BAR_H))
+            atlas[("pv", w, fill)] = (bar, 0, 0)
+
+def _blit_sprite(key, x, y):
+    surf, ox, oy = atlas[key]
+    screen.blit(surf, (x - ox, y - oy))
+
+def hp_bar(x, y, w, ratio):
+    # même remplissage que draw_bar, en un blit
+    screen.blit(atlas[("pv", w, int(w*max(0,min(1,ratio))))][0], (x, y))
+
+def sprite_player(x, y, is_you, moving, hp_ratio):
+    x, y = int(x), int(y)
+    _blit_sprite(("joueur", bool(is_you)), x, y)
+    if hp_ratio is not None:
+        hp_bar(x - 8, y - 21, 16, hp_ratio)   # au-dessus du corps (16x22 centré)
+
+def sprite_mob(name, x, y, moving, hp_ratio):
+    kind = mob_kind.get(name, False)
+    if kind is False:
+        kind = mob_kind[name] = next((k for k in MOB_KINDS if k in name), None)
+    x, y = int(x), int(y)
+    _blit_sprite(("mob", kind), x, y)
     if hp_ratio is not None:
-        draw_bar(int(x-12), int(y-18), 24, 4, hp_ratio, (200,60,60))
+        hp_bar(x - 12, y - 18, 24, hp_ratio)
 
 def sprite_item(typ, ix, iy):
-    r = pygame.Rect(int(ix - 8), int(iy - 8), 16, 16)
-    col = {
-        "potion": (200, 70, 70),
-        "gold":   (220, 200, 60),
-        "weapon": (160, 160, 200),
-        "scroll": (200, 170, 120),
-    }.get(typ, (180,180,180))
-    pygame.draw.rect(screen, col, r, border_radius=4)
-    pygame.draw.rect(screen, (20,20,20), r, 1, border_radius=4)
+    _blit_sprite(("objet", typ if typ in ITEM_COLORS else None), int(ix), int(iy))
+
+def sprite_proj(sx, sy, vx, vy):
+    # traînée de 3 points dans le sens opposé à la vitesse, puis la tête
+    fast = math.hypot(vx, vy) > 6
+    for k in range(1, 4):
+        _blit_sprite(("traînée", fast, k), int(sx - vx*k*0.6), int(sy - vy*k*0.6))
+    _blit_sprite(("proj", fast), int(sx), int(sy))
+
+bake_atlas()
 
 def draw_player(pid, info):
+    is_you = info is world.me
     tx, ty = float(info.get("x",0)), float(info.get("y",0))
-    rx, ry = smooth_to(render_pos_players, pid, tx, ty, 0.4 if str(pid)==str(your_id) else 0.25)
+    rx, ry = smooth_to(render_pos_players, pid, tx, ty, 0.4 if is_you else 0.25)
     sx, sy = world_to_screen(rx, ry)
-    is_you = (str(pid)==str(your_id))
     mhp = info.get("max_hp") or 0
     hp_ratio = (info.get("hp",0) / mhp) if mhp > 0 else None
     moving = True
     sprite_player(sx, sy, is_you, moving, hp_ratio)
     name = info.get("name","?") + (" • YOU" if is_you else "")
-    screen.blit(font.render(name, True, (255,255,255)), (int(sx-20), int(sy-28)))
+    screen.blit(text(font, name, (255,255,255)), (int(sx-20), int(sy-28)))
 
 def draw_npc(nid, info):
     tx, ty = float(info.get("x",0)), float(info.get("y",0))
@@ -334,8 +593,7 @@ def draw_npc(nid, info):
     name = info.get("name","PNJ")
     sprite_mob(name, sx, sy, True, hp_ratio)
     if not info.get("hostile", True):
-        # icône PNJ
-        pygame.draw.circle(screen, (240,220,90), (int(sx), int(sy-16)), 3)
+        _blit_sprite("pnj", int(sx), int(sy-16))  # icône PNJ
 
 def draw_inventory():
     s = {"large":1.0, "medium":0.8, "hidden":0.0}.get(HUD_SCALE, 1.0)
@@ -344,7 +602,7 @@ def draw_inventory():
     x, y = WIDTH - w - 16, 16
     pygame.draw.rect(screen, (18,18,20), (x, y, w, h))
     pygame.draw.rect(screen, (100,100,110), (x, y, w, h), 2)
-    title = bigfont.render("Inventaire (I) — U: utiliser, G: lâcher", True, (255,255,255))
+    title = text(bigfont, "Inventaire (I) — U: utiliser, G: lâcher", (255,255,255))
     screen.blit(title, (x+10, y+8))
     line_h = int(24*s); list_y = y + int(42*s)
     for i, obj in enumerate(inventory):
@@ -352,7 +610,7 @@ def draw_inventory():
         extra = f" (+{obj.get('power',0)})" if obj.get("type") in ("weapon","potion","scroll") else ""
         txt = f"{prefix}{obj.get('name','?')} [{obj.get('type','?')}] {extra}"
         col = (255,255,255) if i == inv_sel else (210,210,210)
-        t = font.render(txt, True, col); screen.blit(t, (x+12, list_y + i*line_h))
+        t = text(font, txt, col); screen.blit(t, (x+12, list_y + i*line_h))
 
 def hud_scale_val():
     return {"large":1.0, "medium":0.8, "hidden":0.0}.get(HUD_SCALE, 1.0)
@@ -360,18 +618,18 @@ def hud_scale_val():
 def draw_hud():
     s = hud_scale_val()
     if s == 0: return
-    me = players.get(str(your_id))
+    me = world.me
     if not me: return
     x, y = 16, HEIGHT - int(64*s)
     max_hp = max(1, me.get("max_hp",100)); hp = max(0, min(max_hp, me.get("hp",100)))
     draw_bar(x, y, int(220*s), int(16*s), hp/max_hp, (200,60,60))
-    screen.blit(font.render(f"HP {int(hp)}/{int(max_hp)}", True, (255,255,255)), (x+6, y-2))
+    screen.blit(text(font, f"HP {int(hp)}/{int(max_hp)}", (255,255,255)), (x+6, y-2))
     y2 = y + int(22*s)
     max_mp = max(1, me.get("max_mp",50)); mp = max(0, min(max_mp, me.get("mp",50)))
     draw_bar(x, y2, int(220*s), int(16*s), mp/max_mp, (60,120,200))
-    screen.blit(font.render(f"MP {int(mp)}/{int(max_mp)}", True, (255,255,255)), (x+6, y2-2))
+    screen.blit(text(font, f"MP {int(mp)}/{int(max_mp)}", (255,255,255)), (x+6, y2-2))
         # XP bar (separate strip)
-    xp = int((players.get(str(your_id)) or {}).get("xp",0)); need = int((players.get(str(your_id)) or {}).get("next_xp",100)) or 1
+    xp = int(me.get("xp",0)); need = int(me.get("next_xp",100)) or 1
     xp_w = 300
     xp_x = 16
     xp_y = HEIGHT - 22
@@ -379,15 +637,15 @@ def draw_hud():
     fill_w = int((xp_w-2)*min(1.0, xp/need))
     pygame.draw.rect(screen, (180,120,40), (xp_x+1, xp_y+1, fill_w, 10))
     # texte à l'intérieur de la barre XP
-    txt = font.render(f"XP {xp}/{need}", True, (20,20,20))
+    txt = text(font, f"XP {xp}/{need}", (20,20,20))
     screen.blit(txt, (xp_x + 6, xp_y + 1))
     pts = int(me.get("stat_points", 0) or 0)
     if pts > 0:
-        t = font.render(f"Points: {pts} (P)", True, (230, 200, 120))
+        t = text(font, f"Points: {pts} (P)", (230, 200, 120))
         screen.blit(t, (x, y - int(18*s)))
 
 def draw_stats():
-    me = players.get(str(your_id))
+    me = world.me
     if not me: return
     pts = int(me.get("stat_points", 0) or 0)
     stats = me.get("stats", {}) or {}
@@ -395,9 +653,9 @@ def draw_stats():
     x, y = WIDTH//2 - w//2, HEIGHT//2 - h//2
     pygame.draw.rect(screen, (14,14,18), (x,y,w,h))
     pygame.draw.rect(screen, (120,120,140), (x,y,w,h), 2)
-    screen.blit(bigfont.render("Attributs", True, (255,255,255)), (x+12,y+10))
-    screen.blit(font.render("P: fermer • Entrée: +1 • ↑/↓: sélectionner • 1-4: STR/INT/AGI/STA", True, (200,200,200)), (x+12,y+36))
-    screen.blit(font.render(f"Points disponibles: {pts}", True, (230,200,120)), (x+12,y+60))
+    screen.blit(text(bigfont, "Attributs", (255,255,255)), (x+12,y+10))
+    screen.blit(text(font, "P: fermer • Entrée: +1 • ↑/↓: sélectionner • 1-4: STR/INT/AGI/STA", (200,200,200)), (x+12,y+36))
+    screen.blit(text(font, f"Points disponibles: {pts}", (230,200,120)), (x+12,y+60))
     labels = [("str","Force"),("int","Intelligence"),("agi","Agilité"),("sta","Endurance")]
     yy = y+88
     for i,(k,label) in enumerate(labels):
@@ -405,7 +663,7 @@ def draw_stats():
         sel = (i == stats_index)
         txt = f"> {label}: {val}" if sel else f"  {label}: {val}"
         col = (255,255,255) if sel else (210,210,210)
-        screen.blit(font.render(txt, True, col), (x+20, yy)); yy += 26
+        screen.blit(text(font, txt, col), (x+20, yy)); yy += 26
 
 def draw_spellbar():
     s = hud_scale_val()
@@ -420,9 +678,9 @@ def draw_spellbar():
         pygame.draw.rect(screen, (60,60,70), (sx+4, y+4, slot_w-8, h-8), 2)
         lbl = (KEYS.get(f"spell_{i+1}","K_?")).replace("K_","").upper()
         sp = SPELLS.get(str(i+1)) or {}
-        screen.blit(font.render(lbl, True, (200,200,200)), (sx+6, y+6))
+        screen.blit(text(font, lbl, (200,200,200)), (sx+6, y+6))
         nm = sp.get("name", f"Sort {i+1}")
-        screen.blit(font.render(nm.split()[0], True, (220,220,220)), (sx+6, y+16))
+        screen.blit(text(font, nm.split()[0], (220,220,220)), (sx+6, y+16))
 
 def draw_chat():
     s = hud_scale_val()*0.85
@@ -434,41 +692,101 @@ def draw_chat():
     yy = y+8
     for author, msg in lines:
         col = (255, 200, 100) if author == "SYSTEM" else (230,230,230)
-        t = font.render(f"{author}: {msg}", True, col)
+        t = text(font, f"{author}: {msg}", col)
         screen.blit(t, (x+8, yy)); yy += int(20*s)
     y2 = y + h + 6
     if chat_typing:
         pygame.draw.rect(screen, (15,15,17), (x, y2, w, int(26*s)))
         pygame.draw.rect(screen, (120,120,130), (x, y2, w, int(26*s)), 2)
-        t = font.render("> " + chat_buffer, True, (255,255,255)); screen.blit(t, (x+6, y2+4))
+        t = text(font, "> " + chat_buffer, (255,255,255)); screen.blit(t, (x+6, y2+4))
     else:
-        hint = font.render("Entrée: chat | F1: HUD | F10/Échap: Options | 1–4: Sorts (viser à la souris) | C: équipement | E: ramasser | I: inventaire", True, (200,200,200))
+        hint = text(font, "Entrée: chat | F1: HUD | F10/Échap: Options | 1–4: Sorts (viser à la souris) | C: équipement | E: ramasser | I: inventaire", (200,200,200))
         screen.blit(hint, (x, y2+4))
 
+# ---- Cartes (mini-carte & carte du monde) ----
+# Chaque chunk chargé a un aperçu persistant d'un pixel par tuile (64x64), calculé une fois à
+# partir de ses octets (table de couleurs NumPy, ou surface 8 bits à palette sans NumPy). Les
+# cartes sont composées par blits de ces aperçus puis agrandies (transform.scale, au plus proche)
+# et gardées telles quelles: recomposées seulement quand le joueur change de tuile ou qu'un
+# chunk arrive.
+MAP_COLORS = ((40,70,40), (90,90,100), (40,70,120), (160,140,100), (120,120,128))  # herbe, mur, eau, sable, route
+_MAP_PALETTE = list(MAP_COLORS) + [MAP_COLORS[4]] * (256 - len(MAP_COLORS))
+_MAP_LUT = np.array(_MAP_PALETTE, np.uint8) if np is not None else None
+chunk_overviews = {}     # (cx,cy) -> Surface 64x64
+map_version = 0          # incrémenté à chaque chunk reçu
+map_cache = {}           # "mini" | "monde" -> (clé, Surface composée)
+
+def invalidate_chunk_overview(cx, cy):
+    global map_version
+    chunk_overviews.pop((cx, cy), None)
+    map_version += 1
+
+def chunk_overview(c):
+    surf = chunk_overviews.get(c)
+    if surf is None:
+        ch = loaded_chunks.get(c)
+        if ch is None:
+            return None
+        raw = b"".join(bytes(row) for row in ch)
+        if len(raw) != CHUNK_TILES * CHUNK_TILES:
+            return None
+        if np is not None:
+            rgb = _MAP_LUT[np.frombuffer(raw, np.uint8).reshape(CHUNK_TILES, CHUNK_TILES)]
+            surf = pygame.surfarray.make_surface(rgb.swapaxes(0, 1))  # surfarray: [x][y]
+        else:
+            surf = pygame.image.frombuffer(raw, (CHUNK_TILES, CHUNK_TILES), "P")
+            surf.set_palette(_MAP_PALETTE)
+            surf = surf.copy()  # frombuffer partage raw
+        chunk_overviews[c] = surf
+    return surf
+
+def map_image(tx0, ty0, w, h, scale):
+    """Tuiles [tx0, tx0+w) x [ty0, ty0+h) à scale px par tuile (hors chunk chargé: herbe)."""
+    canvas = pygame.Surface((w, h))
+    canvas.fill(MAP_COLORS[0])
+    for cy in range(ty0 // CHUNK_TILES, (ty0 + h - 1) // CHUNK_TILES + 1):
+        for cx in range(tx0 // CHUNK_TILES, (tx0 + w - 1) // CHUNK_TILES + 1):
+            ov = chunk_overview((cx, cy))
+            if ov is not None:
+                canvas.blit(ov, (cx*CHUNK_TILES - tx0, cy*CHUNK_TILES - ty0))
+    return pygame.transform.scale(canvas, (w*scale, h*scale))
+
+def draw_minimap(me):
+    # mini-carte en overlay (haut-droit), 4 px par tuile
+    mm_size = 180; scale = 4
+    me_tx = int(me.get("x",0)//TILE); me_ty = int(me.get("y",0)//TILE)
+    key = (me_tx, me_ty, TILE, map_version)
+    cached = map_cache.get("mini")
+    if cached is None or cached[0] != key:
+        half = mm_size//(2*scale)
+        mm = pygame.Surface((mm_size, mm_size))
+        mm.set_alpha(200)
+        mm.fill((12,12,16))
+        mm.blit(map_image(me_tx-half, me_ty-half, 2*half, 2*half, scale), (0, 0))
+        pygame.draw.circle(mm, (240,220,120), (mm_size//2, mm_size//2), 3)
+        cached = map_cache["mini"] = (key, mm)
+    screen.blit(cached[1], (WIDTH - mm_size - 14, 14))
+
 def draw_worldmap_overlay():
     # grande carte stylisée (simple heatmap des tuiles autour du joueur)
     w, h = 520, 360
     x, y = WIDTH//2 - w//2, HEIGHT//2 - h//2
-    surf = pygame.Surface((w, h))
-    surf.set_alpha(220)
-    surf.fill((22,20,18))
-    pygame.draw.rect(surf, (150,140,120), (0,0,w,h), 2)
-    me = players.get(str(your_id)) or {}
-    if me:
-        scale = 3
-        me_tx = int(me.get('x',0)//TILE)
-        me_ty = int(me.get('y',0)//TILE)
-        halfx = (w//scale)//2
-        halfy = (h//scale)//2
-        for ty in range(me_ty-halfy, me_ty+halfy):
-            for tx in range(me_tx-halfx, me_tx+halfx):
-                t = get_tile(tx, ty)
-                px = (tx - (me_tx-halfx)) * scale
-                py = (ty - (me_ty-halfy)) * scale
-                col = (40,70,40) if t==0 else (90,90,100) if t==1 else (40,70,120) if t==2 else (160,140,100) if t==3 else (120,120,128)
-                pygame.draw.rect(surf, col, (px, py, scale, scale))
-        pygame.draw.circle(surf, (240,220,120), (w//2, h//2), 4)
-    screen.blit(surf, (x,y))
+    me = world.me or {}
+    key = (int(me.get('x',0)//TILE), int(me.get('y',0)//TILE), TILE, map_version) if me else None
+    cached = map_cache.get("monde")
+    if cached is None or cached[0] != key:
+        surf = pygame.Surface((w, h))
+        surf.set_alpha(220)
+        surf.fill((22,20,18))
+        pygame.draw.rect(surf, (150,140,120), (0,0,w,h), 2)
+        if me:
+            scale = 3
+            halfx = (w//scale)//2
+            halfy = (h//scale)//2
+            surf.blit(map_image(key[0]-halfx, key[1]-halfy, 2*halfx, 2*halfy, scale), (0, 0))
+            pygame.draw.circle(surf, (240,220,120), (w//2, h//2), 4)
+        cached = map_cache["monde"] = (key, surf)
+    screen.blit(cached[1], (x,y))
 
 # ---- Menu Options / Rebind ----
 OPTIONS_OPEN = False
@@ -478,6 +796,7 @@ waiting_bind = False
 STATS_OPEN = False
 stats_index = 0
 WORLDMAP_OPEN = False
+DEBUG_OPEN = False
 def toggle_hud():
     global HUD_SCALE
     HUD_SCALE = {"large":"medium","medium":"hidden","hidden":"large"}.get(HUD_SCALE,"medium")
@@ -488,8 +807,8 @@ def draw_options():
     x, y = WIDTH//2 - w//2, HEIGHT//2 - h//2
     pygame.draw.rect(screen, (12,12,16), (x,y,w,h))
     pygame.draw.rect(screen, (120,120,140), (x,y,w,h), 2)
-    screen.blit(bigfont.render("Options — Rebind touches", True, (255,255,255)), (x+12,y+12))
-    screen.blit(font.render("↑/↓ sélectionner • Entrée rebinder • F10/Echap fermer • F1 HUD", True, (220,220,220)), (x+12,y+40))
+    screen.blit(text(bigfont, "Options — Rebind touches", (255,255,255)), (x+12,y+12))
+    screen.blit(text(font, "↑/↓ sélectionner • Entrée rebinder • F10/Echap fermer • F1 HUD", (220,220,220)), (x+12,y+40))
     list_y = y+70; line_h = 24
     for i, act in enumerate(REBINDS):
         keyname = KEYS.get(act,"")
@@ -498,7 +817,25 @@ def draw_options():
         if waiting_bind and i == rebind_index:
             label = f"> Appuyez sur une touche pour: {act}"
             col = (120,220,120)
-        screen.blit(font.render(label, True, col), (x+20, list_y+i*line_h))
+        screen.blit(text(font, label, col), (x+20, list_y+i*line_h))
+
+def draw_debug():
+    # overlay F3; rendu hors cache: ses chiffres changent à chaque image
+    hits, total = text_last["touchés"], text_last["touchés"] + text_last["ratés"]
+    lines = [
+        f"FPS {clock.get_fps():.0f}",
+        f"textes: {hits}/{total} en cache ({hits*100//max(1, total)}%), {len(text_cache)}/{TEXT_CACHE_MAX} surfaces",
+        f"sol: {len(tile_cache)} blocs ({tile_cache_bytes/2**20:.0f}/{TILE_CACHE_MB} Mo), rendus {tile_stats['rendus']}, "
+        f"évictions {tile_stats['évictions']}, remplacés {tile_stats['remplacés']}",
+        f"cartes: {len(chunk_overviews)} aperçus de chunk, version {map_version}",
+    ]
+    surfs = [font.render(l, True, (200,230,200)) for l in lines]
+    w = max(sf.get_width() for sf in surfs) + 12; h = 18*len(surfs) + 8
+    x, y = WIDTH - w - 14, HEIGHT - h - 14
+    bg = pygame.Surface((w, h)); bg.set_alpha(190); bg.fill((8,8,10))
+    screen.blit(bg, (x, y))
+    for i, sf in enumerate(surfs):
+        screen.blit(sf, (x+6, y+4+18*i))
 
 # ---- Sorts (client : envoi) ----
 def try_cast(slot, mouse_pos):
@@ -511,13 +848,13 @@ def try_cast(slot, mouse_pos):
 
 def draw_equip_panel():
     if not EQUIP_UI.get("open"): return
-    me = players.get(str(your_id)) or {}
+    me = world.me or {}
     eq = me.get("equipment", {})
     w, h = 360, 300
     x, y = WIDTH - w - 16, HEIGHT - h - 16
     pygame.draw.rect(screen, (18,18,20), (x, y, w, h))
     pygame.draw.rect(screen, (200,200,220), (x, y, w, h), 2)
-    title = bigfont.render("Équipement (C)", True, (255,255,255))
+    title = text(bigfont, "Équipement (C)", (255,255,255))
     screen.blit(title, (x+10, y+8))
     slots = ["head","neck","chest","legs","boots","ring1","ring2","weapon","offhand"]
     global slot_rects; slot_rects = {}
@@ -529,19 +866,19 @@ def draw_equip_panel():
         slot_rects[sl] = rect
         pygame.draw.rect(screen, (34,34,48), rect)
         pygame.draw.rect(screen, (110,110,140), rect, 1)
-        screen.blit(font.render(sl.upper(), True, (210,210,230)), (rx+6, ry+4))
+        screen.blit(text(font, sl.upper(), (210,210,230)), (rx+6, ry+4))
         it = (eq or {}).get(sl)
         if it:
             name = str(it.get("name","?"))
-            screen.blit(font.render(name[:22], True, (240,240,255)), (rx+6, ry+24))
+            screen.blit(text(font, name[:22], (240,240,255)), (rx+6, ry+24))
         # interaction drag&drop basique depuis inventaire sélectionné
     # stats cumulées
-    stats = (players.get(str(your_id)) or {}).get("stats", {})
-    gear = (players.get(str(your_id)) or {}).get("_gear_bonus_stats", stats)
+    stats = me.get("stats", {})
+    gear = me.get("_gear_bonus_stats", stats)
     pygame.draw.rect(screen, (24,24,28), (x+12, y+h-44, w-24, 28))
     pygame.draw.rect(screen, (90,90,110), (x+12, y+h-44, w-24, 28), 1)
     s_txt = f"STR {gear.get('str',0)}  INT {gear.get('int',0)}  AGI {gear.get('agi',0)}  STA {gear.get('sta',0)}"
-    screen.blit(font.render(s_txt, True, (220,220,230)), (x+18, y+h-38))
+    screen.blit(text(font, s_txt, (220,220,230)), (x+18, y+h-38))
     # drag depuis inventaire vers slot (si inventaire ouvert)
 
 # ---- Connexion & boucle ----
@@ -553,6 +890,9 @@ while running:
         if event.type == pygame.QUIT:
             running = False
         elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_F3:
+                DEBUG_OPEN = not DEBUG_OPEN
+                continue
             # UI: Login
             if UI_STATE == "login":
                 if event.key == pygame.K_TAB:
@@ -566,10 +906,10 @@ while running:
                         login_password = login_password[:-1]
                 elif event.key == pygame.K_RETURN:
                     if login_mode == "login":
-                        send_json(sock, {"type":"login","username":login_username.strip(),"password":login_password})
+                        send_json(sock, {"type":"login","username":login_username.strip(),"password":login_password,"proto":WIRE_PROTO})
                         login_msg = "Connexion..."
                     else:
-                        send_json(sock, {"type":"register","username":login_username.strip(),"password":login_password})
+                        send_json(sock, {"type":"register","username":login_username.strip(),"password":login_password,"proto":WIRE_PROTO})
                         login_msg = "Création..."
                 else:
                     ch = event.unicode
@@ -736,7 +1076,7 @@ while running:
             mx, my = event.pos
             for sl, r in slot_rects.items():
                 if r.collidepoint(mx, my):
-                    it = (players.get(str(your_id), {}).get("equipment", {}) or {}).get(sl)
+                    it = ((world.me or {}).get("equipment", {}) or {}).get(sl)
                     if it:
                         tooltip["txt"] = f"{it.get('name','?')} [{it.get('type','?')}] +{it.get('power',0)}"
                         tooltip["until"] = time.time() + 2.0
@@ -760,34 +1100,17 @@ while running:
         if dx or dy: send_json(sock, {"type":"move", "dx": dx, "dy": dy})
 
     # Rendu
+    world = latest_world   # un seul état pour toute l'image
+    text_new_frame()
     screen.fill((20, 20, 22))
     if UI_STATE == "game":
         # caméra centrée sur le joueur
-        me = players.get(str(your_id))
+        me = world.me
         if me:
             cam_x = me.get("x",0) - WIDTH//2
             cam_y = me.get("y",0) - HEIGHT//2
         draw_tilemap()
-        # mini‑map en overlay (haut‑droit)
-        mm_size = 180
-        mm = pygame.Surface((mm_size, mm_size))
-        mm.set_alpha(200)
-        mm.fill((12,12,16))
-        # échelle mini‑map: 1 px = 4 tiles
-        scale = 4
-        me_tx = int((me.get("x",0))//TILE)
-        me_ty = int((me.get("y",0))//TILE)
-        half = mm_size//(2*scale)
-        for ty in range(me_ty-half, me_ty+half):
-            for tx in range(me_tx-half, me_tx+half):
-                t = get_tile(tx, ty)
-                px = (tx - (me_tx-half)) * scale
-                py = (ty - (me_ty-half)) * scale
-                col = (40,70,40) if t==0 else (90,90,100) if t==1 else (40,70,120) if t==2 else (160,140,100) if t==3 else (120,120,128)
-                pygame.draw.rect(mm, col, (px, py, scale, scale))
-        # joueur
-        pygame.draw.circle(mm, (240,220,120), (mm_size//2, mm_size//2), 3)
-        screen.blit(mm, (WIDTH - mm_size - 14, 14))
+        if me: draw_minimap(me)
         # FX légers
         now_t = time.time()
         for f in list(FX):
@@ -798,31 +1121,25 @@ while running:
                 pygame.draw.circle(screen, (220,200,120), (int(sx), int(sy)), 10, 2)
 
         # Items
-        for it in list(items.values()):
+        for it in world.items.values():
             sx, sy = world_to_screen(it.get("x",0), it.get("y",0))
             sprite_item(it.get("type","?"), sx, sy)
 
         # Projectiles (lissage) + FX pour tous les sorts
-        for id_, pr in list(projs.items()):
+        for id_, pr in world.projs.items():
             tx, ty = float(pr.get("x",0)), float(pr.get("y",0))
             # si le joueur est immobile, utiliser directement la position réseau
             is_me_idle = not (pressed("move_left") or pressed("move_right") or pressed("move_up") or pressed("move_down"))
             rx, ry = (tx, ty) if is_me_idle else smooth_to(render_pos_projs, id_, tx, ty, 0.6)
             sx, sy = world_to_screen(rx, ry)
-            col = (240,120,60)
-            spd = math.hypot(pr.get('vx',0), pr.get('vy',0))
-            # couleur par vitesse pour donner une variété visuelle
-            if spd > 6: col = (255,170,70)
-            for k in range(1,4):
-                pygame.draw.circle(screen, (col[0]//2, col[1]//2, col[2]//2), (int(sx - pr.get('vx',0)*k*0.6), int(sy - pr.get('vy',0)*k*0.6)), max(1, 5-k))
-            pygame.draw.circle(screen, col, (int(sx), int(sy)), 5)
+            sprite_proj(sx, sy, pr.get('vx',0), pr.get('vy',0))
 
         # PNJ
-        for nid, info in list(npcs.items()):
+        for nid, info in world.npcs.items():
             draw_npc(nid, info)
 
         # Joueurs
-        for pid, info in list(players.items()):
+        for pid, info in world.players.items():
             draw_player(pid, info)
 
         # UI
@@ -841,63 +1158,64 @@ while running:
         pygame.draw.rect(screen, (16,16,20), (x,y,w,h))
         pygame.draw.rect(screen, (120,120,140), (x,y,w,h), 2)
         title = f"Connexion" if login_mode=="login" else "Inscription"
-        screen.blit(bigfont.render(title, True, (255,255,255)), (x+16,y+12))
-        screen.blit(font.render("F2: basculer Connexion/Inscription", True, (200,200,200)), (x+16,y+42))
+        screen.blit(text(bigfont, title, (255,255,255)), (x+16,y+12))
+        screen.blit(text(font, "F2: basculer Connexion/Inscription", (200,200,200)), (x+16,y+42))
         # Username
         pygame.draw.rect(screen, (28,28,34), (x+16, y+76, w-32, 32))
         pygame.draw.rect(screen, (160,160,180), (x+16, y+76, w-32, 32), 2 if login_focus=="user" else 1)
-        screen.blit(font.render("Utilisateur:", True, (220,220,220)), (x+20, y+56))
-        screen.blit(bigfont.render(login_username or "", True, (255,255,255)), (x+24, y+82))
+        screen.blit(text(font, "Utilisateur:", (220,220,220)), (x+20, y+56))
+        screen.blit(text(bigfont, login_username or "", (255,255,255)), (x+24, y+82))
         # Password
         pygame.draw.rect(screen, (28,28,34), (x+16, y+144, w-32, 32))
         pygame.draw.rect(screen, (160,160,180), (x+16, y+144, w-32, 32), 2 if login_focus=="pass" else 1)
-        screen.blit(font.render("Mot de passe:", True, (220,220,220)), (x+20, y+124))
+        screen.blit(text(font, "Mot de passe:", (220,220,220)), (x+20, y+124))
         dots = "*" * len(login_password)
-        screen.blit(bigfont.render(dots, True, (255,255,255)), (x+24, y+150))
+        screen.blit(text(bigfont, dots, (255,255,255)), (x+24, y+150))
         # Hint & Msg
-        screen.blit(font.render("Entrée: valider • Tab: changer champ • F2: basculer", True, (200,200,200)), (x+16, y+h-48))
+        screen.blit(text(font, "Entrée: valider • Tab: changer champ • F2: basculer", (200,200,200)), (x+16, y+h-48))
         if login_msg:
-            screen.blit(font.render(login_msg, True, (240,200,120)), (x+16, y+h-28))
+            screen.blit(text(font, login_msg, (240,200,120)), (x+16, y+h-28))
     elif UI_STATE == "select":
         w, h = 560, 380
         x, y = WIDTH//2 - w//2, HEIGHT//2 - h//2
         pygame.draw.rect(screen, (16,16,20), (x,y,w,h))
         pygame.draw.rect(screen, (120,120,140), (x,y,w,h), 2)
-        screen.blit(bigfont.render("Sélection du personnage", True, (255,255,255)), (x+16,y+12))
-        screen.blit(font.render("↑/↓ sélectionner • Entrée: jouer • C: créer • R: rafraîchir", True, (200,200,200)), (x+16,y+40))
+        screen.blit(text(bigfont, "Sélection du personnage", (255,255,255)), (x+16,y+12))
+        screen.blit(text(font, "↑/↓ sélectionner • Entrée: jouer • C: créer • R: rafraîchir", (200,200,200)), (x+16,y+40))
         list_y = y+76
         for i, ch in enumerate(char_list):
             sel = (i == char_sel)
             name = ch.get("name","?"); cls = ch.get("class","?"); lvl = ch.get("level",1)
             label = f"> {name}  [{cls}]  niv {lvl}" if sel else f"  {name}  [{cls}]  niv {lvl}"
             col = (255,255,255) if sel else (210,210,210)
-            screen.blit(font.render(label, True, col), (x+24, list_y + i*26))
+            screen.blit(text(font, label, col), (x+24, list_y + i*26))
         if not char_list:
-            screen.blit(font.render("Aucun personnage. Appuyez sur C pour créer.", True, (220,180,120)), (x+24, list_y))
+            screen.blit(text(font, "Aucun personnage. Appuyez sur C pour créer.", (220,180,120)), (x+24, list_y))
         if char_msg:
-            screen.blit(font.render(char_msg, True, (240,200,120)), (x+16, y+h-28))
+            screen.blit(text(font, char_msg, (240,200,120)), (x+16, y+h-28))
     elif UI_STATE == "create":
         w, h = 560, 320
         x, y = WIDTH//2 - w//2, HEIGHT//2 - h//2
         pygame.draw.rect(screen, (16,16,20), (x,y,w,h))
         pygame.draw.rect(screen, (120,120,140), (x,y,w,h), 2)
-        screen.blit(bigfont.render("Création de personnage", True, (255,255,255)), (x+16,y+12))
-        screen.blit(font.render("Nom (écrire) • Classe (←/→) • Entrée: créer • Échap: retour", True, (200,200,200)), (x+16,y+40))
-        screen.blit(font.render("Nom:", True, (220,220,220)), (x+20, y+84))
+        screen.blit(text(bigfont, "Création de personnage", (255,255,255)), (x+16,y+12))
+        screen.blit(text(font, "Nom (écrire) • Classe (←/→) • Entrée: créer • Échap: retour", (200,200,200)), (x+16,y+40))
+        screen.blit(text(font, "Nom:", (220,220,220)), (x+20, y+84))
         pygame.draw.rect(screen, (28,28,34), (x+90, y+80, w-110, 32))
         pygame.draw.rect(screen, (160,160,180), (x+90, y+80, w-110, 32), 1)
-        screen.blit(bigfont.render(create_name or "", True, (255,255,255)), (x+96, y+86))
-        screen.blit(font.render("Classe:", True, (220,220,220)), (x+20, y+140))
+        screen.blit(text(bigfont, create_name or "", (255,255,255)), (x+96, y+86))
+        screen.blit(text(font, "Classe:", (220,220,220)), (x+20, y+140))
         cls = CLASSES[create_class_idx]
-        screen.blit(bigfont.render(f"← {cls} →", True, (230,230,230)), (x+100, y+140))
+        screen.blit(text(bigfont, f"← {cls} →", (230,230,230)), (x+100, y+140))
         if create_msg:
-            screen.blit(font.render(create_msg, True, (240,200,120)), (x+16, y+h-28))
+            screen.blit(text(font, create_msg, (240,200,120)), (x+16, y+h-28))
 
+    if DEBUG_OPEN: draw_debug()
     pygame.display.flip()
     # tooltip render
     if tooltip.get("txt") and time.time() < tooltip.get("until",0):
         tx, ty = tooltip.get("pos", (0,0))
-        label = font.render(tooltip["txt"], True, (255,255,255))
+        label = text(font, tooltip["txt"], (255,255,255))
         bg = pygame.Surface((label.get_width()+8, label.get_height()+6))
         bg.set_alpha(180)
         bg.fill((20,20,24))
@@ -0,0 +1,178 @@
+# router.py
+# Routeur frontal du mode shardé (tout sur localhost): possède les sockets clients et relaie
+# chacun, trame par trame sans la redécoder, vers le worker server_game.py qui simule la région
+# de son joueur. Un nouveau client arrive toujours sur le shard 0 (comptes, personnages).
+# Quand un worker rend un joueur ("shard_handoff"), le routeur ouvre une connexion vers le
+# worker destinataire, lui remet l'état ("shard_attach") et y rebranche le client: celui-ci ne
+# voit qu'un snapshot complet arriver. Les trames du client que l'ancien worker n'a pas appliquées
+# (envoyées pendant le passage) sont rejouées chez le destinataire juste après l'attache.
+# Les workers n'acceptent les messages "shard_*" que munis de la clé de la partie, tirée ici à
+# chaque lancement et transmise aux workers par la variable d'environnement MMO_SHARD_KEY (avec
+# --no-spawn: la poser soi-même, la même pour le routeur et les workers).
+# Usage: python router.py --shards 4 [--port 5555] [--base-port 5600] [--no-spawn]
+import asyncio, argparse, subprocess, sys, os, time, secrets
+from collections import deque
+import wire
+
+HOST = "127.0.0.1"
+PORT = 5555
+WORKER_HOST = "127.0.0.1"
+BASE_PORT = 5600          # worker i: BASE_PORT + i
+STATS_LOG_EVERY = 60.0
+REPLAY_MAX = 256          # trames client gardées pour le rejeu (en vol vers le worker courant)
+CONTROL = b'{"type": "shard_'  # préfixe des messages de contrôle émis par les workers (json.dumps)
+SHARD_KEY_ENV = "MMO_SHARD_KEY"
+SHARD_KEY = None
+
+stats = {"clients": 0, "handoffs": 0, "handoff_errors": 0, "frames_up": 0, "frames_down": 0,
+         "replayed": 0, "replay_lost": 0}
+
+async def _open_worker(shard):
+    return await asyncio.open_connection(WORKER_HOST, BASE_PORT + shard)
+
+class Relay:
+    """Un client et sa connexion amont courante (changée à chaque passage de frontière)."""
+    def __init__(self, reader, writer):
+        self.cr, self.cw = reader, writer
+        self.up_r = self.up_w = None
+        self.shard = None
+        self.sent = deque(maxlen=REPLAY_MAX)  # dernières trames envoyées au worker courant
+        self.sent_n = 0                       # trames envoyées au worker courant
+
+    async def run(self):
+        try:
+            self.up_r, self.up_w = await _open_worker(0)
+        except OSError:
+            self.cw.close(); return
+        self.shard = 0
+        down = asyncio.create_task(self._downstream())
+        try:
+            while True:
+                try:
+                    raw = await wire.read_raw_async(self.cr)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if raw is None or down.done():
+                    break
+                msg = wire.raw_json(raw)
+                if msg is not None and str(msg.get("type", "")).startswith("shard_"):
+                    continue  # protocole interne: jamais accepté d'un client
+                up = self.up_w
+                up.write(raw)
+                self.sent.append(raw); self.sent_n += 1
+                stats["frames_up"] += 1
+                try:
+                    await up.drain()
+                except ConnectionError:
+                    if up is self.up_w:
+                        break  # sinon: ancien worker fermé par un passage de frontière
+        finally:
+            down.cancel()
+            self.up_w.close()
+            self.cw.close()
+
+    async def _downstream(self):
+        try:
+            while True:
+                raw = await wire.read_raw_async(self.up_r)
+                if raw is None:
+                    break
+                ctl = wire.raw_json(raw, CONTROL)
+                if ctl is not None:
+                    if ctl.get("type") == "shard_handoff" and not await self._handoff(ctl):
+                        break
+                    continue
+                self.cw.write(raw)
+                stats["frames_down"] += 1
+                await self.cw.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self.cw.close()  # worker perdu: le client se reconnectera
+
+    async def _handoff(self, ctl):
+        try:
+            r, w = await _open_worker(int(ctl["to"]))
+        except OSError:
+            stats["handoff_errors"] += 1
+            return False
+        w.write(wire.encode({"type": "shard_attach", "state": ctl["state"], "key": SHARD_KEY}))
+        # trames arrivées chez l'ancien worker après sa décision (pendant l'ouverture ci-dessus
+        # comprise): rejouées après l'attache, dans l'ordre
+        late = max(0, self.sent_n - int(ctl.get("seen", self.sent_n)))
+        replay = list(self.sent)[len(self.sent) - min(late, len(self.sent)):]
+        stats["replay_lost"] += late - len(replay)
+        for raw in replay:
+            w.write(raw)
+        stats["replayed"] += len(replay)
+        self.sent = deque(replay, maxlen=REPLAY_MAX); self.sent_n = len(replay)
+        old = self.up_w
+        self.up_r, self.up_w, self.shard = r, w, int(ctl["to"])
+        old.close()  # l'ancien worker voit la connexion fermée et oublie la session
+        stats["handoffs"] += 1
+        return True
+
+async def _serve_client(reader, writer):
+    stats["clients"] += 1
+    try:
+        await Relay(reader, writer).run()
+    finally:
+        stats["clients"] -= 1
+
+async def _stats_loop():
+    while STATS_LOG_EVERY > 0:
+        await asyncio.sleep(STATS_LOG_EVERY)
+        print(f"[ROUTEUR] clients={stats['clients']} passages={stats['handoffs']} "
+              f"échecs={stats['handoff_errors']} trames_amont={stats['frames_up']} trames_aval={stats['frames_down']} "
+              f"rejouées={stats['replayed']} perdues={stats['replay_lost']}")
+
+def spawn_workers(n):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, SHARD_KEY_ENV: SHARD_KEY}
+    procs = []
+    for i in range(n):
+        procs.append(subprocess.Popen([sys.executable, os.path.join(here, "server_game.py"),
+                                       "--host", WORKER_HOST, "--port", str(BASE_PORT + i), "--mode", "asyncio",
+                                       "--shard", str(i), "--shards", str(n), "--shard-base-port", str(BASE_PORT)], env=env))
+    return procs
+
+async def _wait_workers(n, timeout=10.0):
+    end = time.monotonic() + timeout
+    for i in range(n):
+        while True:
+            try:
+                _, w = await _open_worker(i); w.close(); break
+            except OSError:
+                if time.monotonic() > end: raise
+                await asyncio.sleep(0.1)
+
+async def main(n, spawn):
+    procs = spawn_workers(n) if spawn else []
+    try:
+        await _wait_workers(n)
+        server = await asyncio.start_server(_serve_client, HOST, PORT)
+        print(f"[ROUTEUR] en ligne sur {HOST}:{PORT}, {n} shards sur {WORKER_HOST}:{BASE_PORT}..{BASE_PORT + n - 1}")
+        asyncio.create_task(_stats_loop())
+        async with server:
+            await server.serve_forever()
+    finally:
+        for p in procs:
+            p.terminate()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Routeur frontal du serveur MMO-lite shardé")
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--shards", type=int, default=2)
+    ap.add_argument("--base-port", type=int, default=BASE_PORT)
+    ap.add_argument("--no-spawn", action="store_true", help="workers déjà lancés à la main")
+    args = ap.parse_args()
+    HOST, PORT, BASE_PORT = args.host, args.port, args.base_port
+    SHARD_KEY = os.environ.get(SHARD_KEY_ENV)
+    if not SHARD_KEY:
+        if args.no_spawn:
+            sys.exit(f"[ERREUR] --no-spawn: poser {SHARD_KEY_ENV} (la même clé que celle des workers)")
+        SHARD_KEY = secrets.token_hex(16)
+    try:
+        asyncio.run(main(args.shards, not args.no_spawn))
+    except KeyboardInterrupt:
+        pass
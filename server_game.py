@@ -1,5 +1,12 @@
 # server_game.py
-import socket, threading, json, random, time, math, os, hashlib
+import socket, threading, json, random, time, math, os, sys, signal, hashlib, hmac, base64, mmap, asyncio, argparse, sqlite3, tempfile, operator
+from collections import OrderedDict, deque
+from array import array
+import wire
+try:
+    import numpy as np  # optionnel: génération vectorisée des chunks
+except ImportError:
+    np = None
 
 HOST = "127.0.0.1"
 PORT = 5555
@@ -17,6 +24,24 @@ PLAYER_SIZE = 20
 NPC_SIZE = 22
 ITEM_SIZE = 16
 TICK_HZ = 20  # cadence logique et émission d'état
+MAX_CATCHUP_STEPS = 5     # pas de simulation enchaînés au plus par réveil quand on est en retard
+LATE_TOLERANCE = 0.25     # un pas démarré plus d'un quart de tick après son échéance compte "en retard"
+SIM_NUMPY = True          # avec NumPy: projectiles en colonnes (ProjectileStore) et IA des mobs groupée
+AOI_RADIUS = 1400         # px: chaque client ne reçoit que les entités dans ce rayon autour de son joueur
+CHAT_RADIUS = AOI_RADIUS  # chat de proximité et FX suivent le même filtrage
+STATS_LOG_EVERY = 60.0    # s entre deux lignes de stats serveur (0 = désactivé)
+MAX_CONNECTIONS = 1000    # connexions simultanées acceptées (au-delà: fermeture immédiate)
+READ_TIMEOUT = 120.0      # s sans aucun message client -> déconnexion (mode asyncio)
+WRITE_TIMEOUT = 10.0      # s max pour vider le tampon d'envoi d'un client (mode asyncio)
+OUTBOX_MAX = 256          # trames en attente par client; au-delà le client est jugé mort
+CMD_PENDING_MAX = 64      # mode asyncio: commandes décodées en attente par client avant de suspendre sa lecture
+CMD_BATCH_MAX = 2000      # commandes exécutées au plus par passage du thread logique
+CHUNK_RING = 1            # rayon (en chunks) poussé automatiquement autour de chaque joueur
+CHUNK_KEEP = CHUNK_RING + 2  # au-delà (en chunks): chunk envoyé oublié, get_chunks refusé
+MAX_CHUNKS_PER_REQUEST = 16
+SHARD_STRIP_CHUNKS = 16   # mode shardé: largeur (en chunks) d'une bande de région
+HANDOFF_MARGIN = 80       # px à franchir au-delà d'une frontière avant de passer le joueur au voisin
+GHOST_EVERY_TICKS = 5     # cadence du mirroring des entités proches des frontières
 
 # Sorts (slots 1..4) par classe
 SPELLS_BY_CLASS = {
@@ -40,6 +65,90 @@ SPELLS_BY_CLASS = {
     },
 }
 
+# ---------- Entités ----------
+# Joueurs, mobs, objets au sol et projectiles: champs en __slots__ (pas de dict par entité) mais
+# même interface que les dicts d'origine (e["hp"], e.get, in, items) et mêmes clés, dans le même
+# ordre. Chaque entité garde sa forme figée (wire.FrozenEntity, qui mémorise ses encodages):
+# tant qu'aucun champ n'est réécrit, tous les snapshots de tous les clients partagent le même
+# objet, déjà encodé. Cette forme n'existe que pour les entités diffusées: toute écriture la
+# jette, et celle d'une entité sortie de toutes les vues est jetée au passage LOD suivant.
+# Un champ absent (villageois sans atk_until...) est un slot non rempli.
+class Entity:
+    """Entité à champs déclarés (FIELDS) lue et écrite comme un dict; toute autre clé est
+    absente (KeyError). Toute écriture par __setitem__ invalide la copie figée; un dict imbriqué
+    (stats, équipement) modifié en place doit être suivi de touch()."""
+    __slots__ = ("_frozen", "_shown")  # _shown: snapshot_seq de la dernière diffusion
+    FIELDS = ()
+    _FIELD_SET = frozenset()
+
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, d=()):
+        self._frozen = None; self._shown = 0
+        for k, v in dict(d).items():
+            setattr(self, k, v)
+
+    def __getitem__(self, k):
+        if k in self._FIELD_SET:
+            try:
+                return getattr(self, k)
+            except AttributeError:
+                pass  # champ déclaré mais jamais posé
+        raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        if k not in self._FIELD_SET:
+            raise KeyError(k)
+        setattr(self, k, v); self._frozen = None
+
+    def touch(self): self._frozen = None
+
+    def move_to(self, x, y):
+        """e["x"], e["y"] = x, y en un appel (chemin chaud des pas groupés)."""
+        self.x = x; self.y = y; self._frozen = None
+
+    def __contains__(self, k): return k in self._FIELD_SET and hasattr(self, k)
+    def get(self, k, default=None): return getattr(self, k, default) if k in self._FIELD_SET else default
+    def keys(self): return [f for f in self.FIELDS if hasattr(self, f)]
+    def __iter__(self): return iter(self.keys())
+    def __len__(self): return len(self.keys())
+    def items(self): return [(f, getattr(self, f)) for f in self.keys()]
+    def values(self): return [getattr(self, f) for f in self.keys()]
+    def to_dict(self): return dict(self.items())
+    def __repr__(self): return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def setdefault(self, k, default=None):
+        if not hasattr(self, k):
+            self[k] = default
+        return getattr(self, k)
+
+    def frozen(self):
+        """Copie figée (lock tenu), reconstruite seulement si l'entité a été modifiée depuis."""
+        fr = self._frozen
+        if fr is None:
+            fr = self._frozen = wire.FrozenEntity(_copy_entity(self))
+        return fr
+
+class Player(Entity):
+    FIELDS = ("name", "x", "y", "hp", "max_hp", "mp", "max_mp", "dead", "respawn_at", "level", "xp", "next_xp",
+              "gold", "weapon_bonus", "weapon_name", "class", "race", "stats", "stat_points", "equipment",
+              "_gear_bonus_stats")
+    __slots__ = FIELDS
+
+class Mob(Entity):
+    FIELDS = ("x", "y", "dx", "dy", "last_hit_by", "name", "hp", "max_hp", "hostile", "speed", "dmg", "atk_until")
+    __slots__ = FIELDS
+
+class Item(Entity):
+    FIELDS = ("x", "y", "name", "type", "power", "dest_x", "dest_y")
+    __slots__ = FIELDS
+
+class Projectile(Entity):
+    FIELDS = ("x", "y", "vx", "vy", "dmg", "owner", "expire_at")
+    __slots__ = FIELDS
+
 # ---------- État ----------
 lock = threading.RLock()
 active_usernames = set()  # anti double-login même compte
@@ -48,64 +157,202 @@ players = {}         # pid -> {...}
 inventories = {}     # pid -> [items]
 cooldowns = {}       # pid -> {"spells": {slot: ready_ts}}
 next_id = 1
+ID_STEP = 1          # pas des compteurs d'ids (SHARD_COUNT en mode shardé: ids uniques entre shards)
 
 # Comptes / persistance
-ACCOUNTS_PATH = "accounts.json"
+ACCOUNTS_PATH = "accounts.json"   # ancien format: migré une seule fois vers ACCOUNTS_DB_PATH
+ACCOUNTS_DB_PATH = "accounts.db"  # sqlite3 (WAL): une ligne par compte, une ligne par personnage
+SAVE_EVERY = 5.0                  # commit groupé des lignes modifiées
+SAVE_SOON_DELAY = 0.05            # register/create_character: commit anticipé, groupé avec les voisins
 accounts = {"users": {}}  # {username: {"password": hash, "characters": {cid: {...}}, "next_char_id": int}}
 pid_identity = {}  # pid -> {"username": str, "char_id": str}
-_dirty_users = set()
+_dirty = set()     # (username, None) = ligne compte, (username, cid) = ligne personnage
+_save_soon = threading.Event()
+_db = None
+save_stats = {"commits": 0, "rows": 0, "errors": 0, "last_ms": 0.0, "max_ms": 0.0,  # encodage + commit
+              "hold_last_ms": 0.0, "hold_max_ms": 0.0}  # lock tenu pour le snapshot
 
 def _hash_pw(pw: str) -> str:
     return hashlib.sha256(("py_mmo_salt::" + (pw or "")).encode("utf-8")).hexdigest()
 
+def _open_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(ACCOUNTS_DB_PATH, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")  # WAL: un crash ne perd que le dernier commit
+        _db.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        _db.execute("CREATE TABLE IF NOT EXISTS characters (username TEXT NOT NULL, char_id TEXT NOT NULL, "
+                    "data TEXT NOT NULL, PRIMARY KEY (username, char_id)) WITHOUT ROWID")
+    return _db
+
+def _write_rows(db, user_rows, char_rows):
+    with db:  # une transaction: tout ou rien
+        db.executemany("INSERT OR REPLACE INTO users VALUES (?, ?)", user_rows)
+        db.executemany("INSERT OR REPLACE INTO characters VALUES (?, ?, ?)", char_rows)
+
+def _migrate_json(db):
+    if not os.path.exists(ACCOUNTS_PATH):
+        return
+    try:
+        with open(ACCOUNTS_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    users = data.get("users") if isinstance(data, dict) else None
+    if not isinstance(users, dict):
+        return
+    _write_rows(db, [(u, json.dumps({k: v for k, v in user.items() if k != "characters"}, ensure_ascii=False))
+                     for u, user in users.items()],
+                [(u, str(cid), json.dumps(ch, ensure_ascii=False))
+                 for u, user in users.items() for cid, ch in (user.get("characters") or {}).items()])
+    print(f"[COMPTES] {len(users)} comptes migrés de {ACCOUNTS_PATH} vers {ACCOUNTS_DB_PATH}")
+
 def load_accounts():
+    """Charge tous les comptes en mémoire; la première fois, importe accounts.json (laissé intact)."""
     global accounts
     try:
-        if os.path.exists(ACCOUNTS_PATH):
-            with open(ACCOUNTS_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, dict) and "users" in data:
-                    accounts = data
-    except Exception:
+        db = _open_db()
+        if owns_accounts() and db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+            _migrate_json(db)
+        users = {}
+        for username, data in db.execute("SELECT username, data FROM users"):
+            users[username] = dict(json.loads(data), characters={})
+        for username, cid, data in db.execute("SELECT username, char_id, data FROM characters"):
+            if username in users:
+                users[username]["characters"][cid] = json.loads(data)
+        accounts = {"users": users}
+    except (sqlite3.Error, ValueError) as e:
+        print(f"[COMPTES] lecture de {ACCOUNTS_DB_PATH} impossible: {e}")
         accounts = {"users": {}}
 
-def save_accounts():
-    tmp = ACCOUNTS_PATH + ".tmp"
+def snapshot_dirty():
+    """Copie sur écriture (lock tenu): prend les références des lignes marquées, sans rien encoder.
+    Les personnages ne sont jamais modifiés sur place (persist_player_to_character les remplace),
+    seule la ligne compte, petite, est copiée."""
+    keys = list(_dirty); _dirty.clear()
+    users = accounts["users"]
+    snap = []
+    for username, cid in keys:
+        user = users.get(username)
+        if not user:
+            continue
+        if cid is None:
+            snap.append((username, None, {k: v for k, v in user.items() if k != "characters"}))
+        elif cid in user.get("characters", {}):
+            snap.append((username, cid, user["characters"][cid]))
+    return keys, snap
+
+def write_snapshot(keys, snap):
+    """Encode et écrit un snapshot en un commit, hors lock. Renvoie le nombre de lignes."""
+    user_rows = [(u, json.dumps(d, ensure_ascii=False)) for u, cid, d in snap if cid is None]
+    char_rows = [(u, cid, json.dumps(d, ensure_ascii=False)) for u, cid, d in snap if cid is not None]
     try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(accounts, f, indent=2, ensure_ascii=False)
-        os.replace(tmp, ACCOUNTS_PATH)
-    except Exception:
-        pass
+        _write_rows(_open_db(), user_rows, char_rows)
+    except sqlite3.Error as e:
+        with lock:
+            _dirty.update(keys)  # réessai au prochain passage
+        save_stats["errors"] += 1
+        print(f"[COMPTES] écriture impossible: {e}")
+        return 0
+    return len(snap)
 
-def mark_dirty(username: str):
+def save_accounts():
+    """Commit des lignes marquées par mark_dirty. Le lock n'est tenu que pour le snapshot: encodage
+    et écriture se font après. Renvoie le nombre de lignes écrites."""
+    t0 = time.perf_counter()
+    with lock:
+        if not owns_accounts():
+            _dirty.clear()
+            return 0  # mode shardé: seul le shard 0 écrit les comptes
+        if not _dirty:
+            return 0
+        keys, snap = snapshot_dirty()
+    t1 = time.perf_counter()
+    n = write_snapshot(keys, snap)
+    t2 = time.perf_counter()
+    hold, ms = (t1 - t0) * 1000.0, (t2 - t1) * 1000.0
+    save_stats["commits"] += 1; save_stats["rows"] += n
+    save_stats["last_ms"] = ms; save_stats["max_ms"] = max(save_stats["max_ms"], ms)
+    save_stats["hold_last_ms"] = hold; save_stats["hold_max_ms"] = max(save_stats["hold_max_ms"], hold)
+    return n
+
+def mark_dirty(username: str, char_id=None):
+    """Marque la ligne du compte (char_id None) ou d'un de ses personnages pour le prochain commit."""
     if username:
-        _dirty_users.add(username)
+        _dirty.add((username, None if char_id is None else str(char_id)))
+
+def save_soon():
+    _save_soon.set()
 
 def saver_loop():
     while True:
-        time.sleep(5.0)
-        to_save = None
-        with lock:
-            if _dirty_users:
-                to_save = list(_dirty_users)
-                _dirty_users.clear()
-        if to_save is not None:
-            with lock:
-                save_accounts()
+        if _save_soon.wait(SAVE_EVERY):
+            time.sleep(SAVE_SOON_DELAY)  # laisser les requêtes voisines rejoindre le même commit
+            _save_soon.clear()
+        save_accounts()
+
+def stats_loop():
+    if STATS_LOG_EVERY <= 0:
+        return
+    while True:
+        time.sleep(STATS_LOG_EVERY)
+        cs = chunk_store_stats()
+        print(f"[STATS] chunks ram={cs['resident']} disque={cs['spilled']} hits={cs['hits']} "
+              f"miss={cs['misses']} evict={cs['evictions']} relus={cs['spill_reads']} recyclés={cs['spill_recycled']}")
+        ob = outbox_stats()
+        print(f"[STATS] envoi clients={ob['clients']} file_max={ob['depth_max']} file_tot={ob['depth_total']} "
+              f"states_remplacés={ob['state_replaced']} écritures={ob['writes']} octets={ob['bytes']} "
+              f"débordements={ob['overflows']}")
+        ts = dict(tick_stats); tick_stats["work_max"] = 0.0
+        print(f"[STATS] ticks={ts['ticks']} retard={ts['late']} dépassements={ts['overruns']} "
+              f"rattrapés={ts['catchup']} abandonnés={ts['dropped']} pas_max={ts['work_max']*1000:.1f}ms")
+        print(f"[STATS] mobs actifs={lod_stats['active']} intermédiaires={lod_stats['mid']} endormis={lod_stats['asleep']} "
+              f"errances={lod_stats['wandered']} endormissements={lod_stats['slept']} réveils={lod_stats['woken']}")
+        print(f"[STATS] champs de flux construits={flow_stats['builds']} réutilisés={flow_stats['hits']} "
+              f"cache={len(flow_cache)} mobs déviés={flow_stats['steered']}")
+        pr = tick_prof_summary()
+        print("[STATS] profil p50/p99 ms " + " ".join(f"{ph}={a:.2f}/{b:.2f}" for ph, (a, b) in pr.items()))
+        if owns_accounts():
+            sv = dict(save_stats); save_stats["max_ms"] = save_stats["hold_max_ms"] = 0.0
+            print(f"[STATS] comptes commits={sv['commits']} lignes={sv['rows']} erreurs={sv['errors']} "
+                  f"écriture={sv['last_ms']:.1f}ms (max {sv['max_ms']:.1f}) "
+                  f"lock={sv['hold_last_ms']:.2f}ms (max {sv['hold_max_ms']:.2f})")
+        if sharded():
+            print(f"[STATS] shard {SHARD_ID}/{SHARD_COUNT} joueurs={len(players)} mobs={len(npcs)} "
+                  f"passages_out={shard_stats['handoffs_out']} passages_in={shard_stats['handoffs_in']} "
+                  f"fantômes={sum(len(g['players']) + len(g['npcs']) + len(g['items']) for g in list(ghosts.values()))} "
+                  f"erreurs_pairs={shard_stats['peer_errors']}")
 
 # ---------- Monde procédural chunké & collisions ----------
 # types: 0 herbe, 1 montagne/mur (bloquant), 2 eau (bloquant), 3 sable, 4 route/pont
-def is_blocking_tile(t):
-    return t in (1, 2)
+BLOCKING_TILES = (1, 2)
 
-chunk_cache = {}  # (cx,cy) -> 64x64 tiles
+def is_blocking_tile(t):
+    return t in BLOCKING_TILES
+
+# Stockage borné: CHUNK_CACHE_MAX chunks en RAM (ordre LRU), les chunks évincés sont
+# écrits dans un fichier d'enregistrements fixes (CHUNK_BYTES chacun) relu via mmap. Ce fichier
+# est temporaire (supprimé à la sortie, un par processus) et plafonné à CHUNK_SPILL_MAX
+# enregistrements: plein, il réutilise celui du chunk évincé depuis le plus longtemps (tout
+# chunk se régénère depuis WORLD_SEED).
+# Un chunk résident = (tuiles: bytes de 4096 octets ligne par ligne, masque: array('Q') de
+# 64 lignes où le bit lx est à 1 si la tuile (lx, ly) est bloquante).
+CHUNK_CACHE_MAX = 4096            # ~18 Mo (4 Ko de tuiles + 512 o de masque par chunk)
+CHUNK_SPILL_DIR = None            # None: répertoire temporaire du système
+CHUNK_SPILL_MAX = 16384           # enregistrements (64 Mo de fichier au plus)
+CHUNK_BYTES = CHUNK_TILES * CHUNK_TILES
+chunk_cache = OrderedDict()  # (cx,cy) -> (tiles, mask), le plus récent en fin
+chunk_lock = threading.Lock()  # cache LRU et fichier d'évincement: get_chunk est aussi appelé hors du lock global
+chunk_stats = {"hits": 0, "misses": 0, "evictions": 0, "spill_reads": 0, "spill_writes": 0, "spill_recycled": 0}
+_spill = {"file": None, "mm": None, "index": OrderedDict(), "records": 0}  # index LRU: (cx,cy) -> n° d'enregistrement
 
 def _rand_for(cx: int, cy: int, salt: int = 0):
     seed = (cx * 73856093) ^ (cy * 19349663) ^ (WORLD_SEED * 83492791) ^ (salt * 2654435761)
     return random.Random(seed & 0xFFFFFFFF)
 
-def generate_chunk(cx: int, cy: int):
+def _generate_chunk_py(cx: int, cy: int):
+    # Générateur de référence (pur Python), utilisé sans NumPy et pour vérifier la parité
     r = _rand_for(cx, cy)
     tiles = [[0 for _ in range(CHUNK_TILES)] for _ in range(CHUNK_TILES)]
     base_x = cx * CHUNK_TILES
@@ -167,13 +414,209 @@ def generate_chunk(cx: int, cy: int):
         tiles[vy+vh//2][vx+vw//2] = tiles[vy+vh//2][vx+vw//2]  # no-op: juste pour garder une trace de village
     return tiles
 
-def get_chunk(cx: int, cy: int):
+_CHUNK_LOCAL = None  # np.arange(CHUNK_TILES), initialisé au premier appel
+
+def _np_noise(r: random.Random, count: int):
+    # Tire `count` r.random() d'un coup: même MT19937, même conversion 53 bits que random.Random,
+    # puis on recopie l'état pour que la suite (village) reste identique au générateur Python.
+    st = r.getstate()
+    rs = np.random.RandomState()
+    rs.set_state(("MT19937", np.array(st[1][:-1], dtype=np.uint32), st[1][-1]))
+    vals = rs.random_sample(count)
+    _, keys, pos = rs.get_state()[:3]
+    r.setstate((st[0], tuple(int(k) for k in keys) + (int(pos),), None))
+    return vals
+
+def generate_chunk(cx: int, cy: int):
+    """Chunk 64x64 en uint8 (NumPy): bruit, rivières et sable calculés sur tout le tableau.
+    Même disposition que _generate_chunk_py pour un WORLD_SEED donné."""
+    global _CHUNK_LOCAL
+    if np is None:
+        return _generate_chunk_py(cx, cy)
+    if _CHUNK_LOCAL is None:
+        _CHUNK_LOCAL = np.arange(CHUNK_TILES, dtype=np.int64)
+    r = _rand_for(cx, cy)
+    base_x = cx * CHUNK_TILES
+    base_y = cy * CHUNK_TILES
+    river_x = int(20 * math.sin((base_y) * 0.01))
+    river_y = int(20 * math.cos((base_x) * 0.01))
+    gx = base_x + _CHUNK_LOCAL            # colonnes
+    gy = base_y + _CHUNK_LOCAL            # lignes
+    # math.sin/cos sur 64 valeurs par axe: résultats bit à bit identiques au générateur Python
+    sx = np.fromiter((math.sin(x * 0.04) for x in range(base_x, base_x + CHUNK_TILES)), np.float64, CHUNK_TILES)
+    cy_ = np.fromiter((math.cos(y * 0.04) for y in range(base_y, base_y + CHUNK_TILES)), np.float64, CHUNK_TILES)
+    v = (sx[None, :] + cy_[:, None]) * 0.5
+    n = _np_noise(r, CHUNK_TILES * CHUNK_TILES).reshape(CHUNK_TILES, CHUNK_TILES) + 0.5 * v
+    rx = np.abs((gx - river_x) % 64 - 32)[None, :]
+    ry = np.abs((gy - river_y) % 96 - 48)[:, None]
+    water = (rx < 2) | (ry < 2)
+    sand = ~water & ((rx < 3) | (ry < 3))
+    tiles = np.zeros((CHUNK_TILES, CHUNK_TILES), dtype=np.uint8)
+    tiles[(n > 1.25) & ~water & ~sand] = 1
+    tiles[sand] = 3
+    tiles[water] = 2
+    mid = CHUNK_TILES//2
+    if abs(cx) <= 1:
+        tiles[mid-1:mid+1, 6:CHUNK_TILES-6] = 4
+    if abs(cy) <= 1:
+        tiles[6:CHUNK_TILES-6, mid-1:mid+1] = 4
+    if r.random() < 0.07:
+        vx = r.randint(8, CHUNK_TILES-16)
+        vy = r.randint(8, CHUNK_TILES-16)
+        vw = r.randint(8, 14)
+        vh = r.randint(8, 14)
+        tiles[vy:vy+vh, vx:vx+vw] = 3
+        for _ in range(r.randint(1,2)):
+            hx = vx + r.randint(1, max(1, vw-6))
+            hy = vy + r.randint(1, max(1, vh-6))
+            hw = r.randint(4, min(7, vw-2))
+            hh = r.randint(4, min(7, vh-2))
+            tiles[hy, hx:hx+hw] = 1
+            tiles[hy+hh-1, hx:hx+hw] = 1
+            tiles[hy:hy+hh, hx] = 1
+            tiles[hy:hy+hh, hx+hw-1] = 1
+    return tiles
+
+def _blocking_mask(buf: bytes):
+    if np is not None:
+        bits = np.isin(np.frombuffer(buf, dtype=np.uint8), BLOCKING_TILES).reshape(CHUNK_TILES, CHUNK_TILES)
+        return array("Q", np.packbits(bits, axis=1, bitorder="little").view("<u8").ravel().tolist())
+    mask = array("Q")
+    for ly in range(CHUNK_TILES):
+        row = 0
+        for lx, t in enumerate(buf[ly*CHUNK_TILES:(ly+1)*CHUNK_TILES]):
+            if t in BLOCKING_TILES: row |= 1 << lx
+        mask.append(row)
+    return mask
+
+def _spill_write(key, tiles):
+    index = _spill["index"]
+    if key in index:
+        index.move_to_end(key)
+        return  # chunks immuables: l'enregistrement existant reste valide
+    if _spill["file"] is None:
+        # contenu entièrement régénérable depuis WORLD_SEED: on repart d'un fichier vide
+        _spill["file"] = tempfile.TemporaryFile(prefix="chunks-", suffix=".spill", dir=CHUNK_SPILL_DIR)
+    if _spill["records"] < CHUNK_SPILL_MAX:
+        rec = _spill["records"]; _spill["records"] = rec + 1
+    else:
+        _, rec = index.popitem(last=False)  # fichier plein: ce chunk-là sera régénéré au besoin
+        chunk_stats["spill_recycled"] += 1
+    f = _spill["file"]
+    f.seek(rec * CHUNK_BYTES); f.write(_chunk_bytes(tiles)); f.flush()
+    index[key] = rec
+    chunk_stats["spill_writes"] += 1
+
+def _spill_read(key):
+    rec = _spill["index"].get(key)
+    if rec is None:
+        return None
+    _spill["index"].move_to_end(key)
+    end = (rec + 1) * CHUNK_BYTES
+    mm = _spill["mm"]
+    if mm is None or len(mm) < end:
+        # le fichier a grandi depuis le dernier mapping
+        if mm is not None: mm.close()
+        mm = _spill["mm"] = mmap.mmap(_spill["file"].fileno(), 0, access=mmap.ACCESS_READ)
+    chunk_stats["spill_reads"] += 1
+    return mm[rec * CHUNK_BYTES:end]
+
+def _chunk_entry(cx: int, cy: int):
     key = (cx, cy)
-    ch = chunk_cache.get(key)
-    if ch is None:
-        ch = generate_chunk(cx, cy)
-        chunk_cache[key] = ch
-    return ch
+    with chunk_lock:
+        ch = chunk_cache.get(key)
+        if ch is not None:
+            chunk_cache.move_to_end(key)
+            chunk_stats["hits"] += 1
+            return ch
+        buf = _spill_read(key)
+        if buf is None:
+            chunk_stats["misses"] += 1
+            buf = _chunk_bytes(generate_chunk(cx, cy))
+        ch = chunk_cache[key] = (buf, _blocking_mask(buf))
+        while len(chunk_cache) > CHUNK_CACHE_MAX:
+            old_key, old = chunk_cache.popitem(last=False)
+            _spill_write(old_key, old[0])
+            chunk_stats["evictions"] += 1
+        return ch
+
+def get_chunk(cx: int, cy: int) -> bytes:
+    """Tuiles du chunk, 4096 octets ligne par ligne: tuile (lx, ly) = tiles[ly*CHUNK_TILES + lx]."""
+    return _chunk_entry(cx, cy)[0]
+
+def get_chunk_mask(cx: int, cy: int):
+    return _chunk_entry(cx, cy)[1]
+
+def chunk_store_stats():
+    with chunk_lock:
+        return {**chunk_stats, "resident": len(chunk_cache), "spilled": len(_spill["index"])}
+
+# ---------- Streaming des chunks ----------
+# Encodage compact: RLE (compte 1..255, valeur) sur les 4096 tuiles, puis base64
+# pour rester transportable dans le flux JSON. Un chunk typique tient en ~1-2 Ko
+# au lieu de ~12 Ko de listes JSON.
+def _chunk_bytes(tiles) -> bytes:
+    if isinstance(tiles, (bytes, bytearray)):
+        return bytes(tiles)
+    if np is not None and isinstance(tiles, np.ndarray):
+        return tiles.tobytes()
+    return bytes(v for row in tiles for v in row)
+
+def encode_chunk_rle(tiles) -> bytes:
+    raw = _chunk_bytes(tiles)
+    out = bytearray()
+    i, n = 0, len(raw)
+    while i < n:
+        v = raw[i]; j = i + 1
+        while j < n and j - i < 255 and raw[j] == v:
+            j += 1
+        out.append(j - i); out.append(v)
+        i = j
+    return bytes(out)
+
+def chunk_payload(cx: int, cy: int):
+    data = encode_chunk_rle(get_chunk(cx, cy))
+    return {"cx": cx, "cy": cy, "enc": "rle", "data": base64.b64encode(data).decode("ascii")}
+
+def chunk_of_pos(x, y):
+    span = CHUNK_TILES * TILE
+    return int(math.floor(x / span)), int(math.floor(y / span))
+
+def chunk_in_reach(key, here):
+    return abs(key[0]-here[0]) <= CHUNK_KEEP and abs(key[1]-here[1]) <= CHUNK_KEEP
+
+sent_chunks = {}         # pid -> {(cx,cy)} déjà envoyés
+last_player_chunk = {}   # pid -> (cx,cy) au dernier push
+
+def push_chunk_ring(pid, force=False):
+    """Envoie au joueur les chunks de l'anneau CHUNK_RING qu'il n'a pas encore reçus.
+    Ne fait rien tant que le joueur reste dans le même chunk (sauf force)."""
+    with lock:
+        p = players.get(pid)
+        if not p: return
+        here = chunk_of_pos(p["x"], p["y"])
+        if not force and last_player_chunk.get(pid) == here:
+            return
+        last_player_chunk[pid] = here
+        sent = sent_chunks.setdefault(pid, set())
+        # oublier les chunks lointains: le client les garde, on les renverra au besoin
+        for c in [c for c in sent if not chunk_in_reach(c, here)]:
+            sent.discard(c)
+        lst = []
+        for dy in range(-CHUNK_RING, CHUNK_RING+1):
+            for dx in range(-CHUNK_RING, CHUNK_RING+1):
+                key = (here[0]+dx, here[1]+dy)
+                if key not in sent:
+                    sent.add(key)
+                    lst.append(chunk_payload(*key))
+    if lst:
+        send_to(pid, {"type":"chunks", "list": lst})
+
+def stream_chunks_for_all():
+    with lock:
+        pids = list(clients.keys())
+    for pid in pids:
+        push_chunk_ring(pid)
 
 def get_tile_at(tx: int, ty: int) -> int:
     cx = math.floor(tx / CHUNK_TILES)
@@ -182,28 +625,122 @@ def get_tile_at(tx: int, ty: int) -> int:
     ly = int(ty - cy * CHUNK_TILES)
     tiles = get_chunk(cx, cy)
     if 0 <= ly < CHUNK_TILES and 0 <= lx < CHUNK_TILES:
-        return tiles[ly][lx]
+        return tiles[ly * CHUNK_TILES + lx]
     return 0
 
+# ---------- Index spatial ----------
+# Grille uniforme de cellules GRID_CELL px -> ids. Chaque index référence son dict d'entités
+# (players, npcs, items, projs) et doit être tenu à jour à chaque ajout/déplacement/retrait.
+GRID_CELL = 128
+
+class SpatialHash:
+    def __init__(self, store, cell=GRID_CELL):
+        self.store = store
+        self.cell = cell
+        self.cells = {}   # (gx, gy) -> set d'ids
+        self.where = {}   # id -> (gx, gy)
+
+    def _key(self, x, y):
+        return (int(x // self.cell), int(y // self.cell))
+
+    def insert(self, eid, x, y):
+        k = self._key(x, y)
+        old = self.where.get(eid)
+        if old == k:
+            return
+        if old is not None:
+            cell = self.cells[old]; cell.discard(eid)
+            if not cell: del self.cells[old]
+        self.where[eid] = k
+        self.cells.setdefault(k, set()).add(eid)
+
+    move = insert  # déplacement = réinsertion (no-op si la cellule ne change pas)
+
+    def remove(self, eid):
+        k = self.where.pop(eid, None)
+        if k is not None:
+            cell = self.cells[k]; cell.discard(eid)
+            if not cell: del self.cells[k]
+
+    def candidates(self, x, y, r):
+        """ids des cellules recouvrant le carré [x-r, x+r]² (sans test de distance)."""
+        gx0, gy0 = self._key(x - r, y - r); gx1, gy1 = self._key(x + r, y + r)
+        cells = self.cells
+        if (gx1 - gx0 + 1) * (gy1 - gy0 + 1) > len(cells):
+            # rayon énorme face à peu de cellules occupées: parcourir les cellules existantes
+            for (gx, gy), ids in cells.items():
+                if gx0 <= gx <= gx1 and gy0 <= gy <= gy1:
+                    yield from ids
+            return
+        for gx in range(gx0, gx1 + 1):
+            for gy in range(gy0, gy1 + 1):
+                ids = cells.get((gx, gy))
+                if ids: yield from ids
+
+    def query_radius(self, x, y, r):
+        """ids à distance <= r de (x, y), triés (ordre d'insertion des dicts d'origine)."""
+        store = self.store; r2 = r * r; out = []
+        for eid in self.candidates(x, y, r):
+            e = store[eid]
+            dx = e["x"] - x; dy = e["y"] - y
+            if dx*dx + dy*dy <= r2:
+                out.append(eid)
+        out.sort()
+        return out
+
+    def nearest(self, x, y, max_r, pred=None):
+        """(id, distance) le plus proche à distance < max_r (et vérifiant pred), sinon (None, max_r).
+        Anneaux de cellules croissants; à distance égale, le plus petit id gagne."""
+        store = self.store; cell = self.cell
+        gx, gy = self._key(x, y)
+        best = None; best_d = max_r
+        rings = int(max_r // cell) + 1
+        for ring in range(rings + 1):
+            # au-delà de ce rayon, aucune cellule de l'anneau ne peut battre best_d
+            if best is not None and (ring - 1) * cell > best_d:
+                break
+            for cx in range(gx - ring, gx + ring + 1):
+                for cy in (range(gy - ring, gy + ring + 1) if cx in (gx - ring, gx + ring) else (gy - ring, gy + ring)):
+                    ids = self.cells.get((cx, cy))
+                    if not ids: continue
+                    for eid in ids:
+                        e = store[eid]
+                        if pred is not None and not pred(e): continue
+                        d = math.hypot(e["x"] - x, e["y"] - y)
+                        if d < best_d or (d == best_d and best is not None and eid < best):
+                            best, best_d = eid, d
+        return best, best_d
+
+    def clear(self):
+        self.cells.clear(); self.where.clear()
+
+player_grid = SpatialHash(players)
+def _alive(p): return not p["dead"]
+
 # PNJ (mobs)
 npcs = {}           # nid -> {...}
+npc_grid = SpatialHash(npcs)
 next_npc_id = 1
 
 def spawn_mob_at(x: int, y: int):
+    # lock tenu par l'appelant (le thread logique parcourt npc_grid)
     global next_npc_id
     t = make_mob_template()
-    nid = next_npc_id; next_npc_id += 1
-    npcs[nid] = {"x": x, "y": y, "dx": 0, "dy": 0, "last_hit_by": None, **t}
+    nid = next_npc_id; next_npc_id += ID_STEP
+    npcs[nid] = Mob({"x": x, "y": y, "dx": 0, "dy": 0, "last_hit_by": None, **t})
+    npc_grid.insert(nid, x, y)
     return nid
 
 def spawn_villager_npc(x: int, y: int, name: str = None):
     global next_npc_id
-    nid = next_npc_id; next_npc_id += 1
-    npcs[nid] = {"x": x, "y": y, "dx": 0, "dy": 0, "name": name or "Villageois", "hp": 1000000, "max_hp": 1000000, "hostile": False, "speed": 0.0, "dmg": 0}
+    nid = next_npc_id; next_npc_id += ID_STEP
+    npcs[nid] = Mob({"x": x, "y": y, "dx": 0, "dy": 0, "name": name or "Villageois", "hp": 1000000, "max_hp": 1000000, "hostile": False, "speed": 0.0, "dmg": 0})
+    npc_grid.insert(nid, x, y)
     return nid
 
 # Items au sol
 items = {}          # iid -> {"x","y","name","type","power":int, ...}
+item_grid = SpatialHash(items)
 next_item_id = 1
 
 # Portails / Donjons
@@ -215,22 +752,130 @@ def create_dungeon_area(x0_tile: int, y0_tile: int, w_tiles: int, h_tiles: int):
         cy = (y0_tile + 2 + random.randint(0, max(1, h_tiles - 4))) * TILE + TILE // 2
         nid = spawn_mob()
         npcs[nid]["x"] = cx; npcs[nid]["y"] = cy
+        npc_grid.move(nid, cx, cy)
 
 def spawn_portal_to_dungeon():
     global next_item_id
-    sx, sy = random_free_pos()
+    sx, sy = random_free_pos(*region_spawn_center())
     x0_tile = random.randint(GRID_W//2, GRID_W-15)
     y0_tile = random.randint(GRID_H//2, GRID_H-15)
-    create_dungeon_area(x0_tile, y0_tile, 12, 10)
     dx = x0_tile*TILE + 6*TILE
     dy = y0_tile*TILE + 5*TILE
-    iid = next_item_id; next_item_id += 1
-    items[iid] = {"x": sx, "y": sy, "name": "Portail instable", "type": "portal", "power": 0, "dest_x": dx, "dest_y": dy}
-    iid2 = next_item_id; next_item_id += 1
-    items[iid2] = {"x": dx, "y": dy, "name": "Portail de sortie", "type": "portal", "power": 0, "dest_x": sx, "dest_y": sy}
+    if not (owns_x(sx) and owns_x(dx)):
+        return  # mode shardé: les deux extrémités doivent être dans notre région
+    create_dungeon_area(x0_tile, y0_tile, 12, 10)
+    iid = next_item_id; next_item_id += ID_STEP
+    items[iid] = Item({"x": sx, "y": sy, "name": "Portail instable", "type": "portal", "power": 0, "dest_x": dx, "dest_y": dy})
+    item_grid.insert(iid, sx, sy)
+    iid2 = next_item_id; next_item_id += ID_STEP
+    items[iid2] = Item({"x": dx, "y": dy, "name": "Portail de sortie", "type": "portal", "power": 0, "dest_x": sx, "dest_y": sy})
+    item_grid.insert(iid2, dx, dy)
 
 # Projectiles actifs (sort 1)
-projs = {}          # proj_id -> {"x","y","vx","vy","dmg","owner","expire_at"}
+class ProjectileRow(dict):
+    """Lecture d'un projectile du ProjectileStore: une copie, donc en lecture seule (une écriture
+    serait perdue en silence). Le store se modifie par ses colonnes."""
+    __slots__ = ()
+
+    def _read_only(self, *a, **kw):
+        raise TypeError("projectile en lecture seule: modifier les colonnes du ProjectileStore")
+
+    __setitem__ = __delitem__ = setdefault = update = pop = popitem = clear = _read_only
+
+class ProjectileStore:
+    """Projectiles en colonnes NumPy (une ligne par projectile, dans l'ordre des ids).
+    Se comporte comme le dict projs: proj_id -> {"x","y","vx","vy","dmg","owner","expire_at"}
+    (ProjectileRow construits à la lecture). Un projectile pas encore avancé est rendu avec les
+    valeurs insérées, pour des snapshots identiques au mode dict. pop() ne fait que marquer la
+    ligne (id -1); les lignes marquées partent au compact() suivant. Sert aussi d'index spatial."""
+    def __init__(self, cap=256):
+        self.n = 0
+        self.ids = np.zeros(cap, np.int64)
+        self.x = np.zeros(cap); self.y = np.zeros(cap)
+        self.vx = np.zeros(cap); self.vy = np.zeros(cap)
+        self.dmg = np.zeros(cap, np.int64); self.owner = np.zeros(cap, np.int64)
+        self.expire_at = np.zeros(cap)
+        self.row = {}     # proj_id -> ligne (projectiles vivants seulement)
+        self.fresh = {}   # proj_id -> valeurs insérées tant qu'il n'a pas bougé
+
+    _COLS = ("ids", "x", "y", "vx", "vy", "dmg", "owner", "expire_at")
+
+    def __setitem__(self, pid, e):
+        if pid in self.row:
+            self.pop(pid)
+        if self.n == len(self.ids):
+            if len(self.row) < self.n:
+                self.compact(self.ids[:self.n] >= 0)  # place libérée par des pop()
+            else:
+                for c in self._COLS:
+                    a = getattr(self, c); setattr(self, c, np.concatenate([a, np.zeros_like(a)]))
+        i = self.n; self.n += 1
+        self.ids[i] = pid; self.x[i] = e["x"]; self.y[i] = e["y"]; self.vx[i] = e["vx"]; self.vy[i] = e["vy"]
+        self.dmg[i] = e["dmg"]; self.owner[i] = -1 if e["owner"] is None else e["owner"]
+        self.expire_at[i] = e["expire_at"]
+        self.row[pid] = i; self.fresh[pid] = ProjectileRow(e.items())
+
+    def __getitem__(self, pid):
+        e = self.fresh.get(pid)
+        if e is not None:
+            return e
+        i = self.row[pid]; owner = int(self.owner[i])
+        return ProjectileRow(x=float(self.x[i]), y=float(self.y[i]), vx=float(self.vx[i]), vy=float(self.vy[i]),
+                             dmg=int(self.dmg[i]), owner=owner if owner >= 0 else None, expire_at=float(self.expire_at[i]))
+
+    def __contains__(self, pid): return pid in self.row
+    def __len__(self): return len(self.row)
+    def __iter__(self):
+        ids = self.ids[:self.n]
+        return iter(ids[ids >= 0].tolist())
+    def keys(self): return list(self)
+    def values(self): return [self[k] for k in self]
+    def items(self): return [(k, self[k]) for k in self]
+    def get(self, pid, default=None): return self[pid] if pid in self.row else default
+
+    def pop(self, pid, default=None):
+        if pid not in self.row:
+            return default
+        e = self[pid]
+        self.ids[self.row.pop(pid)] = -1
+        self.fresh.pop(pid, None)
+        return e
+
+    def compact(self, keep):
+        """Ne garde que les lignes où keep est vrai (ordre conservé)."""
+        n = int(keep.sum())
+        if n != self.n:
+            for c in self._COLS:
+                a = getattr(self, c); a[:n] = a[:self.n][keep]
+            self.n = n
+            ids = self.ids[:n].tolist()
+            self.row = dict(zip(ids, range(n)))
+            self.fresh = {k: v for k, v in self.fresh.items() if k in self.row}
+
+    def advance(self, sub):
+        # mêmes opérations flottantes que le mode dict: sub demi-pas successifs
+        n = self.n
+        for _ in range(sub):
+            self.x[:n] += self.vx[:n] / sub; self.y[:n] += self.vy[:n] / sub
+        self.fresh.clear()
+
+    def query_radius(self, x, y, r):
+        n = self.n
+        dx = self.x[:n] - x; dy = self.y[:n] - y
+        ids = self.ids[:n]
+        return ids[(dx*dx + dy*dy <= r * r) & (ids >= 0)].tolist()
+
+    # interface SpatialHash: les positions sont lues directement dans les colonnes
+    def insert(self, pid, x, y): pass
+    move = insert
+    def remove(self, pid): pass
+
+if np is not None and SIM_NUMPY:
+    projs = ProjectileStore()
+    proj_grid = projs
+else:
+    projs = {}      # proj_id -> {"x","y","vx","vy","dmg","owner","expire_at"}
+    proj_grid = SpatialHash(projs)
 next_proj_id = 1
 
 # ---------- Utils ----------
@@ -238,17 +883,24 @@ def aabb_overlap(ax, ay, aw, ah, bx, by, bw, bh):
     return (ax < bx + bw and ax + aw > bx and ay < by + bh and ay + ah > by)
 
 def is_colliding_rect(cx, cy, w, h):
+    # test du rectangle contre les masques de blocage: une opération & par ligne de tuiles
+    # (et par chunk traversé), au lieu d'un get_tile_at par tuile couverte
     x0 = int((cx - w/2) // TILE)
     y0 = int((cy - h/2) // TILE)
     x1 = int((cx + w/2) // TILE)
     y1 = int((cy + h/2) // TILE)
+    key = mask = None
     for ty in range(y0, y1 + 1):
-        for tx in range(x0, x1 + 1):
-            t = get_tile_at(tx, ty)
-            # bloquant: uniquement montagnes/murs (1) et eau (2)
-            # sable (3) et herbe (0) sont traversables
-            if is_blocking_tile(t):
+        ccy, ly = divmod(ty, CHUNK_TILES)
+        tx = x0
+        while tx <= x1:
+            ccx, lx = divmod(tx, CHUNK_TILES)
+            if key != (ccx, ccy):
+                key = (ccx, ccy); mask = get_chunk_mask(ccx, ccy)
+            end = min(x1, tx - lx + CHUNK_TILES - 1)
+            if mask[ly] >> lx & ((1 << (end - tx + 1)) - 1):
                 return True
+            tx = end + 1
     return False
 
 def move_with_collisions(cx, cy, dx, dy, size):
@@ -260,6 +912,44 @@ def move_with_collisions(cx, cy, dx, dy, size):
         ny = cy
     return nx, ny
 
+# Versions NumPy (pas groupés de ProjectileStore et des mobs): mêmes tests, mêmes arrondis, pour
+# des tableaux de positions. Les masques des chunks traversés sont empilés une fois par appel.
+_CHUNK_KEY = 1 << 32
+
+def tiles_blocking_np(tx, ty):
+    """Tuiles (tx[i], ty[i]) bloquantes? (tableaux d'entiers -> tableau de booléens)"""
+    ccx = tx // CHUNK_TILES; ccy = ty // CHUNK_TILES
+    keys, inv = np.unique(ccx * _CHUNK_KEY + (ccy + (1 << 31)), return_inverse=True)
+    masks = np.stack([np.frombuffer(get_chunk_mask(int(k >> 32), int(k & 0xFFFFFFFF) - (1 << 31)), np.uint64)
+                      for k in keys.tolist()])
+    rows = masks[inv.ravel(), ty - ccy * CHUNK_TILES]
+    return (rows >> (tx - ccx * CHUNK_TILES).astype(np.uint64)) & np.uint64(1) != 0
+
+def rects_colliding_np(cx, cy, size):
+    """is_colliding_rect(cx[i], cy[i], size, size) pour chaque i."""
+    hit = np.zeros(len(cx), bool)
+    if not len(cx):
+        return hit
+    h = size / 2
+    x0 = ((cx - h) // TILE).astype(np.int64); x1 = ((cx + h) // TILE).astype(np.int64)
+    y0 = ((cy - h) // TILE).astype(np.int64); y1 = ((cy + h) // TILE).astype(np.int64)
+    span = int(size // TILE) + 2  # tuiles couvertes au plus par axe
+    for j in range(span):
+        ty = np.minimum(y0 + j, y1)
+        for i in range(span):
+            hit |= tiles_blocking_np(np.minimum(x0 + i, x1), ty)
+    return hit
+
+def move_with_collisions_np(cx, cy, dx, dy, size):
+    """move_with_collisions groupé: (x glissé, y glissé, x bloqué?, y bloqué?). Un axe bloqué
+    garde sa valeur d'origine côté appelant (un entier reste un entier, comme en mode dict)."""
+    nx = cx + dx
+    bx = rects_colliding_np(nx, cy, size)
+    nx = np.where(bx, cx, nx)
+    ny = cy + dy
+    by = rects_colliding_np(nx, ny, size)
+    return nx, ny, bx, by
+
 def random_free_pos(center_x: int = 0, center_y: int = 0, radius_tiles: int = 64):
     for _ in range(200):
         tx = int(center_x // TILE) + random.randint(-radius_tiles, radius_tiles)
@@ -271,50 +961,331 @@ def random_free_pos(center_x: int = 0, center_y: int = 0, radius_tiles: int = 64
     return center_x or TILE * 4, center_y or TILE * 4
 
 def dist(x1,y1,x2,y2): return math.hypot(x1-x2, y1-y2)
-def now(): return time.time()
+# Horloge unique du monde (recharges, expirations, réapparitions, pas de simulation): monotone,
+# commune aux processus d'une même machine (shards) et insensible aux réglages de l'heure murale.
+def now(): return time.monotonic()
+
+conn_proto = {}  # conn -> protocole négocié au login (wire.PROTO_JSON par défaut)
+client_msgs = {} # conn -> messages clients traités (hors shard_*): rejeu par router.py après un passage
+
+# ---------- Files d'envoi par client ----------
+# Chaque connexion a une file bornée vidée par son propre écrivain (thread en mode threads,
+# callback de la boucle en mode asyncio): un client lent ne bloque plus les autres.
+# Une seule trame "state" attend à la fois: la plus récente remplace l'ancienne (les deltas
+# se basent sur le dernier snapshot acquitté, pas sur le dernier envoyé).
+class Outbox:
+    def __init__(self, conn, on_ready=None):
+        self.conn = conn
+        self.on_ready = on_ready      # None: un thread écrivain attend sur self.cond
+        self.cond = threading.Condition()
+        self.frames = deque()
+        self.state = None
+        self.closed = False
+        self.replaced = 0             # trames state remplacées avant envoi
+        self.writes = 0
+        self.bytes = 0
+
+    def push(self, data, is_state=False):
+        with self.cond:
+            if self.closed:
+                return False
+            if is_state:
+                if self.state is not None: self.replaced += 1
+                self.state = data
+            elif len(self.frames) >= OUTBOX_MAX:
+                self.closed = True
+                outbox_counters["overflows"] += 1
+                self.cond.notify()
+                return False
+            else:
+                self.frames.append(data)
+            pending = getattr(_out_batch, "pending", None)
+            if pending is not None:
+                pending.add(self)  # réveil groupé en fin de tick
+                return True
+            self.cond.notify()
+        if self.on_ready: self.on_ready()
+        return True
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+        if self.on_ready: self.on_ready()
+
+    def _take(self):
+        # lock tenu: tout ce qui attend part en une seule écriture, l'état en dernier
+        parts = list(self.frames); self.frames.clear()
+        if self.state is not None:
+            parts.append(self.state); self.state = None
+        data = b"".join(parts)
+        if data:
+            self.writes += 1; self.bytes += len(data)
+        return data
+
+    def take_nowait(self):
+        with self.cond:
+            return self._take()
+
+    def take(self):
+        with self.cond:
+            while not self.frames and self.state is None and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            return self._take()
+
+    def depth(self):
+        with self.cond:
+            return len(self.frames) + (self.state is not None)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+outboxes = {}  # conn -> Outbox
+outbox_counters = {"overflows": 0}
+_out_batch = threading.local()  # .pending: set d'Outbox à réveiller (bloc outbox_batch)
+
+class outbox_batch:
+    """Dans ce bloc, les trames sont mises en file sans réveiller les écrivains; ils sont
+    réveillés une seule fois à la sortie (une écriture par client et par tick)."""
+    def __enter__(self):
+        _out_batch.pending = set()
+    def __exit__(self, *exc):
+        pending, _out_batch.pending = getattr(_out_batch, "pending", None) or set(), None
+        for ob in pending:
+            ob.wake()
+
+def _writer_loop(ob):
+    while True:
+        data = ob.take()
+        if data is None:
+            break
+        try:
+            ob.conn.sendall(data)
+        except OSError:
+            break
+    ob.close()
+    try: ob.conn.close()  # le thread lecteur sort et fait le ménage (end_session)
+    except OSError: pass
+
+def open_outbox(conn, on_ready=None):
+    ob = Outbox(conn, on_ready)
+    with lock:
+        outboxes[conn] = ob
+    if on_ready is None:
+        threading.Thread(target=_writer_loop, args=(ob,), daemon=True).start()
+    return ob
+
+def outbox_stats():
+    with lock:
+        obs = list(outboxes.values())
+    depths = [ob.depth() for ob in obs]
+    return {"clients": len(obs), "depth_max": max(depths, default=0), "depth_total": sum(depths),
+            "state_replaced": sum(ob.replaced for ob in obs), "writes": sum(ob.writes for ob in obs),
+            "bytes": sum(ob.bytes for ob in obs), "overflows": outbox_counters["overflows"]}
+
+def send_frame(conn, data, is_state=False):
+    ob = outboxes.get(conn)
+    if ob is None:
+        try:
+            conn.sendall(data)
+            return True
+        except Exception:
+            return False
+    return ob.push(data, is_state)
 
 def _safe_send(conn, obj):
     try:
-        conn.sendall((json.dumps(obj) + "\n").encode("utf-8"))
-        return True
-    except (BrokenPipeError, ConnectionResetError):
-        return False
+        data = wire.encode(obj, conn_proto.get(conn, wire.PROTO_JSON))
     except Exception:
         return False
+    return send_frame(conn, data, obj.get("type") == "state")
 
-def broadcast_obj(obj):
+def broadcast_obj(obj, pids=None):
     with lock:
-        conns = list(clients.items())
+        if pids is None:
+            conns = list(clients.items())
+        else:
+            conns = [(pid, clients[pid]) for pid in pids if pid in clients]
+        protos = {pid: conn_proto.get(conn, wire.PROTO_JSON) for pid, conn in conns}
+    encoded = {}  # sérialisé une fois par protocole, octets partagés entre les files
     dead = []
     for pid, conn in conns:
-        if not _safe_send(conn, obj):
-            dead.append(pid)
-    if dead:
-        with lock:
-            for pid in dead:
-                try: clients[pid].close()
-                except: pass
-                clients.pop(pid, None)
-                players.pop(pid, None)
-                inventories.pop(pid, None)
-                cooldowns.pop(pid, None)
+        proto = protos[pid]
+        if proto not in encoded:
+            encoded[proto] = wire.encode(obj, proto)
+        if not send_frame(conn, encoded[proto], obj.get("type") == "state"):
+            dead.append(conn)
+    # fermer suffit: le lecteur de la connexion sort et end_session persiste puis nettoie
+    for conn in dead:
+        try: conn.close()
+        except Exception: pass
+
+# ---------- Zone d'intérêt (AOI) ----------
+aoi_known = {}  # pid -> {"players": set, "npcs": set, "items": set} ids (str) connus du client
+
+def pids_near(x, y, radius=AOI_RADIUS):
+    # lock tenu par l'appelant
+    return [pid for pid in player_grid.query_radius(x, y, radius) if pid in clients]
+
+def aoi_view(pid):
+    """Entités visibles par pid (lock tenu). Le joueur lui-même est toujours inclus."""
+    p = players.get(pid)
+    if not p:
+        return None
+    x, y = p["x"], p["y"]
+    seen = {k: players[k] for k in player_grid.query_radius(x, y, AOI_RADIUS)}
+    seen[pid] = p
+    view = {
+        "players": seen,
+        "npcs": {k: npcs[k] for k in npc_grid.query_radius(x, y, AOI_RADIUS)},
+        "items": {k: items[k] for k in item_grid.query_radius(x, y, AOI_RADIUS)},
+        "projs": {str(k): projs[k] for k in proj_grid.query_radius(x, y, AOI_RADIUS)},
+    }
+    if ghosts:
+        add_ghosts(view, x, y)
+    return view
+
+def _aoi_changes(pid, view):
+    # notifications d'entrée/sortie de la zone d'intérêt (les projectiles, éphémères, n'en ont pas)
+    known = aoi_known.setdefault(pid, {"players": set(), "npcs": set(), "items": set()})
+    enter = {}; leave = {}
+    for kind in ("players", "npcs", "items"):
+        ids = {str(k) for k in view[kind]}
+        e = ids - known[kind]; l = known[kind] - ids
+        if e: enter[kind] = sorted(e)
+        if l: leave[kind] = sorted(l)
+        known[kind] = ids
+    if enter or leave:
+        return {"type":"aoi", "enter": enter, "leave": leave}
+    return None
+
+# ---------- Snapshots delta ----------
+# Chaque état porte un numéro de tick (seq). Le client acquitte les seq reçus; on lui envoie
+# ensuite seulement les entités/champs modifiés depuis le dernier snapshot acquitté (base).
+# Sans base connue (nouveau client, resync, base trop ancienne) -> snapshot complet.
+SNAPSHOT_HISTORY = 32     # snapshots conservés par client comme bases possibles
+snapshot_seq = 0
+client_snaps = {}         # pid -> {"acked": seq|None, "hist": OrderedDict(seq -> vue figée)}
+_MISSING = object()
+
+def _copy_entity(e):
+    # un niveau de copie en plus: equipment/stats/inventaire sont modifiés en place
+    return {k: (dict(v) if isinstance(v, dict) else list(v) if isinstance(v, list) else v) for k, v in e.items()}
+
+def _freeze_entity(e):
+    # les fantômes des shards voisins restent des dicts
+    if isinstance(e, Entity):
+        e._shown = snapshot_seq
+        return e.frozen()
+    return _copy_entity(e)
+
+def drop_unshown_frozen():
+    """Jette la forme figée (et ses encodages) des entités absentes de la dernière diffusion
+    (lock tenu); les snapshots qui la référencent encore gardent leur copie."""
+    for store in (players, npcs, items):
+        for e in store.values():
+            if e._frozen is not None and e._shown != snapshot_seq:
+                e._frozen = None
+
+def _freeze_view(view):
+    return {kind: {str(k): _freeze_entity(e) for k, e in ents.items()} for kind, ents in view.items()}
+
+def _delta(base, cur):
+    out = {}; removed = {}
+    for kind, ents in cur.items():
+        b = base.get(kind, {})
+        changed = {}
+        for k, e in ents.items():
+            be = b.get(k)
+            if be is e:
+                continue  # même forme figée: rien n'a changé
+            if be is None:
+                changed[k] = e  # entité nouvelle pour ce client: envoyée entière
+                continue
+            d = {f: v for f, v in e.items() if be.get(f, _MISSING) != v}
+            if d: changed[k] = d
+        out[kind] = changed
+        gone = [k for k in b if k not in ents]
+        if gone: removed[kind] = gone
+    return out, removed
+
+def snapshot_for(pid, seq, view):
+    """Message "state" (complet ou delta) pour pid; lock tenu."""
+    frozen = _freeze_view(view)
+    cs = client_snaps.setdefault(pid, {"acked": None, "hist": OrderedDict()})
+    base = cs["hist"].get(cs["acked"]) if cs["acked"] is not None else None
+    if base is None:
+        msg = {"type":"state", "seq": seq, "full": True, **frozen}
+    else:
+        ents, removed = _delta(base, frozen)
+        msg = {"type":"state", "seq": seq, "base": cs["acked"], **ents, "removed": removed}
+    cs["hist"][seq] = frozen
+    while len(cs["hist"]) > SNAPSHOT_HISTORY:
+        cs["hist"].popitem(last=False)
+    return msg
+
+def ack_snapshot(pid, seq):
+    with lock:
+        cs = client_snaps.get(pid)
+        if not cs or seq not in cs["hist"]:
+            return
+        if cs["acked"] is None or seq > cs["acked"]:
+            cs["acked"] = seq
+            # les snapshots plus anciens ne serviront plus de base
+            for old in [s for s in cs["hist"] if s < seq]:
+                del cs["hist"][old]
+
+def resync_snapshot(pid):
+    with lock:
+        cs = client_snaps.get(pid)
+        if cs: cs["acked"] = None
+
+def forget_client_views(pid):
+    # lock tenu par l'appelant
+    sent_chunks.pop(pid, None)
+    last_player_chunk.pop(pid, None)
+    aoi_known.pop(pid, None)
+    client_snaps.pop(pid, None)
+
+def broadcast_near(x, y, obj, radius=AOI_RADIUS):
+    with lock:
+        pids = pids_near(x, y, radius)
+    broadcast_obj(obj, pids)
 
 _last_broadcast = 0.0
-def broadcast_state(rate_hz=TICK_HZ):
-    global _last_broadcast
+_state_deferred = threading.local()  # .pending: bool tant que run_commands s'exécute (thread logique)
+
+def broadcast_state(rate_hz=TICK_HZ, tick=False):
+    """Diffuse l'état à chaque client; renvoie False si la diffusion est reportée. tick=True:
+    appel de logic_loop après un pas de simulation, jamais limité par l'horloge (ses tours suivent
+    des échéances absolues et peuvent être à un peu moins d'un tick d'écart)."""
+    global _last_broadcast, snapshot_seq
+    if getattr(_state_deferred, "pending", None) is not None:
+        _state_deferred.pending = True  # commandes: un seul état, diffusé par le tour de logic_loop
+        return False
     t = now()
-    if t - _last_broadcast < (1.0 / rate_hz):
-        return
+    if not tick and t - _last_broadcast < (1.0 / rate_hz):
+        return False
     _last_broadcast = t
-    with lock:
-        state = {
-            "type":"state",
-            "players": dict(players),
-            "npcs": dict(npcs),
-            "items": dict(items),
-            "projs": {str(k):v for k,v in projs.items()},
-        }
-    broadcast_obj(state)
+    out = []
+    with timed_lock():
+        t0 = time.perf_counter()
+        snapshot_seq += ID_STEP
+        for pid in list(clients):
+            view = aoi_view(pid)
+            if view is None:
+                continue
+            out.append((pid, _aoi_changes(pid, view), snapshot_for(pid, snapshot_seq, view)))
+        _lap("etat_construction", t0)
+    t0 = time.perf_counter()
+    for pid, change, state in out:
+        if change: send_to(pid, change)
+        send_to(pid, state)
+    _lap("etat_envoi", t0)
+    return True
 
 def send_to(pid, obj):
     with lock:
@@ -334,10 +1305,11 @@ def make_mob_template():
 
 def spawn_mob():
     global next_npc_id
-    x, y = random_free_pos()
+    x, y = random_free_pos(*region_spawn_center())
     t = make_mob_template()
-    nid = next_npc_id; next_npc_id += 1
-    npcs[nid] = {"x": x, "y": y, "dx": 0, "dy": 0, "last_hit_by": None, **t}
+    nid = next_npc_id; next_npc_id += ID_STEP
+    npcs[nid] = Mob({"x": x, "y": y, "dx": 0, "dy": 0, "last_hit_by": None, **t})
+    npc_grid.insert(nid, x, y)
     return nid
 
 def drop_loot_at(x, y):
@@ -350,12 +1322,13 @@ def drop_loot_at(x, y):
     ]
     for entry in table:
         if random.random() < entry["p"]:
-            iid = next_item_id; next_item_id += 1
-            items[iid] = {"x": x, "y": y, "name": entry["name"], "type": entry["type"], "power": entry["power"]}
+            iid = next_item_id; next_item_id += ID_STEP
+            items[iid] = Item({"x": x, "y": y, "name": entry["name"], "type": entry["type"], "power": entry["power"]})
+            item_grid.insert(iid, x, y)
 
 # ---------- Joueurs ----------
 def base_player(name, x, y):
-    return {
+    return Player({
         "name": name, "x": x, "y": y,
         "hp": 100, "max_hp": 100,
         "mp": 60,  "max_mp": 60,
@@ -370,7 +1343,7 @@ def base_player(name, x, y):
             "head": None, "neck": None, "chest": None, "legs": None, "boots": None,
             "ring1": None, "ring2": None, "weapon": None, "offhand": None,
         },
-    }
+    })
 
 def class_base_stats(cls: str):
     cls = (cls or "").lower()
@@ -398,9 +1371,9 @@ def make_player_from_character(ch: dict, x: int, y: int):
     p["mp"] = int(ch.get("mp", p["max_mp"]))
     p["class"] = ch.get("class", "Aventurier")
     p["race"] = ch.get("race", "Humain")
-    p["stats"] = ch.get("stats", p["stats"]) or p["stats"]
+    p["stats"] = dict(ch.get("stats", p["stats"]) or p["stats"])
     p["stat_points"] = int(ch.get("stat_points", 0))
-    p["equipment"] = ch.get("equipment", p.get("equipment")) or p.get("equipment")
+    p["equipment"] = dict(ch.get("equipment", p.get("equipment")) or p.get("equipment") or {})
     apply_equipment_effects(p)
     return p
 
@@ -429,11 +1402,15 @@ def apply_equipment_effects(p: dict):
     p["_gear_bonus_stats"] = {k: base_stats.get(k,0) + bonus.get(k,0) for k in ("str","int","agi","sta")}
 
 def persist_player_to_character(username: str, char_id: str, p: dict, inv: list):
+    # copie sur écriture: le personnage est remplacé, jamais modifié sur place, et ne partage
+    # rien de mutable avec le joueur vivant (le saver l'encode hors lock)
     with lock:
         user = accounts["users"].get(username)
         if not user: return
         ch = user.get("characters", {}).get(str(char_id))
         if not ch: return
+        ch = dict(ch)
+        eq = p.get("equipment", ch.get("equipment"))
         ch.update({
             "name": p.get("name"),
             "level": p.get("level", 1),
@@ -448,14 +1425,15 @@ def persist_player_to_character(username: str, char_id: str, p: dict, inv: list)
             "max_mp": p.get("max_mp", ch.get("max_mp", 60)),
             "x": p.get("x", ch.get("x")),
             "y": p.get("y", ch.get("y")),
-            "inventory": inv,
+            "inventory": [dict(it) for it in inv],
             "class": p.get("class", ch.get("class", "Aventurier")),
             "race": p.get("race", ch.get("race", "Humain")),
-            "stats": p.get("stats", ch.get("stats", {"str":5,"int":5,"agi":5,"sta":5})),
+            "stats": dict(p.get("stats", ch.get("stats", {"str":5,"int":5,"agi":5,"sta":5}))),
             "stat_points": p.get("stat_points", ch.get("stat_points", 0)),
-            "equipment": p.get("equipment", ch.get("equipment")),
+            "equipment": {k: dict(v) if isinstance(v, dict) else v for k, v in eq.items()} if isinstance(eq, dict) else eq,
         })
-        mark_dirty(username)
+        user["characters"][str(char_id)] = ch
+        mark_dirty(username, char_id)
 
 def grant_xp_gold(p, xp=0, gold=0):
     p["xp"] += xp; p["gold"] += gold
@@ -492,526 +1470,1566 @@ def spawn_projectile(pid, px, py, tx, ty, sp):
     ang = math.atan2(ty - py, tx - px)
     vx = math.cos(ang) * sp["speed"]
     vy = math.sin(ang) * sp["speed"]
-    proj_id = next_proj_id; next_proj_id += 1
-    projs[proj_id] = {"x": px, "y": py, "vx": vx, "vy": vy, "dmg": sp["dmg"], "owner": pid, "expire_at": now()+sp["ttl"]}
+    proj_id = next_proj_id; next_proj_id += ID_STEP
+    projs[proj_id] = Projectile({"x": px, "y": py, "vx": vx, "vy": vy, "dmg": sp["dmg"], "owner": pid, "expire_at": now()+sp["ttl"]})
+    proj_grid.insert(proj_id, px, py)
 
 def apply_cone(pid, px, py, tx, ty, sp):
     ang0 = math.atan2(ty - py, tx - px)
     radius = sp["radius"]; half = math.radians(sp["angle_deg"]) / 2
-    for nid, n in list(npcs.items()):
-        d = dist(px, py, n["x"], n["y"])
-        if d <= radius:
-            ang = math.atan2(n["y"] - py, n["x"] - px)
-            diff = math.atan2(math.sin(ang-ang0), math.cos(ang-ang0))
-            if abs(diff) <= half:
-                caster = players.get(pid, {})
-                bonus = 0
-                if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.5)
-                elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.4)
-                elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.4)
-                n["hp"] -= (sp["dmg"] + bonus); n["last_hit_by"] = pid
-                if n["hp"] <= 0:
-                    owner = players.get(pid)
-                    if owner:
-                        leveled = grant_xp_gold(owner, xp=random.randint(12,22), gold=random.randint(1,3))
-                        ident = pid_identity.get(pid)
-                        if ident: mark_dirty(ident["username"])
-                    drop_loot_at(n["x"], n["y"]); del npcs[nid]
-
-def apply_aoe(pid, px, py, sp):
-    r = sp["radius"]
-    for nid, n in list(npcs.items()):
-        if dist(px,py,n["x"],n["y"]) <= r:
+    for nid in npc_grid.query_radius(px, py, radius):
+        n = npcs[nid]
+        ang = math.atan2(n["y"] - py, n["x"] - px)
+        diff = math.atan2(math.sin(ang-ang0), math.cos(ang-ang0))
+        if abs(diff) <= half:
             caster = players.get(pid, {})
             bonus = 0
-            if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.4)
-            elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.6)
-            elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.3)
-            n["hp"] -= (sp.get("dmg",0) + bonus); n["last_hit_by"] = pid
+            if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.5)
+            elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.4)
+            elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.4)
+            n["hp"] -= (sp["dmg"] + bonus); n["last_hit_by"] = pid
             if n["hp"] <= 0:
                 owner = players.get(pid)
                 if owner:
                     leveled = grant_xp_gold(owner, xp=random.randint(12,22), gold=random.randint(1,3))
                     ident = pid_identity.get(pid)
-                    if ident: mark_dirty(ident["username"])
-                drop_loot_at(n["x"], n["y"]); del npcs[nid]
+                    if ident: mark_dirty(ident["username"], ident["char_id"])
+                drop_loot_at(n["x"], n["y"]); del npcs[nid]; npc_grid.remove(nid)
+
+def apply_aoe(pid, px, py, sp):
+    r = sp["radius"]
+    for nid in npc_grid.query_radius(px, py, r):
+        n = npcs[nid]
+        caster = players.get(pid, {})
+        bonus = 0
+        if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.4)
+        elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.6)
+        elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.3)
+        n["hp"] -= (sp.get("dmg",0) + bonus); n["last_hit_by"] = pid
+        if n["hp"] <= 0:
+            owner = players.get(pid)
+            if owner:
+                leveled = grant_xp_gold(owner, xp=random.randint(12,22), gold=random.randint(1,3))
+                ident = pid_identity.get(pid)
+                if ident: mark_dirty(ident["username"], ident["char_id"])
+            drop_loot_at(n["x"], n["y"]); del npcs[nid]; npc_grid.remove(nid)
 
 # ---------- Client handler ----------
-def handle_client(conn, addr):
+# ---------- Sessions client ----------
+# Une session = l'état d'une connexion (auth, personnage choisi, pid en jeu). handle_message
+# est commun au mode threads (handle_client) et au mode asyncio (serve_async).
+def new_session(conn, addr):
+    return {"conn": conn, "addr": addr, "authed_user": None, "pid": None, "entered_world": False, "char_id": None,
+            "queued": 0, "done": 0}  # commandes mises en file (boucle asyncio) / exécutées (thread logique)
+
+def handle_message(sess, data):
     global next_id, next_item_id
-    f = conn.makefile("r")
-
-    authed_user = None  # username
-    pid = None          # world session pid
-    entered_world = False
-    chosen_char_id = None
+    conn = sess["conn"]
+    authed_user = sess["authed_user"]  # username
+    pid = sess["pid"]                  # world session pid
+    entered_world = sess["entered_world"]
 
     def send_conn(obj):
         _safe_send(conn, obj)
 
-    # Boucle de lecture (auth puis jeu)
-    try:
-        while True:
-                try:
-                    line = f.readline()
-                except Exception:
-                    break
-                if not line:
-                    break
+    def login_ok(char_list, requested_proto):
+        # la réponse part toujours en JSON; le protocole choisi s'applique aux messages suivants
+        proto = requested_proto if requested_proto in wire.PROTOS else wire.PROTO_JSON
+        send_conn({"type":"login_ok","characters": char_list, "proto": proto})
+        conn_proto[conn] = proto
+
+    t = data.get("type")
+    if isinstance(t, str) and t.startswith("shard_"):
+        handle_shard_message(sess, data)
+        return
+    client_msgs[conn] = client_msgs.get(conn, 0) + 1
+
+    # Phase 1: Authentification
+    if not authed_user:
+        if t == "login":
+            username = str(data.get("username",""))
+            password = str(data.get("password",""))
+            with lock:
+                user = accounts["users"].get(username)
+            if not user or user.get("password") != _hash_pw(password):
+                send_conn({"type":"login_error","msg":"Identifiants invalides."})
+            else:
+                with lock:
+                    if username in active_usernames:
+                        send_conn({"type":"login_error","msg":"Compte déjà connecté."})
+                        return
+                    active_usernames.add(username)
+                authed_user = sess["authed_user"] = username
+                chars = user.get("characters", {})
+                char_list = [{"id": cid, "name": ch.get("name"), "class": ch.get("class","?"), "level": ch.get("level",1)} for cid, ch in chars.items()]
+                login_ok(char_list, data.get("proto"))
+        elif t == "register":
+            username = str(data.get("username",""))
+            password = str(data.get("password",""))
+            if not username or not password:
+                send_conn({"type":"login_error","msg":"Utilisateur et mot de passe requis."})
+            else:
+                with lock:
+                    if username in accounts["users"]:
+                        user = None
+                    else:
+                        accounts["users"][username] = {"password": _hash_pw(password), "characters": {}, "next_char_id": 1}
+                        mark_dirty(username); save_soon()
+                        user = accounts["users"][username]
+                if not user:
+                    send_conn({"type":"login_error","msg":"Utilisateur déjà existant."})
+                else:
+                    authed_user = sess["authed_user"] = username
+                    login_ok([], data.get("proto"))
+        else:
+            send_conn({"type":"login_error","msg":"Veuillez vous authentifier."})
+        return
+
+    # Phase 2: Pré-monde (sélection/création)
+    if not entered_world:
+        if t == "request_characters":
+            with lock:
+                user = accounts["users"].get(authed_user, {"characters":{}})
+                chars = user.get("characters", {})
+            char_list = [{"id": cid, "name": ch.get("name"), "class": ch.get("class","?"), "level": ch.get("level",1)} for cid, ch in chars.items()]
+            send_conn({"type":"characters","characters": char_list})
+            return
+        elif t == "create_character":
+            name = str(data.get("name","Héros")).strip() or "Héros"
+            cls = str(data.get("class","Aventurier"))
+            race = str(data.get("race","Humain"))
+            with lock:
+                user = accounts["users"].get(authed_user)
+                if not user:
+                    send_conn({"type":"create_error","msg":"Session invalide."})
+                    return
+                cid = str(user.get("next_char_id", 1))
+                user["next_char_id"] = int(cid) + 1
+                ch = {
+                    "id": cid,
+                    "name": name,
+                    "class": cls,
+                    "race": race,
+                    "level": 1, "xp": 0, "next_xp": 100,
+                    "gold": 0,
+                    "weapon_bonus": 0, "weapon_name": None,
+                    "hp": class_base_stats(cls)["max_hp"],
+                    "max_hp": class_base_stats(cls)["max_hp"],
+                    "mp": class_base_stats(cls)["max_mp"],
+                    "max_mp": class_base_stats(cls)["max_mp"],
+                    "x": None, "y": None,
+                    "stats": {"str": 5, "int": 5, "agi": 5, "sta": 5},
+                    "stat_points": 0,
+                    "inventory": [
+                        {"id": 100000 + int(cid)*10 + 1, "name": "Petite potion", "type": "potion", "power": 30},
+                    ],
+                }
+                if "characters" not in user: user["characters"] = {}
+                user["characters"][cid] = ch
+                mark_dirty(authed_user); mark_dirty(authed_user, cid)
+                save_soon()
+                chars = user["characters"]
+            char_list = [{"id": k, "name": v.get("name"), "class": v.get("class","?"), "level": v.get("level",1)} for k,v in chars.items()]
+            send_conn({"type":"characters","characters": char_list})
+            return
+        elif t == "enter_world":
+            chosen_char_id = sess["char_id"] = str(data.get("char_id"))
+            with lock:
+                user = accounts["users"].get(authed_user)
+                ch = (user or {}).get("characters", {}).get(chosen_char_id)
+            if not ch:
+                send_conn({"type":"enter_error","msg":"Personnage introuvable."})
+                return
+            with lock:
+                pid = sess["pid"] = next_id; next_id += ID_STEP
+                clients[pid] = conn
+                # Position
+                if ch.get("x") is None or ch.get("y") is None:
+                    x, y = random_free_pos(*region_spawn_center())
+                else:
+                    x, y = int(ch.get("x")), int(ch.get("y"))
+                players[pid] = make_player_from_character(ch, x, y)
+                player_grid.insert(pid, players[pid]["x"], players[pid]["y"])
+                entering.add(pid)  # pas de passage de frontière avant l'envoi du welcome
+                inventories[pid] = list(ch.get("inventory", []))
+                cooldowns[pid] = {"spells": {}}
+                pid_identity[pid] = {"username": authed_user, "char_id": chosen_char_id}
+                # Sécurité: monter next_item_id pour éviter collisions avec inventaire persistant
                 try:
-                    data = json.loads(line)
+                    max_inv_id = max((int(v.get("id",0)) for v in inventories[pid]), default=0)
+                    if max_inv_id >= next_item_id:
+                        next_item_id = _align_id(max_inv_id + 1)
                 except Exception:
-                    continue
-                t = data.get("type")
-
-                # Phase 1: Authentification
-                if not authed_user:
-                    if t == "login":
-                        username = str(data.get("username",""))
-                        password = str(data.get("password",""))
-                        with lock:
-                            user = accounts["users"].get(username)
-                        if not user or user.get("password") != _hash_pw(password):
-                            send_conn({"type":"login_error","msg":"Identifiants invalides."})
-                        else:
-                            with lock:
-                                if username in active_usernames:
-                                    send_conn({"type":"login_error","msg":"Compte déjà connecté."})
-                                    continue
-                                active_usernames.add(username)
-                            authed_user = username
-                            chars = user.get("characters", {})
-                            char_list = [{"id": cid, "name": ch.get("name"), "class": ch.get("class","?"), "level": ch.get("level",1)} for cid, ch in chars.items()]
-                            send_conn({"type":"login_ok","characters": char_list})
-                    elif t == "register":
-                        username = str(data.get("username",""))
-                        password = str(data.get("password",""))
-                        if not username or not password:
-                            send_conn({"type":"login_error","msg":"Utilisateur et mot de passe requis."})
-                        else:
-                            with lock:
-                                if username in accounts["users"]:
-                                    user = None
-                                else:
-                                    accounts["users"][username] = {"password": _hash_pw(password), "characters": {}, "next_char_id": 1}
-                                    save_accounts()
-                                    user = accounts["users"][username]
-                            if not user:
-                                send_conn({"type":"login_error","msg":"Utilisateur déjà existant."})
-                            else:
-                                authed_user = username
-                                send_conn({"type":"login_ok","characters": []})
-                    else:
-                        send_conn({"type":"login_error","msg":"Veuillez vous authentifier."})
-                    continue
-
-                # Phase 2: Pré-monde (sélection/création)
-                if not entered_world:
-                    if t == "request_characters":
-                        with lock:
-                            user = accounts["users"].get(authed_user, {"characters":{}})
-                            chars = user.get("characters", {})
-                        char_list = [{"id": cid, "name": ch.get("name"), "class": ch.get("class","?"), "level": ch.get("level",1)} for cid, ch in chars.items()]
-                        send_conn({"type":"characters","characters": char_list})
-                        continue
-                    elif t == "create_character":
-                        name = str(data.get("name","Héros")).strip() or "Héros"
-                        cls = str(data.get("class","Aventurier"))
-                        race = str(data.get("race","Humain"))
-                        with lock:
-                            user = accounts["users"].get(authed_user)
-                            if not user:
-                                send_conn({"type":"create_error","msg":"Session invalide."})
-                                continue
-                            cid = str(user.get("next_char_id", 1))
-                            user["next_char_id"] = int(cid) + 1
-                            ch = {
-                                "id": cid,
-                                "name": name,
-                                "class": cls,
-                                "race": race,
-                                "level": 1, "xp": 0, "next_xp": 100,
-                                "gold": 0,
-                                "weapon_bonus": 0, "weapon_name": None,
-                                "hp": class_base_stats(cls)["max_hp"],
-                                "max_hp": class_base_stats(cls)["max_hp"],
-                                "mp": class_base_stats(cls)["max_mp"],
-                                "max_mp": class_base_stats(cls)["max_mp"],
-                                "x": None, "y": None,
-                                "stats": {"str": 5, "int": 5, "agi": 5, "sta": 5},
-                                "stat_points": 0,
-                                "inventory": [
-                                    {"id": 100000 + int(cid)*10 + 1, "name": "Petite potion", "type": "potion", "power": 30},
-                                ],
-                            }
-                            if "characters" not in user: user["characters"] = {}
-                            user["characters"][cid] = ch
-                            mark_dirty(authed_user)
-                            save_accounts()
-                            chars = user["characters"]
-                        char_list = [{"id": k, "name": v.get("name"), "class": v.get("class","?"), "level": v.get("level",1)} for k,v in chars.items()]
-                        send_conn({"type":"characters","characters": char_list})
-                        continue
-                    elif t == "enter_world":
-                        chosen_char_id = str(data.get("char_id"))
-                        with lock:
-                            user = accounts["users"].get(authed_user)
-                            ch = (user or {}).get("characters", {}).get(chosen_char_id)
-                        if not ch:
-                            send_conn({"type":"enter_error","msg":"Personnage introuvable."})
-                            continue
-                        with lock:
-                            pid = next_id; next_id += 1
-                            clients[pid] = conn
-                            # Position
-                            if ch.get("x") is None or ch.get("y") is None:
-                                x, y = random_free_pos()
-                            else:
-                                x, y = int(ch.get("x")), int(ch.get("y"))
-                            players[pid] = make_player_from_character(ch, x, y)
-                            inventories[pid] = list(ch.get("inventory", []))
-                            cooldowns[pid] = {"spells": {}}
-                            pid_identity[pid] = {"username": authed_user, "char_id": chosen_char_id}
-                            # Sécurité: monter next_item_id pour éviter collisions avec inventaire persistant
-                            try:
-                                max_inv_id = max((int(v.get("id",0)) for v in inventories[pid]), default=0)
-                                if max_inv_id >= next_item_id:
-                                    next_item_id = max_inv_id + 1
-                            except Exception:
-                                pass
-                        # envoyer les sorts de la classe du joueur uniquement
-                        _cls = players[pid].get("class","Mage")
-                        class_spells = SPELLS_BY_CLASS.get(_cls, {})
-                        send_to(pid, {"type":"welcome","your_id":pid,"tile":TILE,"grid_w":GRID_W,"grid_h":GRID_H,"map":[],
-                                      "inventory":inventories[pid],"you":players[pid],"spells":class_spells})
-                        broadcast_state()
-                        broadcast_obj({"type":"chat","from":"SYSTEM","msg":f"{players[pid]['name']} a rejoint la partie."})
-                        # deux mobs à proximité pour tests
-                        px, py = players[pid]["x"], players[pid]["y"]
-                        for _ in range(2):
-                            mx, my = random_free_pos(px, py, 8)
-                            spawn_mob_at(mx, my)
-                        entered_world = True
-                        continue
+                    pass
+            # envoyer les sorts de la classe du joueur uniquement
+            _cls = players[pid].get("class","Mage")
+            class_spells = SPELLS_BY_CLASS.get(_cls, {})
+            send_to(pid, {"type":"welcome","your_id":pid,"tile":TILE,"grid_w":GRID_W,"grid_h":GRID_H,"map":[],
+                          "inventory":inventories[pid],"you":players[pid],"spells":class_spells})
+            push_chunk_ring(pid, force=True)
+            broadcast_state()
+            broadcast_obj({"type":"chat","from":"SYSTEM","msg":f"{players[pid]['name']} a rejoint la partie."})
+            # deux mobs à proximité pour tests (npcs et npc_grid: lock tenu, comme tout ajout au monde)
+            with lock:
+                px, py = players[pid]["x"], players[pid]["y"]
+                for _ in range(2):
+                    mx, my = random_free_pos(px, py, 8)
+                    if owns_x(mx): spawn_mob_at(mx, my)
+                entering.discard(pid)
+            sess["entered_world"] = True
+            return
+        else:
+            send_conn({"type":"error","msg":"Action non valide avant l'entrée en jeu."})
+            return
+
+    # Phase 3: En jeu
+    if t == "move":
+        dx = int(data.get("dx",0)); dy = int(data.get("dy",0))
+        with lock:
+            p = players.get(pid)
+            if p and not p["dead"]:
+                p["x"], p["y"] = move_with_collisions(p["x"], p["y"], dx, dy, PLAYER_SIZE)
+                player_grid.move(pid, p["x"], p["y"])
+
+    elif t == "pickup":
+        to_send_inv = False
+        sys_msg = None
+        with lock:
+            p = players.get(pid)
+            if p and not p["dead"]:
+                px, py = p["x"], p["y"]
+                target_iid, _ = item_grid.nearest(px, py, 40 + 1e-9)
+                if target_iid is not None:
+                    it = items.pop(target_iid); item_grid.remove(target_iid)
+                    if it["type"] == "gold":
+                        p["gold"] += int(it.get("power",1))
+                        sys_msg = {"type":"chat","from":"SYSTEM","msg":f"{p['name']} +{it.get('power',1)} or"}
+                        # persistance
+                        ident = pid_identity.get(pid)
+                        if ident: mark_dirty(ident["username"], ident["char_id"])
                     else:
-                        send_conn({"type":"error","msg":"Action non valide avant l'entrée en jeu."})
-                        continue
-
-                # Phase 3: En jeu
-                if t == "move":
-                    dx = int(data.get("dx",0)); dy = int(data.get("dy",0))
-                    with lock:
-                        p = players.get(pid)
-                        if p and not p["dead"]:
-                            p["x"], p["y"] = move_with_collisions(p["x"], p["y"], dx, dy, PLAYER_SIZE)
-
-                elif t == "pickup":
-                    to_send_inv = False
-                    sys_msg = None
-                    with lock:
-                        p = players.get(pid)
-                        if p and not p["dead"]:
-                            px, py = p["x"], p["y"]
-                            target_iid = None; best_d2 = 999999
-                            for iid, it in items.items():
-                                d2 = (it["x"]-px)**2 + (it["y"]-py)**2
-                                if d2 < best_d2 and d2 <= (40**2):
-                                    best_d2 = d2; target_iid = iid
-                            if target_iid is not None:
-                                it = items.pop(target_iid)
-                                if it["type"] == "gold":
-                                    p["gold"] += int(it.get("power",1))
-                                    sys_msg = {"type":"chat","from":"SYSTEM","msg":f"{p['name']} +{it.get('power',1)} or"}
-                                    # persistance
-                                    ident = pid_identity.get(pid)
-                                    if ident: mark_dirty(ident["username"])
-                                else:
-                                    # Utiliser un ID d'inventaire indépendant
-                                    inv_id = 1000000 + target_iid
-                                    inventories[pid].append({"id": inv_id, "name": it["name"], "type": it["type"], "power": it.get("power",0)})
-                                    to_send_inv = True
-                                    ident = pid_identity.get(pid)
-                                    if ident: mark_dirty(ident["username"])
-                    if to_send_inv:
-                        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
-                    if sys_msg:
-                        broadcast_obj(sys_msg)
-
-                elif t == "use_item":
-                    iid = data.get("id")
-                    with lock:
-                        inv = inventories.get(pid, [])
-                        idx = next((i for i,v in enumerate(inv) if str(v["id"]) == str(iid)), None)
-                        if idx is not None:
-                            obj = inv.pop(idx)
-                            p = players.get(pid)
-                            if p:
-                                typ = obj.get("type"); power = int(obj.get("power",0))
-                                if typ == "potion":   p["hp"] = min(p["max_hp"], p["hp"] + (power or 30))
-                                elif typ == "scroll": p["mp"] = min(p["max_mp"], p["mp"] + (power or 20))
-                                elif typ == "weapon":
-                                    # si utilisé via inventaire, l'équiper directement dans weapon si libre
-                                    if not (p.get("equipment") or {}).get("weapon"):
-                                        p.setdefault("equipment",{})["weapon"] = obj
-                                        apply_equipment_effects(p)
-                                    else:
-                                        p["weapon_bonus"] = max(p["weapon_bonus"], power or 5)
-                                        p["weapon_name"] = obj.get("name","Arme")
-                                else:
-                                    p["gold"] += 1
-                                ident = pid_identity.get(pid)
-                                if ident: mark_dirty(ident["username"])
-                    send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
-
-                elif t == "drop":
-                    with lock:
-                        inv = inventories.get(pid, [])
-                        idx = next((i for i,v in enumerate(inv) if str(v["id"]) == str(data.get("id"))), None)
-                        if idx is not None:
-                            v = inv.pop(idx)
-                            p = players.get(pid)
-                            if p:
-                                px, py = p["x"], p["y"]
-                                ix, iy = move_with_collisions(px, py, data.get("dx",0) or 0, data.get("dy",0) or 0, ITEM_SIZE)
-                                # Allouer un nouvel ID d'item au sol pour éviter toute collision
-                                new_iid = next_item_id; next_item_id += 1
-                                items[new_iid] = {"x": ix, "y": iy, "name": v["name"], "type": v["type"], "power": v.get("power",0)}
-                                ident = pid_identity.get(pid)
-                                if ident: mark_dirty(ident["username"])
-                    send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
-
-                elif t == "cast":
-                    slot = int(data.get("slot",0))
-                    tx = float(data.get("tx",0)); ty = float(data.get("ty",0))
-                    with lock:
-                        ok, reason = can_cast(pid, slot)
-                        if not ok:
-                            send_to(pid, {"type":"chat","from":"SYSTEM","msg":f"Sort {slot} indisponible ({reason})."})
-                        else:
-                            p = players.get(pid)
-                            sp = SPELLS_BY_CLASS.get(p.get("class","Mage"), {}).get(slot)
-                            px, py = p["x"], p["y"]
-                            spend_cast(pid, slot)
-                            if sp["type"] == "projectile":
-                                spawn_projectile(pid, px, py, tx, ty, sp)
-                            elif sp["type"] == "cone":
-                                apply_cone(pid, px, py, tx, ty, sp)
-                            elif sp["type"] == "aoe":
-                                apply_aoe(pid, px, py, sp)
-                            elif sp["type"] == "heal":
-                                p["hp"] = min(p["max_hp"], p["hp"] + sp["amount"] )
-                            # notifier un FX basique au client
-                            fx = {"type":"fx","fx":"cast","slot":slot,"x":px,"y":py,"tx":tx,"ty":ty,"duration":0.25}
-                            broadcast_obj(fx)
-                            # broadcast immédiat pour que les projectiles bougent même si le joueur est immobile
-                            broadcast_state()
-
-                elif t == "equip_item":
-                    slot = str(data.get("slot",""))
-                    iid = data.get("id")
-                    allowed = {
-                        "head": {"head"}, "neck": {"neck"}, "chest": {"chest"}, "legs": {"legs"},
-                        "boots": {"boots"}, "ring1": {"ring"}, "ring2": {"ring"},
-                        "weapon": {"weapon"}, "offhand": {"shield","offhand"}
-                    }
-                    with lock:
-                        p = players.get(pid)
-                        if not p:
-                            continue
-                        inv = inventories.get(pid, [])
-                        idx = next((i for i,v in enumerate(inv) if str(v.get("id")) == str(iid)), None)
-                        if idx is None:
-                            send_to(pid, {"type":"chat","from":"SYSTEM","msg":"Objet introuvable dans l'inventaire."})
-                            continue
-                        obj = inv[idx]
-                        typ = str(obj.get("type",""))
-                        if slot not in allowed or typ not in allowed[slot]:
-                            send_to(pid, {"type":"chat","from":"SYSTEM","msg":"Type d'objet incompatible avec le slot."})
-                            continue
-                        inv.pop(idx)
-                        p.setdefault("equipment", {})
-                        prev = (p.get("equipment") or {}).get(slot)
-                        (p["equipment"]) [slot] = obj
-                        apply_equipment_effects(p)
-                        if prev:
-                            inv.append(prev)
+                        # Utiliser un ID d'inventaire indépendant
+                        inv_id = 1000000 + target_iid
+                        inventories[pid].append({"id": inv_id, "name": it["name"], "type": it["type"], "power": it.get("power",0)})
+                        to_send_inv = True
                         ident = pid_identity.get(pid)
-                        if ident: mark_dirty(ident["username"])
-                    send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
-
-                elif t == "unequip_slot":
-                    slot = str(data.get("slot",""))
-                    with lock:
-                        p = players.get(pid)
-                        if not p:
-                            continue
-                        eq = p.get("equipment") or {}
-                        obj = eq.get(slot)
-                        if obj:
-                            inventories.setdefault(pid, []).append(obj)
-                            eq[slot] = None
+                        if ident: mark_dirty(ident["username"], ident["char_id"])
+        if to_send_inv:
+            send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
+        if sys_msg:
+            broadcast_near(px, py, sys_msg, CHAT_RADIUS)
+
+    elif t == "use_item":
+        iid = data.get("id")
+        with lock:
+            inv = inventories.get(pid, [])
+            idx = next((i for i,v in enumerate(inv) if str(v["id"]) == str(iid)), None)
+            if idx is not None:
+                obj = inv.pop(idx)
+                p = players.get(pid)
+                if p:
+                    typ = obj.get("type"); power = int(obj.get("power",0))
+                    if typ == "potion":   p["hp"] = min(p["max_hp"], p["hp"] + (power or 30))
+                    elif typ == "scroll": p["mp"] = min(p["max_mp"], p["mp"] + (power or 20))
+                    elif typ == "weapon":
+                        # si utilisé via inventaire, l'équiper directement dans weapon si libre
+                        if not (p.get("equipment") or {}).get("weapon"):
+                            p.setdefault("equipment",{})["weapon"] = obj
                             apply_equipment_effects(p)
-                            ident = pid_identity.get(pid)
-                            if ident: mark_dirty(ident["username"])
-                    send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
-
-                elif t == "chat":
-                    txt = str(data.get("msg","")).strip()
-                    if txt:
-                        with lock:
-                            author = players.get(pid, {}).get("name","???")
-                        broadcast_obj({"type":"chat","from":author,"msg":txt})
+                        else:
+                            p["weapon_bonus"] = max(p["weapon_bonus"], power or 5)
+                            p["weapon_name"] = obj.get("name","Arme")
+                    else:
+                        p["gold"] += 1
+                    ident = pid_identity.get(pid)
+                    if ident: mark_dirty(ident["username"], ident["char_id"])
+        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
 
-                elif t == "request_inventory":
-                    send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
+    elif t == "drop":
+        with lock:
+            inv = inventories.get(pid, [])
+            idx = next((i for i,v in enumerate(inv) if str(v["id"]) == str(data.get("id"))), None)
+            if idx is not None:
+                v = inv.pop(idx)
+                p = players.get(pid)
+                if p:
+                    px, py = p["x"], p["y"]
+                    ix, iy = move_with_collisions(px, py, data.get("dx",0) or 0, data.get("dy",0) or 0, ITEM_SIZE)
+                    # Allouer un nouvel ID d'item au sol pour éviter toute collision
+                    new_iid = next_item_id; next_item_id += ID_STEP
+                    items[new_iid] = Item({"x": ix, "y": iy, "name": v["name"], "type": v["type"], "power": v.get("power",0)})
+                    item_grid.insert(new_iid, ix, iy)
+                    ident = pid_identity.get(pid)
+                    if ident: mark_dirty(ident["username"], ident["char_id"])
+        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
 
-                # push l'état à ~20 Hz max
+    elif t == "cast":
+        slot = int(data.get("slot",0))
+        tx = float(data.get("tx",0)); ty = float(data.get("ty",0))
+        with lock:
+            ok, reason = can_cast(pid, slot)
+            if not ok:
+                send_to(pid, {"type":"chat","from":"SYSTEM","msg":f"Sort {slot} indisponible ({reason})."})
+            else:
+                p = players.get(pid)
+                sp = SPELLS_BY_CLASS.get(p.get("class","Mage"), {}).get(slot)
+                px, py = p["x"], p["y"]
+                spend_cast(pid, slot)
+                if sp["type"] == "projectile":
+                    spawn_projectile(pid, px, py, tx, ty, sp)
+                elif sp["type"] == "cone":
+                    apply_cone(pid, px, py, tx, ty, sp)
+                elif sp["type"] == "aoe":
+                    apply_aoe(pid, px, py, sp)
+                elif sp["type"] == "heal":
+                    p["hp"] = min(p["max_hp"], p["hp"] + sp["amount"] )
+                # notifier un FX basique au client
+                fx = {"type":"fx","fx":"cast","slot":slot,"x":px,"y":py,"tx":tx,"ty":ty,"duration":0.25}
+                broadcast_near(px, py, fx)
+                # broadcast immédiat pour que les projectiles bougent même si le joueur est immobile
                 broadcast_state()
 
-    # cleanup
+    elif t == "equip_item":
+        slot = str(data.get("slot",""))
+        iid = data.get("id")
+        allowed = {
+            "head": {"head"}, "neck": {"neck"}, "chest": {"chest"}, "legs": {"legs"},
+            "boots": {"boots"}, "ring1": {"ring"}, "ring2": {"ring"},
+            "weapon": {"weapon"}, "offhand": {"shield","offhand"}
+        }
+        with lock:
+            p = players.get(pid)
+            if not p:
+                return
+            inv = inventories.get(pid, [])
+            idx = next((i for i,v in enumerate(inv) if str(v.get("id")) == str(iid)), None)
+            if idx is None:
+                send_to(pid, {"type":"chat","from":"SYSTEM","msg":"Objet introuvable dans l'inventaire."})
+                return
+            obj = inv[idx]
+            typ = str(obj.get("type",""))
+            if slot not in allowed or typ not in allowed[slot]:
+                send_to(pid, {"type":"chat","from":"SYSTEM","msg":"Type d'objet incompatible avec le slot."})
+                return
+            inv.pop(idx)
+            p.setdefault("equipment", {})
+            prev = (p.get("equipment") or {}).get(slot)
+            (p["equipment"]) [slot] = obj
+            p.touch()
+            apply_equipment_effects(p)
+            if prev:
+                inv.append(prev)
+            ident = pid_identity.get(pid)
+            if ident: mark_dirty(ident["username"], ident["char_id"])
+        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
+
+    elif t == "unequip_slot":
+        slot = str(data.get("slot",""))
+        with lock:
+            p = players.get(pid)
+            if not p:
+                return
+            eq = p.get("equipment") or {}
+            obj = eq.get(slot)
+            if obj:
+                inventories.setdefault(pid, []).append(obj)
+                eq[slot] = None
+                p.touch()
+                apply_equipment_effects(p)
+                ident = pid_identity.get(pid)
+                if ident: mark_dirty(ident["username"], ident["char_id"])
+        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
+
+    elif t == "chat":
+        txt = str(data.get("msg","")).strip()
+        if txt:
+            with lock:
+                p = players.get(pid, {})
+                author = p.get("name","???")
+                pos = (p.get("x",0), p.get("y",0))
+            broadcast_near(pos[0], pos[1], {"type":"chat","from":author,"msg":txt}, CHAT_RADIUS)
+
+    elif t == "request_inventory":
+        send_to(pid, {"type":"inventory", "inventory": inventories.get(pid, [])})
+
+    elif t == "ack":
+        try: ack_snapshot(pid, int(data.get("seq")))
+        except (TypeError, ValueError): pass
+        return  # un ack ne change rien au monde: pas de broadcast
+
+    elif t == "resync":
+        resync_snapshot(pid)
+
+    elif t == "get_chunks":
+        keys = []
+        for c in (data.get("chunks") or [])[:MAX_CHUNKS_PER_REQUEST]:
+            try: keys.append((int(c[0]), int(c[1])))
+            except Exception: continue
+        lst = []
+        if keys:
+            with lock:
+                p = players.get(pid)
+                # seulement autour du joueur: un client ne fait pas générer des chunks arbitraires
+                here = chunk_of_pos(p["x"], p["y"]) if p else None
+                sent = sent_chunks.setdefault(pid, set())
+                for key in keys:
+                    if here is None or not chunk_in_reach(key, here):
+                        continue
+                    sent.add(key)
+                    lst.append(chunk_payload(*key))
+        if lst:
+            send_to(pid, {"type":"chunks", "list": lst})
+
+    # push l'état à ~20 Hz max
+    broadcast_state()
+
+
+def end_session(sess):
+    conn = sess["conn"]
+    if conn in handed_off:
+        # joueur remis à un autre shard: ni persistance ni annonce, le compte reste connecté
+        with lock:
+            handed_off.discard(conn)
+            _release_conn(conn)
+        return
+    try:
         left_name = None
         with lock:
             for _pid, c in list(clients.items()):
                 if c == conn:
                     left_name = players.get(_pid, {}).get("name","Un joueur")
-                    ident = pid_identity.get(_pid)
-                    if ident:
-                        # Persister la progression
-                        persist_player_to_character(ident["username"], ident["char_id"], players.get(_pid, {}), inventories.get(_pid, []))
+                    # Persister la progression
+                    persist_player(_pid, logout=True)
                     try: clients[_pid].close()
                     except: pass
-                    clients.pop(_pid, None)
-                    players.pop(_pid, None)
-                    inventories.pop(_pid, None)
-                    cooldowns.pop(_pid, None)
-                    pid_identity.pop(_pid, None)
+                    _drop_player(_pid)
                     break
         broadcast_state()
         if left_name:
             broadcast_obj({"type":"chat","from":"SYSTEM","msg":f"{left_name} s'est déconnecté."})
-
-        # ---------- Boucle logique ----------
     finally:
         try:
-            _cleanup_disconnect(authed_user, pid)
+            _cleanup_disconnect(sess["authed_user"], sess["pid"], conn)
         except Exception:
             pass
 
-def logic_loop():
+def _release_conn(conn):
+    conn_proto.pop(conn, None)
+    client_msgs.pop(conn, None)
+    ob = outboxes.pop(conn, None)
+    if ob: ob.close()
+
+def _drop_player(pid):
+    # retire le joueur du monde local (lock tenu)
+    conn_proto.pop(clients.get(pid), None)
+    clients.pop(pid, None)
+    players.pop(pid, None); player_grid.remove(pid)
+    inventories.pop(pid, None)
+    cooldowns.pop(pid, None)
+    pid_identity.pop(pid, None)
+    entering.discard(pid)
+    forget_client_views(pid)
+
+def persist_player(pid, logout=False):
+    """Persiste la progression de pid (lock tenu). Hors shard 0, elle part au shard 0 qui possède
+    les comptes; logout y libère aussi le compte (anti double-login)."""
+    ident = pid_identity.get(pid)
+    if not ident:
+        return
+    p = players.get(pid, {}); inv = inventories.get(pid, [])
+    if owns_accounts():
+        persist_player_to_character(ident["username"], ident["char_id"], p, inv)
+    else:
+        peer_send(0, {"type":"shard_persist","username":ident["username"],"char_id":ident["char_id"],
+                      "player":p,"inventory":inv,"logout":logout})
+
+def _cleanup_disconnect(authed_user, pid, conn=None):
     with lock:
-        for _ in range(6): spawn_mob()
+        _release_conn(conn)
+        if authed_user in active_usernames:
+            active_usernames.discard(authed_user)
+        if pid in clients:
+            try: clients[pid].close()
+            except: pass
+            clients.pop(pid, None)
+        if pid in players: players.pop(pid, None); player_grid.remove(pid)
+        if pid in inventories: inventories.pop(pid, None)
+        if pid in cooldowns: cooldowns.pop(pid, None)
+        if pid in pid_identity: pid_identity.pop(pid, None)
+        forget_client_views(pid)
+
+# ---------- Sharding (router.py + plusieurs workers) ----------
+# Le monde est découpé en bandes verticales de SHARD_STRIP_CHUNKS chunks; la bande k appartient
+# au worker k % SHARD_COUNT. router.py possède les sockets clients et relaie chacun vers le worker
+# de son joueur. Le shard 0 possède les comptes (login, création, persistance). Les messages
+# "shard_*" (routeur, workers voisins) portent la clé de la partie: les ports des workers sont
+# joignables par tout processus local, la boucle locale seule ne prouve rien.
+SHARD_ID = 0
+SHARD_COUNT = 1
+SHARD_BASE_PORT = None  # le worker i écoute sur SHARD_BASE_PORT + i
+SHARD_KEY_ENV = "MMO_SHARD_KEY"  # secret tiré par router.py à chaque lancement (hors ligne de commande: visible par ps)
+SHARD_KEY = b""
+STRIP_PX = SHARD_STRIP_CHUNKS * CHUNK_TILES * TILE
+GHOST_TTL = 2.0         # s: fantômes d'un voisin ignorés s'il ne les a pas rafraîchis
+ghosts = {}             # shard voisin -> {"players": {id: e}, "npcs": {...}, "items": {...}, "at": ts}
+handed_off = set()      # conns dont le joueur a été remis à un autre shard
+entering = set()        # pids en cours d'enter_world (welcome pas encore envoyé)
+peer_conns = {}         # shard -> socket vers le worker voisin (JSON, via son Outbox)
+shard_stats = {"handoffs_out": 0, "handoffs_in": 0, "ghost_msgs": 0, "peer_errors": 0, "rejected": 0, "ghosts_changed": False}
+
+def sharded(): return SHARD_COUNT > 1
+def owns_accounts(): return SHARD_ID == 0
+def shard_of_x(x): return int(x // STRIP_PX) % SHARD_COUNT
+def owns_x(x): return SHARD_COUNT == 1 or shard_of_x(x) == SHARD_ID
+
+def configure_shard(shard, count, base_port, key):
+    global SHARD_ID, SHARD_COUNT, SHARD_BASE_PORT, SHARD_KEY, ID_STEP
+    global next_id, next_npc_id, next_item_id, next_proj_id, snapshot_seq
+    SHARD_ID, SHARD_COUNT, SHARD_BASE_PORT, SHARD_KEY = shard, count, base_port, key.encode()
+    # ids et numéros de snapshot entrelacés: uniques entre shards, un joueur garde son pid
+    ID_STEP = count
+    next_id = next_npc_id = next_item_id = next_proj_id = shard + 1
+    snapshot_seq = shard
+
+def _align_id(v):
+    # plus petit id >= v de la série de ce shard
+    return v + (SHARD_ID + 1 - v) % ID_STEP
+
+def region_spawn_center():
+    if not sharded():
+        return 0, 0
+    strip = SHARD_ID  # première bande de la région, à droite de l'origine
+    return int((strip + 0.5) * STRIP_PX), 0
+
+def peer_send(shard, obj):
+    conn = peer_conns.get(shard)
+    ob = outboxes.get(conn) if conn is not None else None
+    if ob is None or ob.closed:
+        if conn is not None:
+            with lock: _release_conn(conn)
+        try:
+            conn = socket.create_connection(("127.0.0.1", SHARD_BASE_PORT + shard), timeout=1.0)
+            conn.settimeout(None)
+        except OSError:
+            shard_stats["peer_errors"] += 1
+            return False
+        peer_conns[shard] = conn
+        open_outbox(conn)
+    return _safe_send(conn, {**obj, "key": SHARD_KEY.decode()})
+
+def check_handoffs():
+    """Remet au shard voisin les joueurs qui ont franchi une frontière (lock tenu). Le client ne
+    voit rien: le routeur reçoit "shard_handoff" et rebranche la connexion sur le destinataire."""
+    moved = 0
+    for pid, p in list(players.items()):
+        x = p["x"]; dest = shard_of_x(x)
+        if dest == SHARD_ID or shard_of_x(x - HANDOFF_MARGIN) != shard_of_x(x + HANDOFF_MARGIN):
+            continue  # chez nous, ou encore dans la marge d'hystérésis
+        conn = clients.get(pid)
+        if conn is None or pid in entering:
+            continue
+        persist_player(pid)
+        state = {"pid": pid, "player": p, "inventory": inventories.get(pid, []),
+                 "cooldowns": cooldowns.get(pid, {"spells": {}}), "identity": pid_identity.get(pid),
+                 "proto": conn_proto.get(conn, wire.PROTO_JSON)}
+        # seen: messages du client déjà appliqués ici; le routeur rejoue les suivants chez le
+        # destinataire (exact en mode asyncio: commandes et passages sur le même thread)
+        _safe_send(conn, {"type":"shard_handoff","to":dest,"state":state,"seen":client_msgs.get(conn, 0)})
+        _drop_player(pid)
+        handed_off.add(conn)
+        shard_stats["handoffs_out"] += 1; moved += 1
+    return moved
+
+def attach_player(sess, st):
+    """Accueille un joueur remis par un autre shard sur la connexion ouverte par le routeur."""
+    conn = sess["conn"]; pid = int(st["pid"]); p = Player(st["player"])
+    ident = st.get("identity") or {}
+    with lock:
+        clients[pid] = conn
+        conn_proto[conn] = st.get("proto", wire.PROTO_JSON)
+        players[pid] = p; player_grid.insert(pid, p["x"], p["y"])
+        inventories[pid] = list(st.get("inventory") or [])
+        spells = (st.get("cooldowns") or {}).get("spells") or {}
+        cooldowns[pid] = {"spells": {int(k): v for k, v in spells.items()}}
+        if ident: pid_identity[pid] = ident
+        sess.update(pid=pid, authed_user=ident.get("username"), char_id=ident.get("char_id"), entered_world=True)
+        shard_stats["handoffs_in"] += 1
+    push_chunk_ring(pid, force=True)
     broadcast_state()
-    tick = 1.0 / TICK_HZ
-    while True:
-        time.sleep(tick)
-        changed = False
+
+def send_ghosts():
+    """Mirroring: envoie aux voisins les entités à moins de AOI_RADIUS d'une frontière, pour que
+    leurs clients les voient (lecture seule). Un envoi vide efface les fantômes côté voisin."""
+    out = {dest: {"players": {}, "npcs": {}, "items": {}} for dest in {(SHARD_ID - 1) % SHARD_COUNT, (SHARD_ID + 1) % SHARD_COUNT} - {SHARD_ID}}
+    for kind, store in (("players", players), ("npcs", npcs), ("items", items)):
+        for eid, e in store.items():
+            x = e["x"]; ox = x - (x // STRIP_PX) * STRIP_PX
+            if ox < AOI_RADIUS: dest = shard_of_x(x - STRIP_PX)
+            elif STRIP_PX - ox <= AOI_RADIUS: dest = shard_of_x(x + STRIP_PX)
+            else: continue
+            if dest in out: out[dest][kind][eid] = e
+    for dest, g in out.items():
+        peer_send(dest, {"type":"shard_ghosts","from":SHARD_ID, **g})
+        shard_stats["ghost_msgs"] += 1
+
+def add_ghosts(view, x, y):
+    # fantômes des voisins dans le rayon AOI (lock tenu); une entité locale de même id l'emporte
+    r2 = AOI_RADIUS * AOI_RADIUS; t = now()
+    for g in ghosts.values():
+        if t - g["at"] > GHOST_TTL:
+            continue
+        for kind in ("players", "npcs", "items"):
+            dst = view[kind]
+            for k, e in g[kind].items():
+                dx = e["x"] - x; dy = e["y"] - y
+                if dx*dx + dy*dy <= r2 and k not in dst:
+                    dst[k] = e
+
+def shard_key_ok(data):
+    key = data.get("key")
+    return bool(SHARD_KEY) and isinstance(key, str) and hmac.compare_digest(key.encode(), SHARD_KEY)
+
+def handle_shard_message(sess, data):
+    addr = sess["addr"]
+    if not sharded() or not addr or addr[0] not in ("127.0.0.1", "::1") or not shard_key_ok(data):
+        shard_stats["rejected"] += 1
+        return
+    t = data.get("type")
+    if t == "shard_attach":
+        attach_player(sess, data["state"])
+    elif t == "shard_ghosts":
+        g = {kind: {int(k): v for k, v in (data.get(kind) or {}).items()} for kind in ("players", "npcs", "items")}
         with lock:
-            # projectiles
-            t0 = now()
-            to_remove = []
-            for pid_, p in list(projs.items()):
-                # avancer plusieurs sous-steps pour lisser et éviter les collisions à grande vitesse
-                sub = 2
-                for _ in range(sub):
-                    p["x"] += p["vx"]/sub; p["y"] += p["vy"]/sub
-                changed = True  # positions de projectiles ont changé → diffuser
-                if p["x"] < 0 or p["x"] > WORLD_W or p["y"] < 0 or p["y"] > WORLD_H or t0 >= p["expire_at"]:
-                    to_remove.append(pid_); continue
-                if is_colliding_rect(p["x"], p["y"], 10, 10):
-                    to_remove.append(pid_); continue
-                hit = None
-                for nid, n in npcs.items():
-                    if dist(p["x"], p["y"], n["x"], n["y"]) <= 18:
-                        hit = nid; break
-                if hit is not None:
-                    n = npcs[hit]
-                    caster = players.get(p.get("owner")) or {}
-                    bonus = 0
-                    if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.6)
-                    elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.6)
-                    elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.6)
-                    n["hp"] -= (p["dmg"] + bonus); n["last_hit_by"] = p["owner"]
-                    if n["hp"] <= 0:
-                        # Récompense
-                        owner = players.get(p["owner"]) if p.get("owner") else None
-                        if owner:
-                            leveled = grant_xp_gold(owner, xp=random.randint(12,22), gold=random.randint(1,3))
-                            ident = pid_identity.get(p["owner"]) if p.get("owner") else None
-                            if ident: mark_dirty(ident["username"])
-                        drop_loot_at(n["x"], n["y"])
-                        del npcs[hit]
-                    to_remove.append(pid_)
-                    changed = True
-            for r in to_remove: projs.pop(r, None)
-
-            # IA mobs
-            for n in npcs.values():
-                target = None; best = 1e9
-                for p in players.values():
-                    if p["dead"]: continue
-                    d = dist(n["x"], n["y"], p["x"], p["y"])
-                    if d < best: best, target = d, p
-                if not n.get("hostile", True):
-                    continue  # PNJ pacifiques
-                if target and best < 160:
-                    if best > 2:
-                        vx = target["x"] - n["x"]; vy = target["y"] - n["y"]
-                        l = math.hypot(vx, vy) or 1
-                        n["x"], n["y"] = move_with_collisions(n["x"], n["y"], (n["speed"]*vx/l), (n["speed"]*vy/l), NPC_SIZE)
-                        changed = True
-                    if best <= 28 and now() >= n["atk_until"]:
-                        n["atk_until"] = now() + 1.2
-                        target["hp"] -= n.get("dmg", 6)
-                        if target["hp"] <= 0 and not target["dead"]:
-                            target["dead"] = True
-                            target["respawn_at"] = now() + 4.0
-                        changed = True
-
-            # respawn joueurs + regen
-            for p in players.values():
-                if p["dead"] and now() >= p.get("respawn_at", 0):
-                    p["dead"] = False
-                    p["hp"] = p["max_hp"]; p["mp"] = p["max_mp"]
-                    p["x"], p["y"] = random_free_pos()
-                    changed = True
-                if not p["dead"]:
-                    p["hp"] = min(p["max_hp"], p["hp"] + 0.5)
-                    p["mp"] = min(p["max_mp"], p["mp"] + 0.5)
-
-            # respawn mobs si peu
-            if len(npcs) < 5 and random.random() < 0.05:
-                spawn_mob(); changed = True
-            if random.random() < 0.002:
-                spawn_portal_to_dungeon(); changed = True
-
-        if changed:
-            broadcast_state()
+            src = int(data["from"]); old = ghosts.get(src)
+            if old is None or any(old[k] != g[k] for k in ("players", "npcs", "items")):
+                shard_stats["ghosts_changed"] = True  # logic_loop rediffusera l'état
+            g["at"] = now()
+            ghosts[src] = g
+    elif t == "shard_persist" and owns_accounts():
+        persist_player_to_character(data["username"], data["char_id"], data["player"], data["inventory"])
+        if data.get("logout"):
+            with lock:
+                active_usernames.discard(data["username"])
+
+# ---------- Mode threads: un thread par connexion ----------
+def handle_client(conn, addr):
+    sess = new_session(conn, addr)
+    open_outbox(conn)  # thread écrivain dédié
+    f = conn.makefile("rb")
+    try:
+        while True:
+            try:
+                data = wire.read_msg(f)
+            except Exception:
+                break
+            if data is None:
+                break
+            if isinstance(data, dict):
+                handle_message(sess, data)
+    finally:
+        end_session(sess)
+
+
+# ---------- Mode asyncio: toutes les connexions sur une seule boucle ----------
+class AsyncConn:
+    """Adaptateur "socket" autour d'un StreamWriter: sendall()/close() sont appelables depuis
+    n'importe quel thread (logic_loop, saver...), l'écriture se fait sur la boucle asyncio.
+    Les trames normales passent par l'Outbox de la connexion, vidée par _flush sur la boucle."""
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.closed = False
+        self.outbox = None
+        self._draining = False
+        self._kicked = False
+
+    def sendall(self, data):
+        if self.closed:
+            raise ConnectionResetError("connexion fermée")
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data):
+        if self.closed:
+            return
+        self.writer.write(data)
+        if not self._draining:
+            self._draining = True
+            self.loop.create_task(self._drain())
+
+    def kick(self):
+        # appelé par l'Outbox (n'importe quel thread): un seul _flush planifié à la fois
+        if self._kicked or self.closed:
+            return
+        self._kicked = True
+        try:
+            self.loop.call_soon_threadsafe(self._flush)
+        except RuntimeError:
+            pass  # boucle arrêtée
+
+    def _flush(self):
+        self._kicked = False
+        if self.closed or self._draining or self.outbox is None:
+            return  # _drain relancera _flush une fois le tampon vidé
+        if self.outbox.closed:
+            self.close(); return
+        data = self.outbox.take_nowait()
+        if data:
+            self._write(data)
+
+    async def _drain(self):
+        try:
+            await asyncio.wait_for(self.writer.drain(), WRITE_TIMEOUT)
+        except Exception:
+            self.close()  # client trop lent ou parti
+        finally:
+            self._draining = False
+        self._flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.outbox: self.outbox.close()
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+_open_conns = 0  # connexions actives (les deux modes)
+
+# La boucle ne fait que lire, décoder, mettre en file et écrire: les commandes décodées sont
+# exécutées par le thread logique (entre deux pas), seul à prendre le lock du monde pour elles.
+# La fin de session passe par la même file, après les dernières commandes de la connexion.
+command_queue = deque()          # (sess, message | None = fin de session)
+_commands_ready = threading.Event()
+
+def queue_command(sess, data):
+    if data is not None:
+        sess["queued"] += 1      # écrit par la boucle seulement ("done": thread logique seulement)
+    command_queue.append((sess, data))
+    _commands_ready.set()
+
+def run_commands(limit=CMD_BATCH_MAX):
+    """Exécute les commandes en attente (thread logique). Renvoie True si l'une d'elles a demandé
+    une diffusion de l'état (faite ensuite par logic_loop, une fois pour tout le lot)."""
+    _commands_ready.clear()
+    n = 0
+    _state_deferred.pending = False
+    with outbox_batch():
+        while n < limit and command_queue:
+            sess, data = command_queue.popleft()
+            try:
+                if data is None:
+                    end_session(sess)
+                else:
+                    sess["done"] += 1
+                    handle_message(sess, data)
+            except Exception as e:
+                # une commande invalide ne doit pas arrêter la simulation
+                print(f"[COMMANDES] {data.get('type') if data else 'fin de session'}: {type(e).__name__}: {e}")
+            n += 1
+    pending, _state_deferred.pending = _state_deferred.pending, None
+    if command_queue:
+        _commands_ready.set()  # reste pour le prochain passage
+    return pending
+
+async def _serve_async_client(reader, writer):
+    global _open_conns
+    if _open_conns >= MAX_CONNECTIONS:
+        writer.close()
+        return
+    _open_conns += 1
+    conn = AsyncConn(asyncio.get_running_loop(), writer)
+    sess = new_session(conn, writer.get_extra_info("peername"))
+    conn.outbox = open_outbox(conn, conn.kick)
+    try:
+        while not conn.closed:
+            while sess["queued"] - sess["done"] >= CMD_PENDING_MAX:
+                await asyncio.sleep(0.5 / TICK_HZ)  # client trop bavard: on cesse de le lire
+            try:
+                data = await asyncio.wait_for(wire.read_msg_async(reader), READ_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+                break
+            if data is None:
+                break
+            if isinstance(data, dict):
+                queue_command(sess, data)
+    finally:
+        _open_conns -= 1
+        conn.close()
+        queue_command(sess, None)
+
+async def serve_async():
+    server = await asyncio.start_server(_serve_async_client, HOST, PORT)
+    print(f"[SERVEUR] asyncio en ligne sur {HOST}:{PORT} (max {MAX_CONNECTIONS} connexions)")
+    async with server:
+        await server.serve_forever()
+
+# ---------- Boucle logique ----------
+# late: pas démarrés après leur échéance; overruns: pas plus longs qu'un tick; catchup: pas
+# supplémentaires enchaînés pour rattraper; dropped: pas abandonnés au-delà de MAX_CATCHUP_STEPS
+tick_stats = {"ticks": 0, "late": 0, "overruns": 0, "catchup": 0, "dropped": 0, "work_max": 0.0}
+
+# ---------- Profil des ticks ----------
+# Chaque tour de logic_loop (pas de simulation + diffusion) est découpé en phases; les durées vont
+# dans des fenêtres glissantes (p50/p99 dans stats_loop) et un tour plus long que SLOW_TICK_MS est
+# journalisé avec le nombre d'entités. lock_attente/lock_tenu recoupent les autres phases.
+# SIGUSR1 (ou la création du fichier PROFILE_TRIGGER_PATH) lance un profil par échantillonnage de
+# PROFILE_SECONDS, écrit en piles repliées (flamegraph.pl, speedscope) sans redémarrer le serveur.
+PROFILE_WINDOW = 1200       # tours gardés par phase (~60 s à 20 Hz)
+SLOW_TICK_MS = 1000.0 / TICK_HZ
+SLOW_LOG_EVERY = 1.0        # au plus une ligne "tick lent" par seconde
+PROFILE_SECONDS = 5.0
+PROFILE_INTERVAL = 0.001
+PROFILE_TRIGGER_PATH = "profile.trigger"
+TICK_PHASES = ("commandes", "projectiles", "mobs", "lod", "regen", "spawn_mobs", "portails", "shard",
+               "etat_construction", "etat_envoi", "chunks", "lock_attente", "lock_tenu", "total")
+tick_prof = {ph: deque(maxlen=PROFILE_WINDOW) for ph in TICK_PHASES}
+_prof = threading.local()   # .cur: phases du tour en cours (thread logique seulement)
+_slow = {"last": 0.0, "muted": 0}
+_profile_req = threading.Event()
+
+def _lap(phase, t0):
+    """Ajoute perf_counter() - t0 à la phase du tour en cours; renvoie l'instant courant.
+    Sans effet hors du thread logique (broadcast_state appelé par un client, par ex.)."""
+    t = time.perf_counter()
+    cur = getattr(_prof, "cur", None)
+    if cur is not None:
+        cur[phase] = cur.get(phase, 0.0) + (t - t0)
+    return t
+
+class timed_lock:
+    """`with lock` qui compte l'attente et la tenue du lock dans le profil du tour."""
+    def __enter__(self):
+        t0 = time.perf_counter()
+        lock.acquire()
+        self.t = _lap("lock_attente", t0)
+    def __exit__(self, *exc):
+        lock.release()
+        _lap("lock_tenu", self.t)
+
+def tick_prof_begin():
+    _prof.cur = {}
+    return time.perf_counter()
+
+def tick_prof_end(t0):
+    cur = _prof.cur; _prof.cur = None
+    cur["total"] = time.perf_counter() - t0
+    for ph in TICK_PHASES:
+        tick_prof[ph].append(cur.get(ph, 0.0) * 1000.0)
+    if cur["total"] * 1000.0 > SLOW_TICK_MS:
+        t = time.monotonic()
+        if t - _slow["last"] < SLOW_LOG_EVERY:
+            _slow["muted"] += 1
+            return
+        muted, _slow["last"], _slow["muted"] = _slow["muted"], t, 0
+        parts = " ".join(f"{ph}={cur[ph]*1000:.1f}" for ph in TICK_PHASES[:-1] if cur.get(ph, 0.0) >= 0.0005)
+        print(f"[TICK LENT] {cur['total']*1000:.1f}ms {parts} | joueurs={len(players)} mobs={len(npcs)} "
+              f"objets={len(items)} projectiles={len(projs)} clients={len(clients)}"
+              + (f" (+{muted} non affichés)" if muted else ""))
+
+def _pct(vals, q):
+    s = sorted(vals)
+    return s[min(len(s) - 1, int(q * len(s)))] if s else 0.0
+
+def tick_prof_summary():
+    """{phase: (p50, p99)} en ms sur la fenêtre glissante."""
+    return {ph: (_pct(list(v), 0.5), _pct(list(v), 0.99)) for ph, v in tick_prof.items()}
+
+def _frame_name(f):
+    c = f.f_code
+    return f"{c.co_name} ({os.path.basename(c.co_filename)}:{c.co_firstlineno})"
+
+def sample_profile(seconds=PROFILE_SECONDS, interval=PROFILE_INTERVAL):
+    """Échantillonne les piles de tous les threads; écrit profile-<date>.folded et affiche les
+    fonctions les plus vues (en propre) dans le thread logique."""
+    me = threading.get_ident()
+    names = {th.ident: th.name for th in threading.enumerate()}
+    stacks, own, n = {}, {}, 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for tid, f in sys._current_frames().items():
+            if tid == me:
+                continue
+            tname = names.get(tid, str(tid))
+            top = _frame_name(f); parts = []
+            while f is not None:
+                parts.append(_frame_name(f)); f = f.f_back
+            key = tname + ";" + ";".join(reversed(parts))
+            stacks[key] = stacks.get(key, 0) + 1
+            if tname == "logic":
+                own[top] = own.get(top, 0) + 1
+        n += 1
+        time.sleep(interval)
+    path = time.strftime("profile-%Y%m%d-%H%M%S.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for key, c in sorted(stacks.items()):
+            f.write(f"{key} {c}\n")
+    total = sum(own.values()) or 1
+    print(f"[PROFIL] {n} échantillons en {seconds:.0f}s -> {path}; thread logique, temps propre:")
+    for name, c in sorted(own.items(), key=lambda kv: -kv[1])[:15]:
+        print(f"[PROFIL] {100.0*c/total:5.1f}% {name}")
+    return path
+
+def profiler_loop():
+    while True:
+        _profile_req.wait(1.0)
+        if os.path.exists(PROFILE_TRIGGER_PATH):
+            try: os.remove(PROFILE_TRIGGER_PATH)
+            except OSError: pass
+            _profile_req.set()
+        if _profile_req.is_set():
+            _profile_req.clear()
+            try: sample_profile()
+            except OSError as e: print(f"[PROFIL] échec: {e}")
+
+def install_profile_signal():
+    # à appeler depuis le thread principal; SIGUSR1 absent sous Windows: fichier déclencheur seul
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: _profile_req.set())
+
+def _proj_hit(owner_pid, dmg, nid):
+    """Impact d'un projectile de owner_pid (dégâts de base dmg) sur le mob nid (lock tenu)."""
+    n = npcs[nid]
+    caster = players.get(owner_pid) or {}
+    bonus = 0
+    if caster.get("class") == "Guerrier": bonus = int(caster.get("stats",{}).get("str",0)*0.6)
+    elif caster.get("class") == "Mage": bonus = int(caster.get("stats",{}).get("int",0)*0.6)
+    elif caster.get("class") == "Voleur": bonus = int(caster.get("stats",{}).get("agi",0)*0.6)
+    n["hp"] -= (dmg + bonus); n["last_hit_by"] = owner_pid
+    if n["hp"] <= 0:
+        # Récompense
+        owner = players.get(owner_pid) if owner_pid else None
+        if owner:
+            leveled = grant_xp_gold(owner, xp=random.randint(12,22), gold=random.randint(1,3))
+            ident = pid_identity.get(owner_pid) if owner_pid else None
+            if ident: mark_dirty(ident["username"], ident["char_id"])
+        drop_loot_at(n["x"], n["y"])
+        del npcs[nid]; npc_grid.remove(nid)
+
+def _step_projs_py(t):
+    changed = False
+    to_remove = []
+    for pid_, p in list(projs.items()):
+        # avancer plusieurs sous-steps pour lisser et éviter les collisions à grande vitesse
+        sub = 2
+        for _ in range(sub):
+            p["x"] += p["vx"]/sub; p["y"] += p["vy"]/sub
+        proj_grid.move(pid_, p["x"], p["y"])
+        changed = True  # positions de projectiles ont changé → diffuser
+        if p["x"] < 0 or p["x"] > WORLD_W or p["y"] < 0 or p["y"] > WORLD_H or t >= p["expire_at"]:
+            to_remove.append(pid_); continue
+        if not owns_x(p["x"]):
+            to_remove.append(pid_); continue  # sorti de la région du shard
+        if is_colliding_rect(p["x"], p["y"], 10, 10):
+            to_remove.append(pid_); continue
+        hits = npc_grid.query_radius(p["x"], p["y"], 18)
+        if hits:
+            _proj_hit(p["owner"], p["dmg"], hits[0])
+            to_remove.append(pid_)
+    for r in to_remove: projs.pop(r, None); proj_grid.remove(r)
+    return changed
+
+def _mob_cols(ents, *names):
+    """Une colonne float par attribut (npcs ne contient que des Mob: lecture sans __getitem__)."""
+    return [np.fromiter(map(operator.attrgetter(f), ents), float, len(ents)) for f in names]
+
+def _npc_hits_np(px, py, r):
+    """Mobs à distance <= r de chaque point (px[i], py[i]): paires (i, nid) triées par i puis
+    par nid (l'ordre de npc_grid.query_radius). Seuls les mobs des cellules voisines des points
+    sont lus; la jointure se fait par recherche dans leurs clés de cellule."""
+    cell = npc_grid.cell
+    gx = (px // cell).astype(np.int64); gy = (py // cell).astype(np.int64)
+    cells = npc_grid.cells
+    reach = int(r // cell) + 1  # cellules voisines pouvant contenir un mob à distance <= r
+    offs = range(-reach, reach + 1)
+    nids = []
+    for cx, cy in set(zip(gx.tolist(), gy.tolist())):
+        for ox in offs:
+            for oy in offs:
+                ids = cells.get((cx + ox, cy + oy))
+                if ids: nids.extend(ids)
+    if not nids:
+        return [], []
+    nids = np.unique(np.array(nids, np.int64))
+    nx, ny = _mob_cols([npcs[k] for k in nids.tolist()], "x", "y")
+    nkey = (nx // cell).astype(np.int64) * _CHUNK_KEY + (ny // cell).astype(np.int64)
+    order = np.argsort(nkey, kind="stable")  # à clé égale: ids croissants (nids est trié)
+    nkey = nkey[order]
+    pi, nj = [], []
+    for ox in offs:
+        for oy in offs:
+            k = (gx + ox) * _CHUNK_KEY + (gy + oy)
+            lo = np.searchsorted(nkey, k, "left"); hi = np.searchsorted(nkey, k, "right")
+            cnt = hi - lo
+            tot = int(cnt.sum())
+            if not tot:
+                continue
+            start = np.cumsum(cnt) - cnt
+            pi.append(np.repeat(np.arange(len(k)), cnt))
+            nj.append(order[np.repeat(lo, cnt) + np.arange(tot) - np.repeat(start, cnt)])
+    if not pi:
+        return [], []
+    pi = np.concatenate(pi); nj = np.concatenate(nj)
+    dx = nx[nj] - px[pi]; dy = ny[nj] - py[pi]
+    near = dx*dx + dy*dy <= r * r  # même test que query_radius
+    pi = pi[near]; hit = nids[nj[near]]
+    o = np.lexsort((hit, pi))
+    return pi[o].tolist(), hit[o].tolist()
+
+def _step_projs_np(t):
+    P = projs
+    if not len(P):
+        return False
+    P.advance(2)
+    n = P.n
+    x, y = P.x[:n], P.y[:n]
+    keep = (P.ids[:n] >= 0) & ~((x < 0) | (x > WORLD_W) | (y < 0) | (y > WORLD_H) | (t >= P.expire_at[:n]))
+    if sharded():
+        keep &= np.floor(x / STRIP_PX) % SHARD_COUNT == SHARD_ID  # sortis de la région du shard
+    live = np.flatnonzero(keep)
+    # murs: tous les projectiles restants d'un coup
+    wall = rects_colliding_np(x[live], y[live], 10)
+    keep[live[wall]] = False
+    live = live[~wall]
+    # impacts: candidats calculés d'un coup, puis appliqués dans l'ordre des ids (un mob tué par
+    # un projectile précédent ne peut plus être touché; les mobs ne bougent pas pendant ce temps)
+    if len(live) and npcs:
+        pi, hit = _npc_hits_np(x[live], y[live], 18)
+        done = -1
+        for i, nid in zip(pi, hit):
+            if i == done or nid not in npcs:
+                continue
+            row = int(live[i]); owner = int(P.owner[row])
+            _proj_hit(owner if owner >= 0 else None, int(P.dmg[row]), nid)
+            keep[row] = False; done = i
+    P.compact(keep)
+    return True
+
+# ---------- Champs de flux (poursuite des mobs) ----------
+# Un champ = distances BFS (8 voisins, sans couper les coins) sur une fenêtre de
+# (2*FLOW_RADIUS+1)^2 tuiles centrée sur la tuile d'une cible. Les tuiles ne changent jamais:
+# un champ reste valable tant qu'il est en cache; il est partagé par tous les mobs qui chassent
+# un joueur de cette tuile (donc par un groupe de joueurs voisins), et un joueur qui change de
+# tuile ne coûte qu'un nouveau BFS, une fois pour tous ses poursuivants.
+FLOW_FIELDS = True
+FLOW_RADIUS = 8              # tuiles (aggro à 160 px = 4 tuiles: marge pour contourner)
+FLOW_CACHE_MAX = 1024
+FLOW_UNREACHED = 255
+_FLOW_DIRS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+flow_cache = OrderedDict()   # (tx, ty) tuile cible -> (x0, y0, distances bytearray)
+flow_stats = {"builds": 0, "hits": 0, "steered": 0}
+
+def _flow_build(tx, ty):
+    r = FLOW_RADIUS; w = 2 * r + 1
+    x0, y0 = tx - r, ty - r
+    free = bytearray(w * w)
+    for j in range(w):
+        cy, ly = divmod(y0 + j, CHUNK_TILES)
+        masks = {}
+        for i in range(w):
+            cx, lx = divmod(x0 + i, CHUNK_TILES)
+            m = masks.get(cx)
+            if m is None:
+                m = masks[cx] = get_chunk_mask(cx, cy)[ly]
+            if not (m >> lx) & 1:
+                free[j * w + i] = 1
+    dist = bytearray(b"\xff") * (w * w)
+    start = r * w + r
+    dist[start] = 0
+    q = deque([start])
+    while q:
+        k = q.popleft()
+        j, i = divmod(k, w); d = dist[k] + 1
+        for di, dj in _FLOW_DIRS:
+            ni, nj = i + di, j + dj
+            if not (0 <= ni < w and 0 <= nj < w):
+                continue
+            nk = nj * w + ni
+            if dist[nk] != FLOW_UNREACHED or not free[nk]:
+                continue
+            if di and dj and not (free[j * w + ni] and free[nj * w + i]):
+                continue  # pas de diagonale entre deux murs
+            dist[nk] = d; q.append(nk)
+    return x0, y0, dist
+
+def flow_field(tx, ty):
+    key = (tx, ty)
+    f = flow_cache.get(key)
+    if f is not None:
+        flow_cache.move_to_end(key); flow_stats["hits"] += 1
+        return f
+    f = flow_cache[key] = _flow_build(tx, ty)
+    flow_stats["builds"] += 1
+    if len(flow_cache) > FLOW_CACHE_MAX:
+        flow_cache.popitem(last=False)
+    return f
+
+def _flow_at(f, tx, ty):
+    x0, y0, dist = f; w = 2 * FLOW_RADIUS + 1
+    i, j = tx - x0, ty - y0
+    return dist[j * w + i] if 0 <= i < w and 0 <= j < w else FLOW_UNREACHED
+
+def _steer(n, target, vx, vy, l):
+    """Direction de poursuite (vx, vy, norme l): droit sur la cible à un pas d'elle sur le champ,
+    sinon vers le centre de la tuile voisine la plus proche (à égalité: la plus alignée)."""
+    if not FLOW_FIELDS:
+        return vx, vy, l
+    mtx, mty = int(n["x"] // TILE), int(n["y"] // TILE)
+    f = flow_field(int(target["x"] // TILE), int(target["y"] // TILE))
+    here = _flow_at(f, mtx, mty)
+    if here <= 1 or here == FLOW_UNREACHED:
+        return vx, vy, l  # à côté, hors fenêtre ou coupé de la cible: ligne droite comme avant
+    # alignement mesuré depuis le centre de la tuile: le choix reste le même tant que le mob
+    # n'en sort pas (pas d'hésitation entre deux voisins à égalité)
+    ax = target["x"] - (mtx * TILE + TILE / 2); ay = target["y"] - (mty * TILE + TILE / 2)
+    best = None; best_key = (here, 0.0)
+    for di, dj in _FLOW_DIRS:
+        d = _flow_at(f, mtx + di, mty + dj)
+        if d == FLOW_UNREACHED:
+            continue
+        if di and dj and (_flow_at(f, mtx + di, mty) == FLOW_UNREACHED or _flow_at(f, mtx, mty + dj) == FLOW_UNREACHED):
+            continue
+        key = (d, -(di * ax + dj * ay))  # à distance égale: la plus alignée sur la cible
+        if key < best_key:
+            best, best_key = (di, dj), key
+    if best is None:
+        return vx, vy, l
+    flow_stats["steered"] += 1
+    vx = (mtx + best[0]) * TILE + TILE / 2 - n["x"]
+    vy = (mty + best[1]) * TILE + TILE / 2 - n["y"]
+    return vx, vy, math.hypot(vx, vy) or 1
+
+def _flow_at_np(fields, g, tx, ty):
+    x0, y0, dist = fields; w = 2 * FLOW_RADIUS + 1
+    i, j = tx - x0[g], ty - y0[g]
+    inside = (i >= 0) & (i < w) & (j >= 0) & (j < w)
+    out = np.full(len(tx), FLOW_UNREACHED, np.int64)
+    out[inside] = dist[g[inside], j[inside] * w + i[inside]]
+    return out
+
+def _steer_np(mx, my, tgx, tgy, vx, vy):
+    """_steer groupé (mob i -> cible en (tgx[i], tgy[i])): (vx, vy, déviés?). Un champ par tuile
+    cible, empilés; même choix de voisin (distance, puis alignement) et mêmes arrondis que la
+    version scalaire."""
+    steered = np.zeros(len(mx), bool)
+    if not FLOW_FIELDS:
+        return vx, vy, steered
+    mtx = (mx // TILE).astype(np.int64); mty = (my // TILE).astype(np.int64)
+    keys, g = np.unique((tgx // TILE).astype(np.int64) * _CHUNK_KEY + ((tgy // TILE).astype(np.int64) + (1 << 31)),
+                        return_inverse=True)
+    g = g.ravel()
+    fs = [flow_field(int(k >> 32), int(k & 0xFFFFFFFF) - (1 << 31)) for k in keys.tolist()]
+    fields = (np.array([f[0] for f in fs], np.int64), np.array([f[1] for f in fs], np.int64),
+              np.stack([np.frombuffer(f[2], np.uint8) for f in fs]))
+    here = _flow_at_np(fields, g, mtx, mty)
+    ax = tgx - (mtx * TILE + TILE / 2); ay = tgy - (mty * TILE + TILE / 2)
+    bd = here; bk = np.zeros(len(mx)); bi = np.zeros(len(mx), np.int64); bj = np.zeros(len(mx), np.int64)
+    for di, dj in _FLOW_DIRS:
+        d = _flow_at_np(fields, g, mtx + di, mty + dj)
+        ok = d != FLOW_UNREACHED
+        if di and dj:  # pas de diagonale entre deux murs
+            ok &= (_flow_at_np(fields, g, mtx + di, mty) != FLOW_UNREACHED) & (_flow_at_np(fields, g, mtx, mty + dj) != FLOW_UNREACHED)
+        k = -(di * ax + dj * ay)
+        better = ok & ((d < bd) | ((d == bd) & (k < bk)))
+        bd = np.where(better, d, bd); bk = np.where(better, k, bk)
+        bi[better] = di; bj[better] = dj; steered |= better
+    steered &= (here > 1) & (here != FLOW_UNREACHED)
+    vx = np.where(steered, (mtx + bi) * TILE + TILE / 2 - mx, vx)
+    vy = np.where(steered, (mty + bj) * TILE + TILE / 2 - my, vy)
+    return vx, vy, steered
+
+# ---------- Niveaux de détail de la simulation ----------
+# Trois paliers de mobs. "Actif": à portée d'aggro (160 px) d'un joueur vivant, poursuite à
+# chaque pas. "Éveillé": dans un chunk surveillé (à LOD_WATCH_RING chunks d'un joueur, fantômes
+# des voisins compris) mais hors d'aggro; présent dans npcs et visible, il erre, mis à jour un pas
+# sur LOD_MID_EVERY (quand (pas + id) % LOD_MID_EVERY == 0) avec un déplacement multiplié
+# d'autant. "Endormi": ailleurs; retiré de npcs et de l'index, rangé par chunk et réveillé tel
+# quel quand un joueur revient. Le tri éveillé/endormi se refait tous les LOD_EVERY pas: le coût
+# d'un pas suit le nombre de régions peuplées, pas le nombre total de mobs.
+LOD_EVERY = 10
+LOD_MID_EVERY = 5
+LOD_WATCH_RING = AOI_RADIUS // (TILE * CHUNK_TILES) + 1  # tout mob dans l'AOI d'un joueur reste éveillé
+WANDER_SPEED = 0.4   # errance: fraction de la vitesse de poursuite
+WANDER_TURN = 0.25   # chance de changer de cap (ou de s'arrêter) à chaque mise à jour
+dormant = {}         # (cx, cy) -> {nid: mob}
+lod_stats = {"active": 0, "mid": 0, "asleep": 0, "slept": 0, "woken": 0, "wandered": 0}
+# step: pas écoulés; mid: mobs éveillés répartis par phase (refait par lod_pass); active: ids du pas
+_lod = {"ticks": 0, "step": 0, "mid": [[] for _ in range(LOD_MID_EVERY)], "active": set()}
+
+def _active_mobs():
+    """Mobs à portée d'aggro d'un joueur vivant, dans l'ordre des ids (lock tenu)."""
+    cand = set()
+    for p in players.values():
+        if not p["dead"]:
+            cand.update(npc_grid.query_radius(p["x"], p["y"], 160))
+    lod_stats["active"] = len(cand)
+    _lod["active"] = cand
+    return sorted(cand)
+
+def _wander(nid, n, k):
+    # k pas d'errance d'un coup; cap (dx, dy) gardé d'une mise à jour à l'autre
+    if random.random() < WANDER_TURN:
+        if random.random() < 0.5:
+            n["dx"], n["dy"] = 0, 0
+        else:
+            a = random.random() * 2 * math.pi
+            n["dx"], n["dy"] = math.cos(a), math.sin(a)
+    if not (n["dx"] or n["dy"]):
+        return False
+    step = n["speed"] * WANDER_SPEED * k
+    nx, ny = move_with_collisions(n["x"], n["y"], n["dx"] * step, n["dy"] * step, NPC_SIZE)
+    if (nx, ny) == (n["x"], n["y"]) or not owns_x(nx):
+        n["dx"], n["dy"] = 0, 0  # contre un mur (ou au bord de la région): repartira ailleurs
+        return False
+    n["x"], n["y"] = nx, ny
+    npc_grid.move(nid, nx, ny)
+    return True
+
+def _step_mobs_mid():
+    """Palier intermédiaire: la phase courante des mobs éveillés hors d'aggro (lock tenu)."""
+    _lod["step"] += 1
+    changed = False
+    active = _lod["active"]
+    for nid in _lod["mid"][-_lod["step"] % LOD_MID_EVERY]:
+        n = npcs.get(nid)
+        if n is None or nid in active or not n.get("hostile", True) or not n["speed"]:
+            continue
+        lod_stats["wandered"] += 1
+        changed |= _wander(nid, n, LOD_MID_EVERY)
+    return changed
+
+def mob_count():
+    return len(npcs) + lod_stats["asleep"]
+
+def _watched_chunks():
+    cs = TILE * CHUNK_TILES; r = LOD_WATCH_RING
+    pts = [(p["x"], p["y"]) for p in players.values()]
+    for g in ghosts.values():
+        pts.extend((e["x"], e["y"]) for e in g["players"].values())
+    out = set()
+    for x, y in pts:
+        cx, cy = int(x // cs), int(y // cs)
+        out.update((cx + i, cy + j) for i in range(-r, r + 1) for j in range(-r, r + 1))
+    return out
+
+def lod_pass():
+    """Endort les mobs hors des chunks surveillés, réveille les autres (lock tenu). Renvoie True
+    si des mobs sont réapparus."""
+    cs = TILE * CHUNK_TILES
+    watched = _watched_chunks()
+    for nid in [nid for nid, n in npcs.items() if (int(n["x"] // cs), int(n["y"] // cs)) not in watched]:
+        n = npcs.pop(nid); npc_grid.remove(nid); n.touch()  # endormi: plus diffusé
+        dormant.setdefault((int(n["x"] // cs), int(n["y"] // cs)), {})[nid] = n
+        lod_stats["asleep"] += 1; lod_stats["slept"] += 1
+    woke = False
+    for key in watched & dormant.keys():
+        for nid, n in sorted(dormant.pop(key).items()):
+            npcs[nid] = n; npc_grid.insert(nid, n["x"], n["y"])
+            lod_stats["asleep"] -= 1; lod_stats["woken"] += 1
+            woke = True
+    mid = _lod["mid"] = [[] for _ in range(LOD_MID_EVERY)]
+    for nid in sorted(npcs):
+        mid[nid // ID_STEP % LOD_MID_EVERY].append(nid)  # ids entrelacés entre shards
+    lod_stats["mid"] = len(npcs) - lod_stats["active"]
+    return woke
+
+def _mob_attack(n, target, best, t):
+    if best <= 28 and t >= n["atk_until"]:
+        n["atk_until"] = t + 1.2
+        target["hp"] -= n.get("dmg", 6)
+        if target["hp"] <= 0 and not target["dead"]:
+            target["dead"] = True
+            target["respawn_at"] = t + 4.0
+        return True
+    return False
 
-def start_server():
+def _step_mobs_py(t):
+    changed = False
+    for nid in _active_mobs():
+        n = npcs[nid]
+        if not n.get("hostile", True):
+            continue  # PNJ pacifiques
+        tpid, best = player_grid.nearest(n["x"], n["y"], 160, _alive)
+        target = players[tpid] if tpid is not None else None
+        if target:
+            if best > 2:
+                vx = target["x"] - n["x"]; vy = target["y"] - n["y"]
+                vx, vy, l = _steer(n, target, vx, vy, math.hypot(vx, vy) or 1)
+                nx, ny = move_with_collisions(n["x"], n["y"], (n["speed"]*vx/l), (n["speed"]*vy/l), NPC_SIZE)
+                if owns_x(nx): n["x"], n["y"] = nx, ny  # un mob reste dans la région de son shard
+                npc_grid.move(nid, n["x"], n["y"])
+                changed = True
+            changed |= _mob_attack(n, target, best, t)
+    return changed
+
+def _step_mobs_np(t):
+    # mobs actifs, cible la plus proche, direction, champ de flux et collisions en calcul
+    # matriciel. Si aucun joueur ne peut mourir dans ce pas, l'ordre des mobs ne compte plus:
+    # seuls les mobs qui bougent vraiment sont réécrits, l'index seulement s'ils changent de
+    # cellule. Sinon les effets sont appliqués mob par mob, dans l'ordre des ids.
+    alive = [(pid, p) for pid, p in players.items() if not p["dead"]]
+    if not alive:
+        return False
+    px = np.array([p["x"] for _, p in alive], float)
+    py = np.array([p["y"] for _, p in alive], float)
+    # paires (joueur, mob) à portée d'aggro: les mobs actifs, et leur cible (aucun joueur plus
+    # loin ne peut être plus proche)
+    pi, hit = _npc_hits_np(px, py, 160)
+    pi = np.array(pi, np.int64); hit = np.array(hit, np.int64)
+    ids = np.unique(hit)
+    lod_stats["active"] = len(ids)
+    _lod["active"] = set(ids.tolist())
+    ents = [npcs[nid] for nid in ids.tolist()]
+    keep = np.fromiter((e.get("hostile", True) for e in ents), bool, len(ents))  # PNJ pacifiques
+    if not keep.any():
+        return False
+    cand = ids[keep].tolist()
+    ents = [e for e, h in zip(ents, keep.tolist()) if h]
+    k = len(cand)
+    mx, my, sp, atk = _mob_cols(ents, "x", "y", "speed", "atk_until")
+    c = np.searchsorted(cand, hit)
+    ok = (c < k) & (np.asarray(cand)[np.minimum(c, k - 1)] == hit)
+    c = c[ok]; pi = pi[ok]
+    d = np.hypot(px[pi] - mx[c], py[pi] - my[c])
+    o = np.lexsort((pi, d, c))  # par mob: la plus courte distance, à égalité le premier joueur
+    first = np.ones(len(o), bool); first[1:] = c[o][1:] != c[o][:-1]
+    j = pi[o][first]
+    vx = px[j] - mx; vy = py[j] - my
+    # distance recalculée avec math.hypot: mêmes arrondis que le mode dict
+    b = [math.hypot(x, y) for x, y in zip(vx.tolist(), vy.tolist())]
+    barr = np.array(b)
+    moving = np.flatnonzero((barr > 2) & (barr < 160))
+    steered = np.zeros(k, bool)
+    gx = gy = bx = by = None
+    if len(moving):
+        jm = j[moving]
+        vx[moving], vy[moving], steered[moving] = _steer_np(mx[moving], my[moving], px[jm], py[jm], vx[moving], vy[moving])
+        l = np.array([math.hypot(x, y) or 1 for x, y in zip(vx[moving].tolist(), vy[moving].tolist())])
+        gx, gy, bx, by = move_with_collisions_np(mx[moving], my[moving], sp[moving] * vx[moving] / l, sp[moving] * vy[moving] / l, NPC_SIZE)
+    hit = np.flatnonzero((barr <= 28) & (t >= atk))
+    if len(hit):
+        dmg = np.array([ents[i].get("dmg", 6) for i in hit.tolist()], float)
+        taken = np.bincount(j[hit], dmg, len(alive))
+        hp = np.array([p["hp"] for _, p in alive], float)
+        if (hp - taken <= 0)[taken > 0].any():
+            return _apply_mobs_seq(t, cand, alive, j, b, moving, gx, gy, bx, by, steered)
+    changed = False
+    if len(moving):
+        changed = True
+        flow_stats["steered"] += int(steered[moving].sum())
+        # axe bloqué: valeur d'origine, comme move_with_collisions; hors région: pas de déplacement
+        ox = np.where(bx, mx[moving], gx); oy = np.where(by, my[moving], gy)
+        upd = ~(bx & by)
+        if sharded():
+            upd &= np.floor(ox / STRIP_PX) % SHARD_COUNT == SHARD_ID
+        cell = npc_grid.cell
+        recell = (ox // cell != mx[moving] // cell) | (oy // cell != my[moving] // cell)
+        for i, nx, ny, bxi, byi, rc in zip(moving[upd].tolist(), gx[upd].tolist(), gy[upd].tolist(),
+                                           bx[upd].tolist(), by[upd].tolist(), recell[upd].tolist()):
+            n = ents[i]
+            if bxi: nx = n.x
+            if byi: ny = n.y
+            n.move_to(nx, ny)
+            if rc: npc_grid.move(cand[i], nx, ny)
+    for i in hit.tolist():
+        changed |= _mob_attack(ents[i], alive[j[i]][1], b[i], t)
+    return changed
+
+def _apply_mobs_seq(t, cand, alive, j, b, moving, gx, gy, bx, by, steered):
+    """Effets des mobs un par un, dans l'ordre des ids: un joueur tué en cours de pas n'est plus
+    une cible pour les mobs suivants."""
+    step = dict(zip(moving.tolist(), zip(gx.tolist(), gy.tolist(), bx.tolist(), by.tolist(), steered[moving].tolist()))) if len(moving) else {}
+    j = j.tolist()
+    changed = False
+    for i, nid in enumerate(cand):
+        n = npcs[nid]
+        target = alive[j[i]][1]
+        if target["dead"]:
+            # tué par un mob traité avant dans ce pas: recalcul individuel
+            tpid, bi = player_grid.nearest(n["x"], n["y"], 160, _alive)
+            if tpid is None: continue
+            target = players[tpid]
+            if bi > 2:
+                wx = target["x"] - n["x"]; wy = target["y"] - n["y"]
+                wx, wy, l = _steer(n, target, wx, wy, math.hypot(wx, wy) or 1)
+                nx, ny = move_with_collisions(n["x"], n["y"], (n["speed"]*wx/l), (n["speed"]*wy/l), NPC_SIZE)
+                if owns_x(nx): n["x"], n["y"] = nx, ny
+                npc_grid.move(nid, n["x"], n["y"])
+                changed = True
+            changed |= _mob_attack(n, target, bi, t)
+            continue
+        bi = b[i]
+        if bi >= 160:
+            continue
+        if bi > 2:
+            nx, ny, bx, by, st = step[i]
+            flow_stats["steered"] += st
+            if bx: nx = n["x"]  # axe bloqué: valeur d'origine, comme move_with_collisions
+            if by: ny = n["y"]
+            if owns_x(nx): n["x"], n["y"] = nx, ny  # un mob reste dans la région de son shard
+            npc_grid.move(nid, n["x"], n["y"])
+            changed = True
+        changed |= _mob_attack(n, target, bi, t)
+    return changed
+
+def logic_step(t):
+    """Un pas de simulation de durée 1/TICK_HZ; t = horodatage unique du pas. Renvoie True si
+    l'état visible a changé."""
+    changed = False
+    with timed_lock():
+        t0 = time.perf_counter()
+        # projectiles
+        changed |= (_step_projs_np if isinstance(projs, ProjectileStore) else _step_projs_py)(t)
+        t0 = _lap("projectiles", t0)
+
+        # IA mobs
+        _lod["active"] = set()
+        changed |= (_step_mobs_np if SIM_NUMPY and np is not None else _step_mobs_py)(t)
+        t0 = _lap("mobs", t0)
+
+        # mobs éveillés hors d'aggro (une phase par pas), puis endormis / réveillés
+        changed |= _step_mobs_mid()
+        _lod["ticks"] += 1
+        if _lod["ticks"] >= LOD_EVERY:
+            _lod["ticks"] = 0
+            changed |= lod_pass()
+            drop_unshown_frozen()
+        t0 = _lap("lod", t0)
+
+        # respawn joueurs + regen
+        for ppid, p in players.items():
+            if p["dead"] and t >= p.get("respawn_at", 0):
+                p["dead"] = False
+                p["hp"] = p["max_hp"]; p["mp"] = p["max_mp"]
+                p["x"], p["y"] = random_free_pos(*region_spawn_center())  # dans la région du shard
+                player_grid.move(ppid, p["x"], p["y"])
+                changed = True
+            if not p["dead"] and (p["hp"] < p["max_hp"] or p["mp"] < p["max_mp"]):
+                p["hp"] = min(p["max_hp"], p["hp"] + 0.5)
+                p["mp"] = min(p["max_mp"], p["mp"] + 0.5)
+        t0 = _lap("regen", t0)
+
+        # respawn mobs si peu
+        if mob_count() < 5 and random.random() < 0.05:
+            spawn_mob(); changed = True
+        t0 = _lap("spawn_mobs", t0)
+        if random.random() < 0.002:
+            spawn_portal_to_dungeon(); changed = True
+        _lap("portails", t0)
+    return changed
+
+def logic_loop(stop=None):
+    with lock:
+        for _ in range(6): spawn_mob()
+    broadcast_state()
+    tick = 1.0 / TICK_HZ
+    # échéances absolues sur l'horloge monotone (celle de now()); l'horodatage d'un pas est son
+    # échéance (et non l'heure de son exécution) pour que les rattrapages gardent la cadence
+    deadline = time.monotonic() + tick
+    ghost_ticks = 0
+    changed = False
+    while stop is None or not stop.is_set():
+        # en attendant l'échéance: commandes des clients asyncio (simple sommeil en mode threads)
+        delay = deadline - time.monotonic()
+        while delay > 0:
+            if _commands_ready.wait(delay):
+                changed |= run_commands()
+            delay = deadline - time.monotonic()
+        t_tick = tick_prof_begin()
+        if command_queue:
+            # en retard, l'attente ci-dessus est sautée: les commandes passent quand même à chaque tour
+            t0 = time.perf_counter()
+            changed |= run_commands()
+            _lap("commandes", t0)
+        steps = 0
+        while steps < MAX_CATCHUP_STEPS:
+            woke = time.monotonic()
+            if woke < deadline:
+                break
+            if woke - deadline > tick * LATE_TOLERANCE:
+                tick_stats["late"] += 1
+            changed |= logic_step(deadline)
+            work = time.monotonic() - woke
+            tick_stats["ticks"] += 1
+            tick_stats["work_max"] = max(tick_stats["work_max"], work)
+            if work > tick: tick_stats["overruns"] += 1
+            deadline += tick; steps += 1
+        if steps > 1:
+            tick_stats["catchup"] += steps - 1
+        behind = time.monotonic() - deadline
+        if behind >= tick:
+            # trop en retard malgré le rattrapage: abandonner les pas restants et recaler
+            skipped = int(behind // tick)
+            tick_stats["dropped"] += skipped
+            deadline += skipped * tick
+        # tout ce que le tick envoie part en une écriture par client
+        with outbox_batch():
+            if sharded():
+                t0 = time.perf_counter()
+                with timed_lock():
+                    changed |= check_handoffs() > 0 or shard_stats["ghosts_changed"]
+                    shard_stats["ghosts_changed"] = False
+                    ghost_ticks += steps
+                    if ghost_ticks >= GHOST_EVERY_TICKS:
+                        ghost_ticks = 0
+                        send_ghosts()
+                _lap("shard", t0)
+            if changed and broadcast_state(tick=steps > 0):
+                changed = False  # sinon (cadence max atteinte): au tour suivant
+            # pousser l'anneau de chunks aux joueurs qui ont changé de chunk (déplacement, respawn, portail)
+            t0 = time.perf_counter()
+            stream_chunks_for_all()
+            _lap("chunks", t0)
+        if steps:
+            tick_prof_end(t_tick)
+        else:
+            _prof.cur = None
+
+def start_server(mode="threads"):
+    global _open_conns
     load_accounts()
     threading.Thread(target=saver_loop, daemon=True).start()
-    threading.Thread(target=logic_loop, daemon=True).start()
+    threading.Thread(target=logic_loop, name="logic", daemon=True).start()
+    threading.Thread(target=stats_loop, daemon=True).start()
+    threading.Thread(target=profiler_loop, name="profiler", daemon=True).start()
+    install_profile_signal()
+    if mode == "asyncio":
+        asyncio.run(serve_async())
+        return
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((HOST, PORT)); s.listen()
     print(f"[SERVEUR] en ligne sur {HOST}:{PORT}")
     while True:
         conn, addr = s.accept()  # pas de timeout client
-        threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
-
-if __name__ == "__main__":
-    start_server()
+        if _open_conns >= MAX_CONNECTIONS:
+            conn.close(); continue
+        with lock:
+            _open_conns += 1
+        threading.Thread(target=_handle_client_counted, args=(conn, addr), daemon=True).start()
 
+def _handle_client_counted(conn, addr):
+    global _open_conns
+    try:
+        handle_client(conn, addr)
+    finally:
+        with lock:
+            _open_conns -= 1
 
-def _cleanup_disconnect(authed_user, pid):
-    with lock:
-        if authed_user in active_usernames:
-            active_usernames.discard(authed_user)
-        if pid in clients:
-            try: clients[pid].close()
-            except: pass
-            clients.pop(pid, None)
-        if pid in players: players.pop(pid, None)
-        if pid in inventories: inventories.pop(pid, None)
-        if pid in cooldowns: cooldowns.pop(pid, None)
-        if pid in pid_identity: pid_identity.pop(pid, None)
\ No newline at end of file
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serveur MMO-lite")
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                    help="threads: un thread par connexion; asyncio: une seule boucle d'événements")
+    ap.add_argument("--max-conn", type=int, default=MAX_CONNECTIONS)
+    ap.add_argument("--stats-every", type=float, default=STATS_LOG_EVERY, help="s entre deux lignes [STATS] (0 = aucune)")
+    ap.add_argument("--shard", type=int, default=0, help="mode shardé (lancé par router.py): n° de ce worker")
+    ap.add_argument("--shards", type=int, default=1, help="nombre total de workers")
+    ap.add_argument("--shard-base-port", type=int, default=None, help="port du worker 0 (worker i: +i)")
+    args = ap.parse_args()
+    HOST, PORT, MAX_CONNECTIONS, STATS_LOG_EVERY = args.host, args.port, args.max_conn, args.stats_every
+    if args.shards > 1:
+        key = os.environ.get(SHARD_KEY_ENV)
+        if not key:
+            sys.exit(f"[ERREUR] mode shardé: clé de la partie absente (variable {SHARD_KEY_ENV}, posée par router.py)")
+        configure_shard(args.shard, args.shards, args.shard_base_port if args.shard_base_port is not None else args.port - args.shard, key)
+    start_server(args.mode)
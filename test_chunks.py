@@ -0,0 +1,37 @@
+# test_chunks.py
+# Parité du générateur vectorisé (NumPy) avec le générateur de référence pur Python.
+# Usage: python -m pytest -q test_chunks.py
+import random
+import pytest
+import server_game as S
+
+pytestmark = pytest.mark.skipif(S.np is None, reason="NumPy absent: seul le générateur pur Python existe")
+
+def _coords(n=60, seed=7):
+    # centre (routes), voisins négatifs, puis des chunks lointains au hasard
+    rnd = random.Random(seed)
+    fixed = [(0, 0), (1, -1), (-1, 1), (-2, 0), (0, -2), (-1, -1)]
+    return fixed + [(rnd.randint(-5000, 5000), rnd.randint(-5000, 5000)) for _ in range(n)]
+
+def _has_village(cx, cy):
+    # même tirage que les générateurs: 4096 valeurs de bruit, puis le test de village
+    r = S._rand_for(cx, cy)
+    for _ in range(S.CHUNK_TILES * S.CHUNK_TILES):
+        r.random()
+    return r.random() < 0.07
+
+@pytest.mark.parametrize("cx,cy", _coords())
+def test_generate_chunk_matches_reference(cx, cy):
+    assert S._chunk_bytes(S.generate_chunk(cx, cy)) == S._chunk_bytes(S._generate_chunk_py(cx, cy))
+
+def test_sample_has_villages():
+    # sans village dans l'échantillon, la suite du tirage (après le bruit) ne serait pas vérifiée
+    assert any(_has_village(cx, cy) for cx, cy in _coords())
+
+def test_blocking_mask_matches_tiles():
+    for cx, cy in _coords(10, seed=3):
+        buf = S._chunk_bytes(S.generate_chunk(cx, cy))
+        mask = S._blocking_mask(buf)
+        for ly in range(S.CHUNK_TILES):
+            for lx in range(S.CHUNK_TILES):
+                assert bool(mask[ly] >> lx & 1) == S.is_blocking_tile(buf[ly * S.CHUNK_TILES + lx])
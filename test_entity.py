@@ -0,0 +1,45 @@
+# test_entity.py
+# Entités à __slots__: accès dict limité aux champs déclarés, copie figée invalidée à l'écriture.
+# Usage: python -m pytest -q test_entity.py
+import pytest
+import server_game as S
+
+@pytest.mark.parametrize("key", ["to_dict", "_frozen", "keys", "FIELDS", "inconnu"])
+def test_only_declared_fields(key):
+    p = S.base_player("A", 1, 2)
+    assert key not in p and p.get(key, 7) == 7
+    with pytest.raises(KeyError):
+        p[key]
+    with pytest.raises(KeyError):
+        p[key] = 1
+
+def test_declared_but_unset_field():
+    m = S.Mob({"x": 1, "y": 2})
+    assert "hp" not in m and m.get("hp") is None and m.setdefault("hp", 5) == 5 and m["hp"] == 5
+    with pytest.raises(KeyError):
+        S.Mob()["x"]
+
+def test_frozen_reused_until_written():
+    p = S.base_player("A", 1, 2)
+    f = p.frozen()
+    assert p.frozen() is f
+    p["x"] = 3
+    assert p.frozen() is not f and p.frozen()["x"] == 3
+
+def test_nested_edit_then_touch():
+    p = S.base_player("A", 1, 2)
+    f = p.frozen()
+    p["equipment"]["weapon"] = {"name": "Dague", "type": "weapon", "power": 6}
+    assert p.frozen() is f and f["equipment"]["weapon"] is None  # copie figée: pas d'alias
+    p.touch()
+    assert p.frozen()["equipment"]["weapon"]["power"] == 6
+
+def test_frozen_dropped_once_out_of_view(monkeypatch):
+    monkeypatch.setattr(S, "npcs", {1: S.Mob({"x": 1, "y": 2}), 2: S.Mob({"x": 3, "y": 4})})
+    monkeypatch.setattr(S, "snapshot_seq", S.snapshot_seq + S.ID_STEP)
+    seen, gone = S._freeze_entity(S.npcs[1]), S._freeze_entity(S.npcs[2])
+    S.snapshot_seq += S.ID_STEP
+    assert S._freeze_entity(S.npcs[1]) is seen  # toujours en vue: forme partagée
+    S.drop_unshown_frozen()
+    assert S.npcs[1]._frozen is seen and S.npcs[2]._frozen is None
+    assert S.npcs[2].frozen() is not gone and S.npcs[2].frozen() == gone
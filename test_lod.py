@@ -0,0 +1,57 @@
+# test_lod.py
+# Paliers de simulation des mobs: poursuite à chaque pas près d'un joueur, errance un pas sur
+# LOD_MID_EVERY plus loin, sommeil hors des chunks surveillés. Usage: python -m pytest -q test_lod.py
+import math, random
+import pytest
+import server_game as S
+
+T0 = 1_000_000.0
+
+def _clear():
+    for store, grid in ((S.players, S.player_grid), (S.npcs, S.npc_grid), (S.items, S.item_grid)):
+        store.clear(); grid.clear()
+    S.dormant.clear(); S.lod_stats["asleep"] = 0
+    S._lod.update(ticks=0, step=0, mid=[[] for _ in range(S.LOD_MID_EVERY)], active=set())
+
+@pytest.fixture
+def world(monkeypatch):
+    _clear()
+    monkeypatch.setattr(S, "spawn_portal_to_dungeon", lambda: None)
+    random.seed(4)
+    x, y = S.random_free_pos(0, 0, 4)
+    p = S.players[1] = S.base_player("P", x, y); S.player_grid.insert(1, x, y)
+    yield p
+    _clear()
+
+def _mob_near(p, dist):
+    for a in range(0, 360, 10):
+        x = p["x"] + dist * math.cos(math.radians(a)); y = p["y"] + dist * math.sin(math.radians(a))
+        if not S.is_colliding_rect(x, y, S.NPC_SIZE * 3, S.NPC_SIZE * 3):  # de la place pour errer
+            return S.spawn_mob_at(x, y)
+    pytest.skip("pas de case libre autour du joueur")
+
+def test_mid_band_mob_moves_every_n_steps(world, monkeypatch):
+    nid = _mob_near(world, 400)
+    far = S.spawn_mob_at(*S.random_free_pos(world["x"] + 10 ** 6, world["y"], 4))
+    start = (S.npcs[nid]["x"], S.npcs[nid]["y"])
+    calls = []
+    wander = S._wander
+    monkeypatch.setattr(S, "_wander", lambda i, n, k: calls.append((S._lod["step"], i, k)) or wander(i, n, k))
+    S.lod_pass()
+    steps = 20 * S.LOD_MID_EVERY
+    for i in range(steps):
+        S.logic_step(T0 + i / S.TICK_HZ)
+    mine = [c for c in calls if c[1] == nid]
+    assert len(mine) == steps // S.LOD_MID_EVERY
+    assert all(k == S.LOD_MID_EVERY and (st + nid) % S.LOD_MID_EVERY == 0 for st, _, k in mine)
+    assert (S.npcs[nid]["x"], S.npcs[nid]["y"]) != start
+    assert far not in S.npcs and all(c[1] != far for c in calls)  # endormi: ni IA ni errance
+
+def test_active_mob_does_not_wander(world, monkeypatch):
+    nid = _mob_near(world, 100)
+    calls = []
+    monkeypatch.setattr(S, "_wander", lambda i, n, k: calls.append(i) or False)
+    S.lod_pass()
+    for i in range(3 * S.LOD_MID_EVERY):
+        S.logic_step(T0 + i / S.TICK_HZ)
+    assert nid not in calls
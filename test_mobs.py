@@ -0,0 +1,46 @@
+# test_mobs.py
+# Pas des mobs en calcul matriciel (SIM_NUMPY) face au parcours d'origine mob par mob: mêmes
+# snapshots, y compris quand un joueur meurt en cours de pas. Usage: python -m pytest -q test_mobs.py
+import json, random
+import pytest
+import server_game as S
+import wire
+
+pytestmark = pytest.mark.skipif(S.np is None, reason="NumPy absent: seul le mode dicts existe")
+
+T0 = 1_000_000.0
+
+def _run(monkeypatch, numpy_mode, hp):
+    for store, grid in ((S.players, S.player_grid), (S.npcs, S.npc_grid), (S.items, S.item_grid)):
+        store.clear(); grid.clear()
+    S.dormant.clear(); S.lod_stats["asleep"] = 0
+    S._lod.update(ticks=0, step=0, mid=[[] for _ in range(S.LOD_MID_EVERY)], active=set())
+    S.next_npc_id = 1
+    monkeypatch.setattr(S, "SIM_NUMPY", numpy_mode)
+    monkeypatch.setattr(S, "projs", S.ProjectileStore() if numpy_mode else {})
+    monkeypatch.setattr(S, "proj_grid", S.projs if numpy_mode else S.SpatialHash(S.projs))
+    monkeypatch.setattr(S, "spawn_portal_to_dungeon", lambda: None)
+    random.seed(5)
+    for pid in (1, 2):
+        x, y = S.random_free_pos(40 * pid, 0, 4)
+        p = S.players[pid] = S.base_player(f"P{pid}", x, y); S.player_grid.insert(pid, x, y)
+    S.players[1]["hp"] = hp
+    for _ in range(12):
+        S.spawn_mob_at(*S.random_free_pos(S.players[1]["x"], S.players[1]["y"], 1))
+    random.seed(6)
+    out = []
+    for i in range(20):
+        S.logic_step(T0 + i / S.TICK_HZ)
+        out.append(json.dumps([S.players, S.npcs], sort_keys=True, default=wire.json_default))
+    return out
+
+@pytest.mark.parametrize("hp", [10 ** 6, 8])
+def test_numpy_step_matches_dict_step(monkeypatch, hp):
+    seq = []
+    apply_seq = S._apply_mobs_seq
+    monkeypatch.setattr(S, "_apply_mobs_seq", lambda *a: seq.append(1) or apply_seq(*a))
+    ref = _run(monkeypatch, False, hp)
+    assert _run(monkeypatch, True, hp) == ref
+    assert bool(seq) == (hp < 100)  # mort possible: effets appliqués mob par mob
+    if hp < 100:
+        assert '"dead": true' in ref[-1]
@@ -0,0 +1,170 @@
+# test_shard.py
+# Messages de contrôle entre shards: acceptés avec la clé de la partie, ignorés sans elle, même
+# depuis la boucle locale; réapparition dans sa région; rejeu des trames par le routeur après un
+# passage; passage de frontière de bout en bout (router.py + 2 workers sur la boucle locale).
+# Usage: python -m pytest -q test_shard.py
+import asyncio, os, signal, socket, subprocess, sys, time
+from collections import deque
+import pytest
+import server_game as S
+import router
+import wire
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+KEY = "0123456789abcdef0123456789abcdef"
+LOCAL = ("127.0.0.1", 40000)
+
+@pytest.fixture
+def shard1(monkeypatch):
+    for name in ("SHARD_ID", "SHARD_COUNT", "SHARD_BASE_PORT", "SHARD_KEY", "ID_STEP", "next_id", "next_npc_id",
+                 "next_item_id", "next_proj_id", "snapshot_seq"):
+        monkeypatch.setattr(S, name, getattr(S, name))
+    monkeypatch.setattr(S, "ghosts", {})
+    monkeypatch.setattr(S, "shard_stats", dict(S.shard_stats, rejected=0))
+    S.configure_shard(1, 2, 5600, KEY)
+
+def _ghosts(key, addr=LOCAL):
+    msg = {"type": "shard_ghosts", "from": 0, "players": {}, "npcs": {"2": {"x": 1, "y": 2}}, "items": {}}
+    if key is not None:
+        msg["key"] = key
+    S.handle_shard_message({"addr": addr}, msg)
+
+def test_accepted_with_key(shard1):
+    _ghosts(KEY)
+    assert S.ghosts[0]["npcs"] == {2: {"x": 1, "y": 2}}
+
+@pytest.mark.parametrize("key", [None, "", KEY[:-1] + "0", 12, "clé"])
+def test_rejected_without_key(shard1, key):
+    _ghosts(key)
+    assert S.ghosts == {} and S.shard_stats["rejected"] == 1
+
+def test_rejected_from_outside(shard1):
+    _ghosts(KEY, ("10.0.0.2", 40000))
+    assert S.ghosts == {}
+
+def test_unsharded_ignores_everything(monkeypatch):
+    monkeypatch.setattr(S, "ghosts", {})
+    monkeypatch.setattr(S, "shard_stats", dict(S.shard_stats))
+    _ghosts(KEY)
+    assert S.ghosts == {}
+
+def test_respawn_stays_in_region(shard1, monkeypatch):
+    for store, grid in (("players", "player_grid"), ("npcs", "npc_grid")):
+        monkeypatch.setattr(S, store, {}); monkeypatch.setattr(S, grid, S.SpatialHash(getattr(S, store)))
+    monkeypatch.setattr(S, "spawn_portal_to_dungeon", lambda: None)
+    cx, cy = S.region_spawn_center()
+    for pid in range(1, 21):
+        p = S.players[pid] = S.base_player(f"P{pid}", cx, cy); S.player_grid.insert(pid, cx, cy)
+        p["dead"] = True; p["respawn_at"] = 0.0
+    S.logic_step(1.0)
+    assert all(not p["dead"] and S.owns_x(p["x"]) for p in S.players.values())
+
+def test_router_replays_frames_after_handoff(monkeypatch):
+    # le shard 0 a appliqué 2 des 5 trames envoyées: les 3 suivantes partent au shard 1 après l'attache
+    frames = [wire.encode({"type": "move", "dx": i, "dy": 0}, wire.PROTO_BIN) for i in range(5)]
+    monkeypatch.setattr(router, "SHARD_KEY", KEY)
+    monkeypatch.setattr(router, "stats", dict(router.stats))
+    async def run():
+        got = []; done = asyncio.Event()
+        async def worker(r, w):
+            while (m := await wire.read_msg_async(r)) is not None:
+                got.append(m)
+            done.set()
+        server = await asyncio.start_server(worker, "127.0.0.1", 0)
+        monkeypatch.setattr(router, "BASE_PORT", server.sockets[0].getsockname()[1] - 1)
+        relay = router.Relay(None, None)
+        relay.up_w = type("Old", (), {"close": lambda self: None})()
+        relay.sent = deque(frames, maxlen=router.REPLAY_MAX); relay.sent_n = 5
+        assert await relay._handoff({"type": "shard_handoff", "to": 1, "state": {"pid": 3}, "seen": 2})
+        relay.up_w.close(); await asyncio.wait_for(done.wait(), 5)
+        server.close()
+        return got, relay
+    got, relay = asyncio.run(run())
+    assert got[0] == {"type": "shard_attach", "state": {"pid": 3}, "key": KEY}
+    assert got[1:] == [wire.decode_frame(f[4:]) for f in frames[2:]]
+    assert relay.sent_n == 3 and router.stats["replayed"] == 3 and router.stats["replay_lost"] == 0
+
+# ----- De bout en bout: routeur + 2 workers sur la boucle locale -----
+def _free_ports(n):
+    socks = [socket.socket() for _ in range(n)]
+    for s in socks: s.bind(("127.0.0.1", 0))
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks: s.close()
+    return ports
+
+def _connect(port, timeout=15.0):
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port), timeout=5.0)
+        except OSError:
+            if time.monotonic() > end: raise
+            time.sleep(0.2)
+
+class _Client:
+    def __init__(self, port):
+        self.sock = _connect(port); self.f = self.sock.makefile("rb")
+        self.pid = None; self.me = {}
+
+    def send(self, obj): self.sock.sendall(wire.encode(obj, wire.PROTO_JSON))
+
+    def wait(self, pred, timeout=10.0):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            m = wire.read_msg(self.f)
+            assert m is not None, "connexion fermée"
+            if m.get("type") == "welcome":
+                self.pid = str(m["your_id"]); self.me = dict(m["you"]); self.welcome = dict(m["you"])
+            elif m.get("type") == "state" and self.pid in m.get("players", {}):
+                self.me.update(m["players"][self.pid])
+            if pred(m):
+                return m
+        raise AssertionError("délai dépassé")
+
+def _free_run(x, y, n):
+    # x, x+1, ..., x+n libres sur la ligne y (pas de mur sur le chemin des petits pas)
+    return all(not S.is_colliding_rect(x + i, y, S.PLAYER_SIZE, S.PLAYER_SIZE) for i in range(n + 1))
+
+STEPS = 40
+
+def test_handoff_end_to_end(tmp_path):
+    port, base = _free_ports(2)
+    with socket.socket() as s:  # le worker 1 écoute sur base + 1
+        try: s.bind(("127.0.0.1", base + 1))
+        except OSError: pytest.skip("ports voisins occupés")
+    if base + 1 == port: pytest.skip("ports voisins occupés")
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "router.py"), "--shards", "2", "--port", str(port),
+                             "--base-port", str(base)], cwd=tmp_path, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+                            env={k: v for k, v in os.environ.items() if k != "MMO_SHARD_KEY"},
+                            start_new_session=True)  # routeur et workers: un groupe, arrêté d'un coup
+    try:
+        c = _Client(port)
+        c.send({"type": "register", "username": "passeur", "password": "x"})
+        c.wait(lambda m: m.get("type") == "login_ok")
+        c.send({"type": "create_character", "name": "Passeur", "class": "Guerrier"})
+        c.wait(lambda m: m.get("type") == "characters")
+        c.send({"type": "enter_world", "char_id": "1"})
+        c.wait(lambda m: m.get("type") == "welcome")
+        c.send({"type": "request_inventory"})
+        inv = c.wait(lambda m: m.get("type") == "inventory")["inventory"]
+        x, y = c.me["x"], c.me["y"]
+        assert int(x // S.STRIP_PX) % 2 == 0
+        # un grand pas jusque dans la bande du shard 1, puis des petits pas envoyés pendant le passage
+        tx = S.STRIP_PX + S.HANDOFF_MARGIN + 40
+        while not _free_run(tx, y, STEPS): tx += S.TILE
+        c.send({"type": "move", "dx": tx - x, "dy": 0})
+        for _ in range(STEPS):  # étalés sur plus d'un tick: certains arrivent pendant le passage
+            c.send({"type": "move", "dx": 1, "dy": 0}); time.sleep(0.002)
+        c.wait(lambda m: m.get("type") == "state" and m.get("full") and c.me.get("x", 0) >= tx)  # attache
+        c.wait(lambda m: c.me.get("x") == tx + STEPS)  # aucun petit pas perdu pendant le passage
+        # état conservé chez le shard 1, qui répond maintenant au client
+        assert int(c.me["x"] // S.STRIP_PX) % 2 == 1
+        for k in ("name", "class", "level", "xp", "gold", "max_hp", "stats", "equipment"):
+            assert c.me[k] == c.welcome[k], k
+        c.send({"type": "request_inventory"})
+        assert c.wait(lambda m: m.get("type") == "inventory")["inventory"] == inv
+        c.send({"type": "move", "dx": -1, "dy": 0})
+        c.wait(lambda m: m.get("type") == "state" and c.me.get("x") == tx + STEPS - 1)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM); proc.wait(10)
@@ -0,0 +1,24 @@
+# test_tick.py
+# Cadence de logic_loop: un état diffusé par pas quand le monde change, soit ~TICK_HZ par seconde.
+# Usage: python -m pytest -q test_tick.py
+import threading, time
+import server_game as S
+
+def test_one_broadcast_per_tick(monkeypatch):
+    sent = []
+    real = S.broadcast_state
+    def counted(*a, **kw):
+        ok = real(*a, **kw)
+        if ok: sent.append(time.monotonic())
+        return ok
+    monkeypatch.setattr(S, "broadcast_state", counted)
+    monkeypatch.setattr(S, "logic_step", lambda t: True)  # chaque pas change l'état visible
+    stop = threading.Event()
+    th = threading.Thread(target=S.logic_loop, args=(stop,), daemon=True)
+    th.start()
+    time.sleep(0.2)
+    n0 = len(sent); time.sleep(2.0); n = len(sent) - n0
+    stop.set(); th.join(2.0)
+    assert not th.is_alive()
+    assert n >= 2.0 * S.TICK_HZ * 0.85, n
+    assert n <= 2.0 * S.TICK_HZ * 1.1, n
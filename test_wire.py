@@ -0,0 +1,161 @@
+# test_wire.py
+# Aller-retour de chaque message du protocole dans les deux formats (json, bin1), relais brut
+# (router.py) et entités figées. Usage: python -m pytest -q test_wire.py
+# `python test_wire.py` affiche en plus la taille de chaque cas dans les deux formats.
+import io, json, asyncio, base64
+import pytest
+import wire
+
+RLE = base64.b64encode(bytes([255, 0, 255, 0, 2, 3])).decode("ascii")
+PLAYER = {"name": "Héros", "x": 1624, "y": -2020.5, "hp": 89.5, "max_hp": 100, "mp": 60, "max_mp": 60,
+          "dead": False, "respawn_at": 0.0, "level": 2, "xp": 10, "next_xp": 150, "gold": 3,
+          "weapon_bonus": 0, "weapon_name": None, "class": "Mage", "race": "Humain",
+          "stats": {"str": 5, "int": 5, "agi": 5, "sta": 5}, "stat_points": 0,
+          "equipment": {"head": None, "weapon": {"id": 7, "name": "Dague", "type": "weapon", "power": 6}},
+          "_gear_bonus_stats": {"str": 5, "int": 11, "agi": 5, "sta": 5}}
+NPC = {"x": 12.25, "y": -40.0, "dx": 0, "dy": 0, "last_hit_by": None, "name": "Loup", "hp": 50,
+       "max_hp": 50, "hostile": True, "speed": 2.3, "dmg": 8, "atk_until": 0}
+ITEM = {"x": 10, "y": 20, "name": "Portail instable", "type": "portal", "power": 0, "dest_x": 5, "dest_y": 6}
+PROJ = {"x": 100.5, "y": 7.0, "vx": 6.123, "vy": -0.5, "dmg": 26, "owner": 1, "expire_at": 1.7e9}
+INVENTORY = [{"id": 1, "name": "Petite potion", "type": "potion", "power": 30}]
+KEY = "0123456789abcdef0123456789abcdef"  # clé de la partie (router.py, MMO_SHARD_KEY)
+HANDOFF_STATE = {"pid": 3, "player": PLAYER, "inventory": INVENTORY, "cooldowns": {"spells": {"1": 1.7e9}},
+                 "identity": {"username": "a", "char_id": "1"}, "proto": wire.PROTO_BIN}
+
+# (cas, message): un cas par disposition, les replis JSON de bin1 compris
+CASES = [
+    # client -> serveur
+    ("login", {"type": "login", "username": "a", "password": "b", "proto": wire.PROTO_BIN}),
+    ("register", {"type": "register", "username": "a", "password": "b", "proto": wire.PROTO_JSON}),
+    ("request_characters", {"type": "request_characters"}),
+    ("create_character", {"type": "create_character", "name": "Zoé", "class": "Voleur"}),
+    ("enter_world", {"type": "enter_world", "char_id": "1"}),
+    ("move", {"type": "move", "dx": -4, "dy": 4}),
+    ("move_hors_int16", {"type": "move", "dx": 100000, "dy": 0}),   # repli JSON
+    ("pickup", {"type": "pickup"}),
+    ("use_item", {"type": "use_item", "id": 1000003}),
+    ("drop", {"type": "drop", "id": 1000003, "dx": 0, "dy": 24}),
+    ("cast", {"type": "cast", "slot": 2, "tx": 1234.5, "ty": -99.0}),
+    ("equip_item", {"type": "equip_item", "id": 7, "slot": "weapon"}),
+    ("unequip_slot", {"type": "unequip_slot", "slot": "weapon"}),
+    ("chat_client", {"type": "chat", "msg": "salut"}),
+    ("request_inventory", {"type": "request_inventory"}),
+    ("get_chunks", {"type": "get_chunks", "chunks": [[0, 0], [-1, 2]]}),
+    ("allocate_stat", {"type": "allocate_stat", "stat": "str"}),
+    ("ack", {"type": "ack", "seq": 42}),
+    ("resync", {"type": "resync"}),
+    # serveur -> client
+    ("login_ok", {"type": "login_ok", "characters": [{"id": "1", "name": "A", "class": "Mage", "level": 1}],
+                  "proto": wire.PROTO_BIN}),
+    ("login_error", {"type": "login_error", "msg": "Identifiants invalides."}),
+    ("characters", {"type": "characters", "characters": []}),
+    ("create_error", {"type": "create_error", "msg": "Session invalide."}),
+    ("enter_error", {"type": "enter_error", "msg": "Personnage introuvable."}),
+    ("error", {"type": "error", "msg": "Action non valide avant l'entrée en jeu."}),
+    ("welcome", {"type": "welcome", "your_id": 1, "tile": 40, "grid_w": 800, "grid_h": 800, "map": [],
+                 "inventory": [], "you": PLAYER, "spells": {"1": {"name": "Boule de feu"}}}),
+    ("state_complet", {"type": "state", "seq": 7, "full": True, "players": {"1": PLAYER}, "npcs": {"3": NPC},
+                       "items": {"4": ITEM}, "projs": {"5": PROJ}}),
+    ("state_delta", {"type": "state", "seq": 8, "base": 7, "players": {"1": {"x": 1628}}, "npcs": {},
+                     "items": {}, "projs": {"6": PROJ}, "removed": {"npcs": ["3"], "projs": ["5"]}}),
+    ("aoi", {"type": "aoi", "enter": {"npcs": ["9"]}, "leave": {"players": ["2"]}}),
+    ("chunks", {"type": "chunks", "list": [{"cx": 0, "cy": -3, "enc": "rle", "data": RLE}]}),
+    ("inventory", {"type": "inventory", "inventory": INVENTORY}),
+    ("chat", {"type": "chat", "from": "SYSTEM", "msg": "A a rejoint la partie."}),
+    ("fx", {"type": "fx", "fx": "cast", "slot": 1, "x": 1624, "y": -2020, "tx": 0.5, "ty": 3.0, "duration": 0.25}),
+    # entre shards et routeur (JSON, encapsulé en bin1 côté clients)
+    ("shard_handoff", {"type": "shard_handoff", "to": 1, "state": HANDOFF_STATE, "seen": 12}),
+    ("shard_attach", {"type": "shard_attach", "state": HANDOFF_STATE, "key": KEY}),
+    ("shard_persist", {"type": "shard_persist", "username": "a", "char_id": "1", "player": PLAYER,
+                       "inventory": INVENTORY, "logout": True, "key": KEY}),
+    ("shard_ghosts", {"type": "shard_ghosts", "from": 1, "players": {"3": PLAYER}, "npcs": {"8": NPC}, "items": {},
+                      "key": KEY}),
+]
+MSGS = [m for _, m in CASES]
+CONTROL = b'{"type": "shard_'  # préfixe filtré par router.py
+
+def _close(a, b):
+    # tolérance: quantification des coordonnées (1/COORD_Q px) et float32 des champs "f"
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_close(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_close(x, y) for x, y in zip(a, b))
+    if wire._is_num(a) and wire._is_num(b):
+        return abs(a - b) <= max(1.0 / wire.COORD_Q, 1e-6 * abs(a))
+    return a == b
+
+async def _raw_frames(data):
+    r = asyncio.StreamReader(); r.feed_data(data); r.feed_eof()
+    out = []
+    while (f := await wire.read_raw_async(r)) is not None:
+        out.append(f)
+    return out
+
+@pytest.mark.parametrize("proto", wire.PROTOS)
+@pytest.mark.parametrize("case,msg", CASES, ids=[c for c, _ in CASES])
+def test_round_trip(case, msg, proto):
+    got = wire.read_msg(io.BytesIO(wire.encode(msg, proto)))
+    assert _close(msg, got)
+
+@pytest.mark.parametrize("proto", wire.PROTOS)
+def test_stream_of_all_messages(proto):
+    stream = io.BytesIO(b"".join(wire.encode(m, proto) for m in MSGS))
+    for m in MSGS:
+        assert _close(m, wire.read_msg(stream))
+    assert wire.read_msg(stream) is None
+
+@pytest.mark.parametrize("proto", wire.PROTOS)
+def test_raw_relay_is_byte_exact(proto):
+    frames = [wire.encode(m, proto) for m in MSGS]
+    assert asyncio.run(_raw_frames(b"".join(frames))) == frames
+
+@pytest.mark.parametrize("proto", wire.PROTOS)
+def test_raw_json_prefix(proto):
+    assert wire.raw_json(wire.encode(MSGS[0], proto), b'{"type": "login"') == MSGS[0]
+    assert wire.raw_json(wire.encode(MSGS[0], proto), CONTROL) is None
+    # les messages de contrôle des shards restent repérables sans décodage complet
+    for case, m in CASES:
+        if case.startswith("shard_"):
+            assert _close(m, wire.raw_json(wire.encode(m, proto), CONTROL)), case
+
+def test_hot_messages_are_binary():
+    for case in ("move", "cast", "fx", "ack", "chunks", "state_complet", "state_delta"):
+        assert wire.encode(dict(CASES)[case], wire.PROTO_BIN)[4] != wire.M_JSON, case
+    assert wire.encode(dict(CASES)["move_hors_int16"], wire.PROTO_BIN)[4] == wire.M_JSON
+
+@pytest.mark.parametrize("proto", wire.PROTOS)
+def test_frozen_entities_encode_like_dicts(proto):
+    st = dict(CASES)["state_complet"]
+    frozen = {**st, **{kind: {k: wire.FrozenEntity(e) for k, e in st[kind].items()} for kind in wire.STATE_KINDS}}
+    # avant et après mise en cache des fragments
+    assert wire.encode(frozen, proto) == wire.encode(st, proto) == wire.encode(frozen, proto)
+
+# trames bin1 mal formées: code inconnu, charges tronquées (la longueur de trame reste juste)
+BAD_FRAMES = [("code_inconnu", bytes((200,)) + b"xyz"), ("move_tronque", bytes((wire.M_MOVE,)) + b"\x01"),
+              ("state_tronque", bytes((wire.M_STATE,)) + wire.encode(dict(CASES)["state_complet"], wire.PROTO_BIN)[5:40]),
+              ("json_invalide", bytes((wire.M_JSON,)) + b"{pas du json")]
+
+@pytest.mark.parametrize("case,body", BAD_FRAMES, ids=[c for c, _ in BAD_FRAMES])
+def test_bad_frame_raises_value_error(case, body):
+    with pytest.raises(ValueError):
+        wire.decode_frame(body)
+
+@pytest.mark.parametrize("case,body", BAD_FRAMES, ids=[c for c, _ in BAD_FRAMES])
+def test_bad_frame_is_skipped(case, body):
+    ok = wire.encode(dict(CASES)["move"], wire.PROTO_BIN)
+    data = wire._FRAME.pack(len(body)) + body + ok
+    assert wire.read_msg(io.BytesIO(data)) == dict(CASES)["move"]
+    async def read():
+        r = asyncio.StreamReader(); r.feed_data(data); r.feed_eof()
+        return await wire.read_msg_async(r)
+    assert asyncio.run(read()) == dict(CASES)["move"]
+
+def test_dumps_matches_json():
+    assert all(wire._dumps(m) == json.dumps(m) for m in MSGS)
+
+def sizes():
+    return {case: (len(wire.encode(m, wire.PROTO_JSON)), len(wire.encode(m, wire.PROTO_BIN))) for case, m in CASES}
+
+if __name__ == "__main__":
+    for case, (j, b) in sizes().items():
+        print(f"{case:18s} json={j:5d} o  bin1={b:5d} o")
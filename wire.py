@@ -0,0 +1,349 @@
+# wire.py
+# Protocole réseau partagé par client.py et server_game.py.
+#  - "json": une ligne JSON par message (format historique, lisible pour déboguer)
+#  - "bin1": trames [u32 longueur big-endian][u8 code][charge utile]. Les messages chauds
+#    (state, move, cast, fx, chunks, ack) ont une disposition struct fixe et des coordonnées
+#    quantifiées; tous les autres voyagent en JSON encapsulé (code 0).
+# Le lecteur accepte les deux formats à tout moment: une trame binaire commence par un
+# octet de poids fort nul (trames < 16 Mo) alors qu'une ligne JSON commence par "{".
+import json, struct, base64
+
+PROTO_JSON = "json"
+PROTO_BIN = "bin1"
+PROTOS = (PROTO_JSON, PROTO_BIN)
+
+MAX_FRAME = 1 << 24
+COORD_Q = 2               # coordonnées au demi-pixel dans un int32 (±1.07e9 px)
+_I32 = 1 << 31
+
+M_JSON, M_MOVE, M_CAST, M_FX, M_CHUNKS, M_STATE, M_ACK = range(7)
+
+_FRAME = struct.Struct(">I")
+_MOVE = struct.Struct("<hh")
+_CAST = struct.Struct("<Bii")
+_FX = struct.Struct("<Biiiii")         # slot, x, y, tx, ty, durée (ms)
+_ACK = struct.Struct("<I")
+_U16 = struct.Struct("<H")
+_CHUNK_HDR = struct.Struct("<iiH")     # cx, cy, longueur RLE
+_STATE_HDR = struct.Struct("<IIB")     # seq, base (NO_BASE si absent), drapeaux
+_ENT_HDR = struct.Struct("<IH")        # id, masque des champs présents
+_IDS = struct.Struct("<I")
+NO_BASE = 0xFFFFFFFF
+F_FULL = 1
+REST_BIT = 1 << 15                     # champs restants en JSON
+
+# Champs chauds par type d'entité: (nom, format) avec "c" = coordonnée quantifiée
+STATE_KINDS = ("players", "npcs", "items", "projs")
+ENTITY_FIELDS = {
+    "players": (("x", "c"), ("y", "c"), ("hp", "f"), ("mp", "f"), ("dead", "?")),
+    "npcs":    (("x", "c"), ("y", "c"), ("hp", "f")),
+    "items":   (("x", "c"), ("y", "c")),
+    "projs":   (("x", "c"), ("y", "c"), ("vx", "f"), ("vy", "f")),
+}
+_FIELD_STRUCT = {"c": struct.Struct("<i"), "f": struct.Struct("<f"), "?": struct.Struct("<?")}
+
+def _q(v):
+    q = int(round(v * COORD_Q))
+    if not -_I32 <= q < _I32:
+        raise OverflowError(v)
+    return q
+
+def _dq(q):
+    # les coordonnées entières reviennent en int (comme en JSON)
+    return q // COORD_Q if q % COORD_Q == 0 else q / COORD_Q
+
+def _num(v):
+    return int(v) if float(v).is_integer() else v
+
+def _is_num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def _fits(fmt, v):
+    if fmt == "?":
+        return isinstance(v, bool)
+    if not _is_num(v):
+        return False
+    if fmt == "c":
+        return -_I32 <= v * COORD_Q < _I32
+    return True
+
+# ---------- Encodeurs des messages chauds (None = pas de disposition fixe -> JSON) ----------
+def _enc_move(o):
+    dx, dy = o.get("dx", 0), o.get("dy", 0)
+    if set(o) - {"type", "dx", "dy"} or not (isinstance(dx, int) and isinstance(dy, int)):
+        return None
+    if not (-32768 <= dx < 32768 and -32768 <= dy < 32768):
+        return None
+    return _MOVE.pack(dx, dy)
+
+def _enc_cast(o):
+    if set(o) - {"type", "slot", "tx", "ty"}:
+        return None
+    return _CAST.pack(int(o.get("slot", 0)), _q(float(o.get("tx", 0))), _q(float(o.get("ty", 0))))
+
+def _enc_fx(o):
+    if o.get("fx") != "cast" or set(o) - {"type", "fx", "slot", "x", "y", "tx", "ty", "duration"}:
+        return None
+    return _FX.pack(int(o.get("slot", 0)), _q(o["x"]), _q(o["y"]), _q(o["tx"]), _q(o["ty"]),
+                    int(round(float(o.get("duration", 0.2)) * 1000)))
+
+def _enc_ack(o):
+    if set(o) - {"type", "seq"}:
+        return None
+    return _ACK.pack(int(o["seq"]))
+
+def _enc_chunks(o):
+    if set(o) - {"type", "list"}:
+        return None
+    out = [_U16.pack(len(o["list"]))]
+    for e in o["list"]:
+        if e.get("enc") != "rle" or set(e) - {"cx", "cy", "enc", "data"}:
+            return None
+        raw = base64.b64decode(e["data"])
+        out.append(_CHUNK_HDR.pack(e["cx"], e["cy"], len(raw))); out.append(raw)
+    return b"".join(out)
+
+# ---------- Entités figées ----------
+class FrozenEntity(dict):
+    """Entité figée par le serveur, partagée telle quelle par les snapshots de tous les clients
+    et jamais modifiée: ses fragments JSON et bin1 ne sont calculés qu'une fois."""
+    __slots__ = ("_json", "_bin")
+
+    def __init__(self, *a):
+        dict.__init__(self, *a)
+        self._json = self._bin = None
+
+def json_default(o):
+    # entités du serveur (classes à __slots__) -> dict, pour json.dumps(default=...)
+    to_dict = getattr(o, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"{type(o).__name__} non sérialisable en JSON")
+    return to_dict()
+
+def _ent_json(e):
+    if type(e) is not FrozenEntity:
+        return json.dumps(e, default=json_default)
+    if e._json is None:
+        e._json = json.dumps(e)
+    return e._json
+
+def _state_json(o):
+    # même texte que json.dumps(o), les entités figées étant recopiées depuis leur cache
+    out = []
+    for k, v in o.items():
+        if k in STATE_KINDS:
+            v = "{" + ", ".join(f"{json.dumps(str(i))}: {_ent_json(e)}" for i, e in v.items()) + "}"
+        else:
+            v = json.dumps(v, default=json_default)
+        out.append(f"{json.dumps(k)}: {v}")
+    return "{" + ", ".join(out) + "}"
+
+def _dumps(obj):
+    if obj.get("type") == "state":
+        return _state_json(obj)
+    return json.dumps(obj, default=json_default)
+
+def _enc_entity(kind, k, e):
+    body = e._bin if type(e) is FrozenEntity else None
+    if body is None:
+        body = _enc_entity_body(kind, e)
+        if type(e) is FrozenEntity:
+            e._bin = body
+    return _IDS.pack(int(k)) + body
+
+def _enc_entity_body(kind, e):
+    # [u16 masque][champs chauds][JSON du reste]: _ENT_HDR sans l'id
+    mask = 0; parts = []
+    rest = dict(e)
+    for i, (name, fmt) in enumerate(ENTITY_FIELDS[kind]):
+        if name in e and _fits(fmt, e[name]):
+            v = rest.pop(name)
+            mask |= 1 << i
+            parts.append(_FIELD_STRUCT[fmt].pack(_q(v) if fmt == "c" else v))
+    if rest:
+        mask |= REST_BIT
+        js = json.dumps(rest, ensure_ascii=False).encode("utf-8")
+        parts.append(_U16.pack(len(js))); parts.append(js)
+    return _U16.pack(mask) + b"".join(parts)
+
+def _enc_state(o):
+    if set(o) - {"type", "seq", "base", "full", "removed", *STATE_KINDS} or o.get("seq") is None:
+        return None
+    full = bool(o.get("full"))
+    base = o.get("base")
+    out = [_STATE_HDR.pack(o["seq"], NO_BASE if base is None else base, F_FULL if full else 0)]
+    for kind in STATE_KINDS:
+        ents = o.get(kind, {})
+        out.append(_U16.pack(len(ents)))
+        for k, e in ents.items():
+            out.append(_enc_entity(kind, k, e))
+    removed = o.get("removed", {})
+    for kind in STATE_KINDS:
+        ids = removed.get(kind, [])
+        out.append(_U16.pack(len(ids)))
+        out.extend(_IDS.pack(int(k)) for k in ids)
+    return b"".join(out)
+
+_ENCODERS = {"move": (M_MOVE, _enc_move), "cast": (M_CAST, _enc_cast), "fx": (M_FX, _enc_fx),
+             "ack": (M_ACK, _enc_ack), "chunks": (M_CHUNKS, _enc_chunks), "state": (M_STATE, _enc_state)}
+
+# ---------- Décodeurs ----------
+def _dec_move(b):
+    dx, dy = _MOVE.unpack(b)
+    return {"type": "move", "dx": dx, "dy": dy}
+
+def _dec_cast(b):
+    slot, tx, ty = _CAST.unpack(b)
+    return {"type": "cast", "slot": slot, "tx": _dq(tx), "ty": _dq(ty)}
+
+def _dec_fx(b):
+    slot, x, y, tx, ty, ms = _FX.unpack(b)
+    return {"type": "fx", "fx": "cast", "slot": slot, "x": _dq(x), "y": _dq(y),
+            "tx": _dq(tx), "ty": _dq(ty), "duration": ms / 1000.0}
+
+def _dec_ack(b):
+    return {"type": "ack", "seq": _ACK.unpack(b)[0]}
+
+def _dec_chunks(b):
+    (n,) = _U16.unpack_from(b, 0); off = _U16.size
+    lst = []
+    for _ in range(n):
+        cx, cy, ln = _CHUNK_HDR.unpack_from(b, off); off += _CHUNK_HDR.size
+        raw = b[off:off+ln]; off += ln
+        lst.append({"cx": cx, "cy": cy, "enc": "rle", "data": base64.b64encode(raw).decode("ascii")})
+    return {"type": "chunks", "list": lst}
+
+def _dec_state(b):
+    seq, base, flags = _STATE_HDR.unpack_from(b, 0); off = _STATE_HDR.size
+    o = {"type": "state", "seq": seq}
+    if flags & F_FULL: o["full"] = True
+    if base != NO_BASE: o["base"] = base
+    for kind in STATE_KINDS:
+        (n,) = _U16.unpack_from(b, off); off += _U16.size
+        ents = {}
+        for _ in range(n):
+            k, mask = _ENT_HDR.unpack_from(b, off); off += _ENT_HDR.size
+            e = {}
+            for i, (name, fmt) in enumerate(ENTITY_FIELDS[kind]):
+                if mask & (1 << i):
+                    st = _FIELD_STRUCT[fmt]
+                    (v,) = st.unpack_from(b, off); off += st.size
+                    e[name] = _dq(v) if fmt == "c" else v if fmt == "?" else _num(v)
+            if mask & REST_BIT:
+                (ln,) = _U16.unpack_from(b, off); off += _U16.size
+                e.update(json.loads(b[off:off+ln].decode("utf-8"))); off += ln
+            ents[str(k)] = e
+        o[kind] = ents
+    removed = {}
+    for kind in STATE_KINDS:
+        (n,) = _U16.unpack_from(b, off); off += _U16.size
+        if n:
+            removed[kind] = [str(_IDS.unpack_from(b, off + i*_IDS.size)[0]) for i in range(n)]
+        off += n * _IDS.size
+    if base != NO_BASE:
+        o["removed"] = removed
+    return o
+
+_DECODERS = {M_MOVE: _dec_move, M_CAST: _dec_cast, M_FX: _dec_fx, M_ACK: _dec_ack,
+             M_CHUNKS: _dec_chunks, M_STATE: _dec_state}
+
+# ---------- Trames ----------
+def encode(obj, proto=PROTO_JSON) -> bytes:
+    if proto == PROTO_BIN:
+        code, enc = _ENCODERS.get(obj.get("type"), (M_JSON, None))
+        body = None
+        if enc is not None:
+            try: body = enc(obj)
+            except (KeyError, TypeError, ValueError, OverflowError, struct.error): body = None
+        if body is None:
+            code, body = M_JSON, _dumps(obj).encode("utf-8")
+        return _FRAME.pack(len(body) + 1) + bytes((code,)) + body
+    return (_dumps(obj) + "\n").encode("utf-8")
+
+def decode_frame(body: bytes):
+    """Décode le corps d'une trame bin1; ValueError si illisible (code inconnu, charge tronquée)."""
+    code = body[0]
+    if code == M_JSON:
+        return json.loads(body[1:].decode("utf-8"))
+    try:
+        return _DECODERS[code](body[1:])
+    except (KeyError, IndexError, struct.error) as e:
+        raise ValueError(f"trame bin1 illisible (code {code}): {e}") from None
+
+def read_msg(f):
+    """Lit le prochain message (JSON ligne ou trame bin1) depuis un fichier binaire bufferisé.
+    Renvoie None en fin de flux; les lignes JSON et trames bin1 illisibles sont ignorées."""
+    while True:
+        b = f.read(1)
+        if not b:
+            return None
+        if b == b"{":
+            line = b + f.readline()
+            try: return json.loads(line)
+            except ValueError: continue
+        if b in b" \t\r\n":
+            continue
+        hdr = b + f.read(3)
+        if len(hdr) < 4:
+            return None
+        n = _FRAME.unpack(hdr)[0]
+        if not 0 < n <= MAX_FRAME:
+            return None  # flux désynchronisé: on coupe
+        body = f.read(n)
+        if len(body) < n:
+            return None
+        try: return decode_frame(body)
+        except ValueError: continue  # longueur connue: le flux reste synchronisé
+
+async def read_msg_async(reader):
+    """Équivalent de read_msg pour un asyncio.StreamReader (IncompleteReadError en fin de trame tronquée)."""
+    while True:
+        b = await reader.read(1)
+        if not b:
+            return None
+        if b == b"{":
+            line = b + await reader.readline()
+            try: return json.loads(line)
+            except ValueError: continue
+        if b in b" \t\r\n":
+            continue
+        n = _FRAME.unpack(b + await reader.readexactly(3))[0]
+        if not 0 < n <= MAX_FRAME:
+            return None
+        body = await reader.readexactly(n)
+        try: return decode_frame(body)
+        except ValueError: continue
+
+async def read_raw_async(reader):
+    """Comme read_msg_async mais renvoie la trame brute complète (ligne JSON ou en-tête + corps
+    bin1), pour relayer un flux sans le redécoder (router.py)."""
+    while True:
+        b = await reader.read(1)
+        if not b:
+            return None
+        if b == b"{":
+            return b + await reader.readline()
+        if b in b" \t\r\n":
+            continue
+        hdr = b + await reader.readexactly(3)
+        n = _FRAME.unpack(hdr)[0]
+        if not 0 < n <= MAX_FRAME:
+            return None
+        return hdr + await reader.readexactly(n)
+
+def raw_json(raw: bytes, prefix: bytes = b""):
+    """Message porté par une trame brute s'il voyage en JSON (ligne ou code M_JSON) et que son
+    texte commence par prefix; None pour les trames binaires (ou un autre préfixe)."""
+    if raw[:1] == b"{":
+        body = raw
+    elif len(raw) > 4 and raw[4] == M_JSON:
+        body = raw[5:]
+    else:
+        return None
+    if not body.startswith(prefix):
+        return None
+    try:
+        o = json.loads(body)
+    except ValueError:
+        return None
+    return o if isinstance(o, dict) else None